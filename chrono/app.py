@@ -1,18 +1,161 @@
+import json
 import os
-from flask import Flask
+import threading
+from flask import Flask, jsonify, request
 from dotenv import load_dotenv
+from elastic_transport import TransportError
+from elasticsearch import ApiError
 
 from course import course
+from course_cache import course_cache
+from course_engine import COURSE_ENGINE_ENABLED, load_course_engine
+from elasticsearch_setup import client
+from metrics import begin_request, finish_request, render_metrics, slow_queries
+from profiling import is_admin
+from propagation import course_propagator
+from resilience import (
+    STALE_WARNING,
+    CircuitOpenError,
+    breaker,
+    health_cache,
+    is_unavailable,
+    last_known_good,
+    reset_stale,
+    served_stale,
+)
+from search import search
+from search_cache import facet_cache, search_cache
 from timetable import timetable
+from write_queue import WRITE_BEHIND, write_queue
 
 load_dotenv()
 
 app = Flask(__name__)
 
 app.config['REFRESH_SETTING'] = os.getenv('REFRESH_SETTING', 'wait_for')
+app.config['BULK_CHUNK_SIZE'] = int(os.getenv('BULK_CHUNK_SIZE', 500))
+app.config['CURSOR_KEEP_ALIVE'] = os.getenv('CURSOR_KEEP_ALIVE', '5m')
+app.config['BATCH_MAX_SEARCHES'] = int(os.getenv('BATCH_MAX_SEARCHES', 20))
+app.config['EXPORT_PAGE_SIZE'] = int(os.getenv('EXPORT_PAGE_SIZE', 1000))
+app.config['COMBINATIONS_MAX_RESULTS'] = int(os.getenv('COMBINATIONS_MAX_RESULTS', 500))
+app.config['COMBINATIONS_MAX_PICKS'] = int(os.getenv('COMBINATIONS_MAX_PICKS', 100000))
+# Required in `X-Admin-Token` by the admin endpoints and `profile=1`, which are disabled when unset
+app.config['ADMIN_TOKEN'] = os.getenv('ADMIN_TOKEN')
+# Path of a JSONL file every request is appended to, for `benchmark.py replay`
+app.config['RECORD_TRAFFIC'] = os.getenv('RECORD_TRAFFIC')
+
+if COURSE_ENGINE_ENABLED:
+    load_course_engine()
 
 app.register_blueprint(course, url_prefix="/course")
 app.register_blueprint(timetable, url_prefix="/timetable")
+app.register_blueprint(search, url_prefix="/search")
+
+
+@app.before_request
+def start_request_timer():
+    begin_request(request.url_rule.rule if request.url_rule else "unmatched", request.args)
+    reset_stale()
+
+
+@app.after_request
+def add_server_timing(response):
+    server_timing = finish_request(request.method, response.status_code)
+    if server_timing:
+        response.headers["Server-Timing"] = server_timing
+    if served_stale():
+        response.headers["Warning"] = STALE_WARNING
+    return response
+
+
+@app.errorhandler(ApiError)
+@app.errorhandler(TransportError)
+@app.errorhandler(CircuitOpenError)
+def elasticsearch_unavailable(e):
+    # As in `asgi.py`: only errors meaning Elasticsearch is down or overloaded are a 503
+    if not is_unavailable(e):
+        raise e
+    return jsonify({"error": "Search is temporarily unavailable"}), 503
+
+
+_record_lock = threading.Lock()
+
+
+@app.after_request
+def record_traffic(response):
+    if not app.config['RECORD_TRAFFIC']:
+        return response
+    entry = {"method": request.method, "path": request.path, "query": request.args.to_dict(flat=False)}
+    # The raw body, since handlers modify the parsed one in place. Streamed
+    # NDJSON bodies (the bulk endpoints) are consumed by then and not recorded
+    if request.is_json:
+        try:
+            entry["body"] = json.loads(request.get_data())
+        except ValueError:
+            pass
+    append_traffic(entry)
+    return response
+
+
+def append_traffic(entry):
+    """Append a request to the `RECORD_TRAFFIC` file, also used by the routes `asgi.py` serves itself."""
+    with _record_lock:
+        with open(app.config['RECORD_TRAFFIC'], "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+def check_health():
+    try:
+        res = client.options(request_timeout=1).cluster.health(timeout="1s")
+    except Exception as e:
+        if not is_unavailable(e):
+            raise
+        return {"status": "unavailable"}
+    return {"status": res["status"], "nodes": res["number_of_nodes"]}
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    # Cached, so that frequent probes cost Elasticsearch at most one call per HEALTH_CACHE_TTL
+    health = dict(health_cache.get_or_set("health", check_health), breaker=breaker.state)
+    healthy = health["status"] in ["green", "yellow"] and health["breaker"] != "open"
+    return jsonify(health), 200 if healthy else 503
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    stats = {
+        "search_cache": search_cache.stats(),
+        "facet_cache": facet_cache.stats(),
+        "course_cache": course_cache.stats(),
+        "propagation": course_propagator.stats(),
+        "breaker": breaker.stats(),
+        "last_known_good": last_known_good.stats(),
+    }
+    if WRITE_BEHIND:
+        stats["write_queue"] = write_queue.stats()
+    return jsonify(stats), 200
+
+
+@app.route("/admin/slow-queries", methods=["GET"])
+def slow_query_log():
+    if not is_admin(request):
+        return jsonify({"error": "Admin token required"}), 403
+    return jsonify({"threshold_ms": slow_queries.threshold * 1000, "queries": slow_queries.summary()}), 200
+
+
+@app.route("/flush", methods=["POST"])
+def flush():
+    if not WRITE_BEHIND:
+        return jsonify({"error": "Write-behind mode is not enabled"}), 400
+    write_queue.flush()
+    return jsonify(write_queue.stats()), 200
+
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=os.getenv("CHRONO_PORT"), debug=True)
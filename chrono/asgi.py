@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from elasticsearch import AsyncElasticsearch
+from werkzeug.datastructures import MultiDict
+
+from app import app as flask_app
+from app import append_traffic
+from course import (
+    course_field_presets,
+    course_search_cache_key,
+    course_search_params,
+    course_search_results,
+    course_suggest_cache_key,
+    course_suggest_params,
+    course_suggest_results,
+    get_course_queries,
+    get_suggest_args,
+    search_courses,
+)
+from course_engine import course_engine
+from elasticsearch_setup import CLIENT_OPTIONS
+from metrics import begin_request, finish_request, record_took, stage
+from profiling import wants_profile
+from resilience import (
+    SEARCH_TIMEOUT,
+    STALE_WARNING,
+    breaker,
+    is_unavailable,
+    reset_stale,
+    served_stale,
+    with_fallback_async,
+)
+from search_cache import facet_cache, search_cache
+from timetable import (
+    get_timetable_queries,
+    timetable_facet_cache_key,
+    timetable_facet_params,
+    timetable_facet_results,
+    timetable_field_presets,
+    timetable_search_cache_key,
+    timetable_search_params,
+    timetable_search_results,
+)
+from utils import parse_source_filter
+
+# Serves the search endpoints natively on the event loop with AsyncElasticsearch
+# and hands every other request to the Flask app in a thread.
+async_client = AsyncElasticsearch(os.getenv("ELASTIC_URL"), **CLIENT_OPTIONS)
+wsgi_app = WsgiToAsgi(flask_app)
+
+_inflight = {}
+
+
+async def cached_search(key, get_params, format_results, cache=search_cache):
+    return await with_fallback_async(key, lambda: _cached_search(key, get_params, format_results, cache))
+
+
+async def _cached_search(key, get_params, format_results, cache):
+    results = cache.get(key)
+    if results is not None:
+        return results
+
+    task = _inflight.get(key)
+    if task is None:
+
+        async def run():
+            with stage("build"):
+                # In a thread: picking the timetable partitions to search may list
+                # them with the sync client, which must not block the event loop
+                params = await asyncio.to_thread(get_params)
+            with stage("es"):
+                res = await breaker.call_async(async_client.options(request_timeout=SEARCH_TIMEOUT).search, **params)
+            record_took(res)
+            with stage("hits"):
+                results = format_results(res)
+            cache.set(key, results)
+            return results
+
+        task = _inflight[key] = asyncio.ensure_future(run())
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+
+    # Shielded so that a client disconnecting does not cancel the search for others
+    return await asyncio.shield(task)
+
+
+async def search_course(args):
+    if wants_profile(args):
+        # Admin only, checked and run by the Flask view
+        return None
+
+    queries = get_course_queries(args)
+
+    if not any(queries.values()):
+        return {"error": "At least one valid query parameter required"}, 400
+
+    source = parse_source_filter(args.get("fields", type=str), course_field_presets)
+
+    if course_engine.ready:
+        # In-memory and fast enough to answer without leaving the event loop
+        return search_courses(queries, source), 200
+
+    search_results = await cached_search(
+        course_search_cache_key(queries, source),
+        lambda: course_search_params(queries, source),
+        course_search_results,
+    )
+    return search_results, 200
+
+
+async def suggest_course(args):
+    prefix, size = get_suggest_args(args)
+    if not prefix:
+        return {"error": "Query parameter `query` required"}, 400
+
+    suggestions = await cached_search(
+        course_suggest_cache_key(prefix, size),
+        lambda: course_suggest_params(prefix, size),
+        course_suggest_results,
+    )
+    return suggestions, 200
+
+
+async def search_timetable(args):
+    if "cursor" in args or wants_profile(args):
+        # Cursor pages and profiles are not cached, let the Flask view run them
+        return None
+    if args.get("noClashWith"):
+        # Its course is read with the sync client, which must not block the event loop
+        return None
+
+    start = args.get("from", type=int)
+    if start is None:
+        start = 0
+
+    queries = get_timetable_queries(args)
+    source = parse_source_filter(args.get("fields", type=str), timetable_field_presets)
+
+    search_results = await cached_search(
+        timetable_search_cache_key(queries, start, source),
+        lambda: timetable_search_params(queries, start, source),
+        timetable_search_results,
+    )
+    return search_results, 200
+
+
+async def timetable_facets(args):
+    if args.get("noClashWith"):
+        return None
+    start = args.get("from", default=0, type=int)
+    hits = args.get("hits") == "true"
+    queries = get_timetable_queries(args)
+    source = parse_source_filter(args.get("fields", type=str), timetable_field_presets)
+
+    results = await cached_search(
+        timetable_facet_cache_key(queries, start, hits, source),
+        lambda: timetable_facet_params(queries, start, hits, source),
+        lambda res: timetable_facet_results(res, hits),
+        cache=facet_cache,
+    )
+    return results, 200
+
+
+routes = {
+    "/course/search": search_course,
+    "/course/suggest": suggest_course,
+    "/timetable/search": search_timetable,
+    "/timetable/facets": timetable_facets,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+
+    handler = None
+    if scope["type"] == "http" and scope["method"] == "GET":
+        handler = routes.get(scope["path"])
+    if handler is None:
+        await wsgi_app(scope, receive, send)
+        return
+
+    args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+    begin_request(scope["path"], args)
+    reset_stale()
+    try:
+        response = await handler(args)
+    except Exception as e:
+        if is_unavailable(e):
+            response = {"error": "Search is temporarily unavailable"}, 503
+        else:
+            flask_app.logger.exception(f"Exception on {scope['path']} [GET]")
+            response = {"error": "Internal server error"}, 500
+
+    if response is None:
+        await wsgi_app(scope, receive, send)
+        return
+
+    if flask_app.config['RECORD_TRAFFIC']:
+        await asyncio.to_thread(
+            append_traffic, {"method": "GET", "path": scope["path"], "query": args.to_dict(flat=False)}
+        )
+
+    body, status = response
+
+    with stage("serialize"):
+        payload = json.dumps(body, sort_keys=True).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(payload)).encode()),
+    ]
+    server_timing = finish_request("GET", status)
+    if server_timing:
+        headers.append((b"server-timing", server_timing.encode()))
+    if served_stale():
+        headers.append((b"warning", STALE_WARNING.encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,323 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+# The in-process app never connects, but the client is still constructed on import
+os.environ.setdefault("ELASTIC_URL", "http://localhost:9200")
+os.environ.setdefault("ELASTIC_USERNAME", "elastic")
+os.environ.setdefault("ELASTIC_PASSWORD", "benchmark")
+
+import elasticsearch_setup
+from fake_elasticsearch import FakeElasticsearch
+
+# Load test and replay benchmark:
+#
+#   python benchmark.py replay traffic.jsonl [--target URL] [--concurrency N] [--rate R]
+#   python benchmark.py synthetic [--requests N] [--latency S] [--max-p95-ms MS] [--cache]
+#
+# Traffic is recorded by running the service with RECORD_TRAFFIC=traffic.jsonl,
+# one JSON request per line. Without `--target`, requests are replayed against
+# the app in-process, backed by FakeElasticsearch seeded with synthetic courses
+# and timetables, so runs are repeatable and need no cluster. `synthetic` does
+# the same with generated search traffic and exits non-zero when any endpoint's
+# p95 is over `--max-p95-ms`, for use in CI. It runs without the search caches
+# unless given `--cache`, since its repeated searches would mostly be cache hits.
+
+DEPARTMENTS = ["CS", "MATH", "PHY", "CHEM", "ECON", "EEE", "MECH", "BIO", "HSS", "BITS"]
+WORDS = [
+    "Data", "Structures", "Algorithms", "Systems", "Theory", "Design", "Analysis", "Networks",
+    "Signals", "Mechanics", "Organic", "Economics", "Principles", "Applied", "Digital", "Thermo",
+]
+INSTRUCTORS = [f"{first} {last}" for first in ["Anil", "Priya", "Ravi", "Sneha", "Vikram", "Meera"]
+               for last in ["Sharma", "Rao", "Iyer", "Gupta", "Reddy"]]
+DAYS = ["M", "T", "W", "Th", "F", "S"]
+DEGREES = ["A1", "A3", "A4", "A7", "A8", "AA", "B1", "B3", "B5"]
+TIMESTAMP = "2024-07-01T00:00:00.000Z"
+
+
+def synthetic_courses(count, seed=0):
+    rng = random.Random(seed)
+    courses = []
+    for i in range(count):
+        dept = DEPARTMENTS[i % len(DEPARTMENTS)]
+        code = f"{dept} F{100 + i // len(DEPARTMENTS)}"
+        sections = []
+        for number, kind in enumerate(["L", "L", "T", "P"], start=1):
+            sections.append(
+                {
+                    "id": f"section-{i}-{number}",
+                    "courseId": f"course-{i}",
+                    "type": kind,
+                    "number": number,
+                    "instructors": rng.sample(INSTRUCTORS, 2),
+                    "roomTime": [f"{code}:F10{number}:{day}:{rng.randint(1, 12)}" for day in rng.sample(DAYS, 3)],
+                    "createdAt": TIMESTAMP,
+                }
+            )
+        courses.append(
+            {
+                "id": f"course-{i}",
+                "code": code,
+                "name": " ".join(rng.sample(WORDS, 3)),
+                "sections": sections,
+                "midsemStartTime": None,
+                "midsemEndTime": None,
+                "compreStartTime": None,
+                "compreEndTime": None,
+                "archived": False,
+                "acadYear": 2024,
+                "semester": 1,
+                "createdAt": TIMESTAMP,
+            }
+        )
+    return courses
+
+
+def synthetic_timetables(count, courses, seed=0):
+    rng = random.Random(seed)
+    timetables = []
+    for i in range(count):
+        picked = rng.sample(courses, 5)
+        timetables.append(
+            {
+                "id": f"timetable-{i}",
+                "authorId": f"f2021{i:04d}",
+                "name": f"Timetable {i}",
+                "degrees": rng.sample(DEGREES, rng.randint(1, 2)),
+                "private": False,
+                "draft": False,
+                "archived": False,
+                "year": rng.randint(1, 4),
+                "acadYear": 2024,
+                "semester": 1,
+                "sections": [rng.choice(course["sections"]) for course in picked],
+                "timings": [],
+                "examTimes": [],
+                "warnings": [],
+                "createdAt": TIMESTAMP,
+                "lastUpdated": TIMESTAMP,
+            }
+        )
+    return timetables
+
+
+def synthetic_traffic(count, courses, seed=0):
+    rng = random.Random(seed)
+    traffic = []
+    for _ in range(count):
+        course = rng.choice(courses)
+        kind = rng.random()
+        if kind < 0.15:
+            word = rng.choice(course["name"].split())
+            entry = {"path": "/course/suggest", "query": {"query": word[: rng.randint(1, len(word))]}}
+        elif kind < 0.3:
+            entry = {"path": "/course/search", "query": {"query": rng.choice([course["code"], course["code"].split()[0]])}}
+        elif kind < 0.45:
+            entry = {"path": "/course/search", "query": {"name": rng.choice(course["name"].split())}}
+        elif kind < 0.55:
+            entry = {"path": "/course/search", "query": {"instructor": rng.choice(INSTRUCTORS).split()[0]}}
+        elif kind < 0.8:
+            entry = {"path": "/timetable/search", "query": {"degree": rng.choice(DEGREES), "year": rng.randint(1, 4)}}
+        elif kind < 0.85:
+            entry = {"path": "/timetable/facets", "query": {"degree": rng.choice(DEGREES)}}
+        else:
+            entry = {"path": "/timetable/search", "query": {"query": course["code"], "from": rng.choice([0, 12])}}
+        traffic.append({"method": "GET", **entry})
+    return traffic
+
+
+def load_traffic(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def in_process_app(latency, jitter, courses, timetables, cache):
+    """Return the app, backed by a FakeElasticsearch seeded through the bulk endpoints, and the fake."""
+    fake = FakeElasticsearch(latency=latency, jitter=jitter)
+    # Swapped before the app is imported, so every module that does
+    # `from elasticsearch_setup import client` gets the fake
+    elasticsearch_setup.client = fake
+    from app import app
+    from search_cache import facet_cache, search_cache
+
+    if not cache:
+        search_cache.maxsize = facet_cache.maxsize = 0
+    test_client = app.test_client()
+    for path, documents in [("/course/bulk", courses), ("/timetable/bulk", timetables)]:
+        body = "\n".join(json.dumps(document) for document in documents)
+        res = test_client.post(path, data=body, content_type="application/x-ndjson")
+        if res.json["errors"]:
+            raise RuntimeError(f"seeding {path} failed: {res.json['errors'][:3]}")
+    fake.latency, fake.calls = latency, {}
+    return app, fake
+
+
+def http_sender(target):
+    import requests
+
+    local = threading.local()
+
+    def send(entry):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        res = local.session.request(
+            entry.get("method", "GET"),
+            target + entry["path"],
+            params=entry.get("query"),
+            json=entry.get("body"),
+            timeout=30,
+        )
+        return res.status_code
+
+    return send
+
+
+def app_sender(app):
+    def send(entry):
+        with app.test_client() as test_client:
+            res = test_client.open(
+                entry["path"],
+                method=entry.get("method", "GET"),
+                query_string=entry.get("query"),
+                json=entry.get("body"),
+            )
+            return res.status_code
+
+    return send
+
+
+def replay(traffic, send, concurrency=8, rate=0.0):
+    """
+    Send `traffic` from `concurrency` threads, at most `rate` requests per
+    second overall when `rate` is set, and return `{endpoint: [(seconds, status)]}`
+    and the wall-clock duration.
+    """
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    position = iter(range(len(traffic)))
+    started = time.perf_counter()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(position, None)
+            if i is None:
+                return
+            if rate:
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            entry = traffic[i]
+            request_started = time.perf_counter()
+            try:
+                status = send(entry)
+            except Exception:
+                status = 599
+            elapsed = time.perf_counter() - request_started
+            with lock:
+                samples[f"{entry.get('method', 'GET')} {entry['path']}"].append((elapsed, status))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def summarize(samples, duration):
+    report = {}
+    for endpoint, values in sorted(samples.items()):
+        latencies = sorted(seconds for seconds, _ in values)
+        report[endpoint] = {
+            "requests": len(values),
+            "errors": sum(1 for _, status in values if status >= 500),
+            "throughput": len(values) / duration if duration else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+    return report
+
+
+def print_report(report, duration):
+    print(f"{'endpoint':<28}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, row in report.items():
+        print(
+            f"{endpoint:<28}{row['requests']:>10}{row['errors']:>8}{row['throughput']:>10.1f}"
+            f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+        )
+    print(f"{sum(row['requests'] for row in report.values())} requests in {duration:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded or synthetic traffic and report latency per endpoint")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    replay_parser = subparsers.add_parser("replay", help="replay traffic recorded with RECORD_TRAFFIC")
+    replay_parser.add_argument("traffic")
+    replay_parser.add_argument("--target", help="base URL of a running service, instead of the in-process app")
+    synthetic_parser = subparsers.add_parser("synthetic", help="replay generated search traffic in-process")
+    synthetic_parser.add_argument("--requests", type=int, default=2000)
+    synthetic_parser.add_argument("--max-p95-ms", type=float, help="fail when an endpoint's p95 is over this")
+    for subparser in [replay_parser, synthetic_parser]:
+        subparser.add_argument("--concurrency", type=int, default=8)
+        subparser.add_argument("--rate", type=float, default=0.0, help="requests per second, unlimited when 0")
+        subparser.add_argument("--latency", type=float, default=0.002, help="seconds added to every fake Elasticsearch call")
+        subparser.add_argument("--jitter", type=float, default=0.001)
+        subparser.add_argument("--courses", type=int, default=1000)
+        subparser.add_argument("--timetables", type=int, default=2000)
+        subparser.add_argument(
+            "--cache",
+            action=argparse.BooleanOptionalAction,
+            default=subparser is replay_parser,
+            help="use the search cache, reporting its hits and misses",
+        )
+        subparser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    courses = synthetic_courses(args.courses)
+    if args.command == "replay":
+        traffic = load_traffic(args.traffic)
+    else:
+        traffic = synthetic_traffic(args.requests, courses)
+
+    if getattr(args, "target", None):
+        send = http_sender(args.target.rstrip("/"))
+    else:
+        app, fake = in_process_app(
+            args.latency, args.jitter, courses, synthetic_timetables(args.timetables, courses), args.cache
+        )
+        send = app_sender(app)
+
+    samples, duration = replay(traffic, send, args.concurrency, args.rate)
+    report = summarize(samples, duration)
+    caches = {}
+    if args.cache and not getattr(args, "target", None):
+        from search_cache import facet_cache, search_cache
+
+        # The latencies mix both, a hit rate near 1 means Elasticsearch was barely exercised
+        caches = {
+            name: {"hits": cache.hits, "misses": cache.misses}
+            for name, cache in [("search", search_cache), ("facets", facet_cache)]
+        }
+    if args.json:
+        print(json.dumps({**report, "cache": caches} if caches else report, indent=2))
+    else:
+        print_report(report, duration)
+        for name, counts in caches.items():
+            print(f"{name} cache: {counts['hits']} hits, {counts['misses']} misses")
+
+    if getattr(args, "max_p95_ms", None) is not None:
+        slow = [endpoint for endpoint, row in report.items() if row["p95_ms"] > args.max_p95_ms]
+        if slow:
+            raise SystemExit(f"p95 over {args.max_p95_ms} ms: {', '.join(slow)}")
@@ -0,0 +1,66 @@
+import timeit
+
+from course import course_schema, course_validator
+from jsonschema import validate
+from timetable import timetable_schema, timetable_validator
+from utils import validate_with
+
+# Micro-benchmark of request validation: python benchmark_validation.py
+
+section = {
+    "id": "section-1",
+    "courseId": "course-1",
+    "type": "L",
+    "number": 1,
+    "instructors": ["Instructor One", "Instructor Two"],
+    "roomTime": ["CS F211:F105:M:2", "CS F211:F105:W:2", "CS F211:F105:F:2"],
+    "createdAt": "2024-07-01T00:00:00.000Z",
+}
+
+course_data = {
+    "id": "course-1",
+    "code": "CS F211",
+    "name": "Data Structures and Algorithms",
+    "sections": [dict(section, id=f"section-{i}", number=i) for i in range(1, 9)],
+    "midsemStartTime": "2024-10-01T09:00:00.000Z",
+    "midsemEndTime": "2024-10-01T10:30:00.000Z",
+    "compreStartTime": "2024-12-01T09:00:00.000Z",
+    "compreEndTime": "2024-12-01T12:00:00.000Z",
+    "archived": False,
+    "acadYear": 2024,
+    "semester": 1,
+    "createdAt": "2024-07-01T00:00:00.000Z",
+}
+
+timetable_data = {
+    "id": "timetable-1",
+    "authorId": "f20210001",
+    "name": "Timetable",
+    "degrees": ["A7"],
+    "private": False,
+    "draft": False,
+    "archived": False,
+    "year": 2,
+    "acadYear": 2024,
+    "semester": 1,
+    "sections": [dict(section, id=f"section-{i}", courseId=f"course-{i}") for i in range(1, 8)],
+    "timings": ["CS F211:F105:M:2"] * 20,
+    "examTimes": ["CS F211|2024-10-01T09:00:00.000Z|2024-10-01T10:30:00.000Z"] * 7,
+    "warnings": [],
+    "createdAt": "2024-07-01T00:00:00.000Z",
+    "lastUpdated": "2024-07-01T00:00:00.000Z",
+}
+
+
+def per_call_microseconds(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+if __name__ == "__main__":
+    for name, instance, schema, validator in [
+        ("course", course_data, course_schema, course_validator),
+        ("timetable", timetable_data, timetable_schema, timetable_validator),
+    ]:
+        before = per_call_microseconds(lambda: validate(instance=instance, schema=schema), 200)
+        after = per_call_microseconds(lambda: validate_with(validator, instance), 200)
+        print(f"{name}: jsonschema.validate {before:.1f} us/doc, precompiled {after:.1f} us/doc ({before / after:.1f}x)")
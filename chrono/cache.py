@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache holding at most `maxsize` entries, each of which
+    expires `ttl` seconds after it was set.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.collapsed = 0
+
+    def get(self, key, default=None):
+        return self._get(key, default, count=True)
+
+    def _get(self, key, default, count):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += count
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += count
+                return default
+            self._data.move_to_end(key)
+            self.hits += count
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, key, compute):
+        """
+        Return the cached value for `key`, calling `compute` to fill it on a
+        miss. Concurrent misses for the same key wait for the first caller's
+        result instead of computing it again.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            event.wait()
+            # Already counted as a miss (and as collapsed) above
+            value = self._get(key, _MISSING, count=False)
+            # The leader failed or its result was already evicted
+            return compute() if value is _MISSING else value
+
+        try:
+            value = compute()
+            self.set(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "collapsed": self.collapsed,
+        }
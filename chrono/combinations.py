@@ -0,0 +1,88 @@
+from slots import from_hex, mask_of
+
+
+def section_mask(section):
+    # Courses indexed before masks were stored have only `time`
+    if "mask" in section:
+        return from_hex(section["mask"])
+    return mask_of(section["time"])
+
+
+def section_groups(courses, blocked=0, instructors=()):
+    """
+    Group the sections of `courses` by course and section type, one of each
+    to be picked, as `[(masks, sections)]`. Sections meeting in a `blocked`
+    slot are left out, and those taught by one of `instructors` come first.
+    """
+    preferred = {instructor.lower() for instructor in instructors}
+    groups = {}
+    for course in courses:
+        for section in course["sections"]:
+            mask = section_mask(section)
+            if mask & blocked:
+                continue
+            groups.setdefault((course["id"], section["type"]), []).append((mask, section))
+        for section_type in {section["type"] for section in course["sections"]}:
+            groups.setdefault((course["id"], section_type), [])
+
+    result = []
+    for options in groups.values():
+        options.sort(
+            key=lambda option: not any(
+                instructor.lower() in preferred for instructor in option[1]["instructors"]
+            )
+        )
+        result.append(([mask for mask, _ in options], [section for _, section in options]))
+    return result
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def enumerate_combinations(courses, blocked=0, instructors=(), limit=100, max_picks=None):
+    """
+    Yield up to `limit` clash-free picks of one section of every type of every
+    course in `courses`, as lists of sections, preferred instructors first.
+
+    Groups with the fewest options are picked first and, after every pick, the
+    search backs off as soon as a remaining group has no section left that fits
+    around the slots taken so far, so dead ends are cut before they are explored.
+    Some dead ends still take factorial time to rule out (more courses than
+    free slots for them), so the search raises BudgetExceeded once it has
+    tried `max_picks` sections.
+    """
+    groups = section_groups(courses, blocked, instructors)
+    if not groups or any(not masks for masks, _ in groups):
+        return
+    groups.sort(key=lambda group: len(group[0]))
+
+    found = 0
+    tried = 0
+    picked = []
+
+    def search(depth, occupied):
+        nonlocal found, tried
+        if depth == len(groups):
+            found += 1
+            yield list(picked)
+            return
+        masks, sections = groups[depth]
+        for mask, section in zip(masks, sections):
+            if mask & occupied:
+                continue
+            tried += 1
+            if max_picks is not None and tried > max_picks:
+                raise BudgetExceeded(f"Gave up after trying {max_picks} sections")
+            taken = occupied | mask
+            if not all(
+                any(not other & taken for other in later) for later, _ in groups[depth + 1 :]
+            ):
+                continue
+            picked.append(section)
+            yield from search(depth + 1, taken)
+            picked.pop()
+            if found >= limit:
+                return
+
+    yield from search(0, blocked)
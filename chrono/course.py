@@ -1,11 +1,48 @@
-from elasticsearch import NotFoundError
-from elasticsearch_setup import COURSE_INDEX, client, search_by_id
+import os
+
+from combinations import BudgetExceeded, enumerate_combinations
+from course_cache import invalidate_course
+from course_engine import course_engine, reload_course_engine_if_stale
+from elasticsearch import ConflictError, NotFoundError
+from elasticsearch_setup import (
+    COURSE_INDEX,
+    bulk_index,
+    client,
+    course_derived_fields,
+    get_by_ids,
+    iter_documents,
+)
 from flask import Blueprint, jsonify, request, current_app
-from jsonschema import ValidationError, validate
-from utils import remove_newline_chars
+from jsonschema import ValidationError
+from metrics import record_took, stage
+from profiling import is_admin, profile_search, wants_profile
+from propagation import course_propagator
+from resilience import with_fallback
+from search_cache import bump_generation, normalize_queries, search_cache, search_cache_key
+from slots import ROOM_TIME_PATTERN, SLOTS, mask_of
+from utils import (
+    compile_validator,
+    export_failure,
+    filter_source,
+    iter_ndjson_chunks,
+    parse_source_filter,
+    remove_newline_chars,
+    stream_ndjson,
+    validate_with,
+)
+from write_queue import WRITE_BEHIND, write_queue
 
 course = Blueprint("course", __name__)
 
+# Stored by `prepare_course` for the index and combinations, never returned unless asked for by name
+DERIVED_FIELDS = ["suggest", "slots", "mask", "sections.mask"]
+
+# `fields` presets for /course/search, mapping to `_source` filters
+course_field_presets = {
+    "full": {"excludes": DERIVED_FIELDS},
+    "summary": {"includes": ["id", "code", "name", "dept", "archived", "acadYear", "semester"]},
+}
+
 course_schema = {
     "type": "object",
     "properties": {
@@ -22,7 +59,7 @@ course_schema = {
                     "type": {"type": "string"},
                     "number": {"type": "integer"},
                     "instructors": {"type": "array", "items": {"type": "string"}},
-                    "roomTime": {"type": "array", "items": {"type": "string"}},
+                    "roomTime": {"type": "array", "items": {"type": "string", "pattern": ROOM_TIME_PATTERN}},
                     "createdAt": {"type": "string", "format": "date-time"},
                 },
                 "required": [
@@ -63,22 +100,50 @@ course_schema = {
     "additionalProperties": False,
 }
 
+course_validator = compile_validator(course_schema)
 
-@course.route("/search", methods=["GET"])
-def search_course():
-    queries = {
-        "query": request.args.get("query", type=str),
-        "name": request.args.get("name", type=str),
-        "code": request.args.get("code", type=str),
-        "dept": request.args.get("dept", type=str),
-        "instructors": request.args.getlist("instructor", type=str),
-        "time": request.args.getlist("time", type=str),
+COMBINATIONS_MAX_COURSES = int(os.getenv("COMBINATIONS_MAX_COURSES", 12))
+
+combinations_schema = {
+    "type": "object",
+    "properties": {
+        "courseIds": {
+            "type": "array",
+            "items": {"type": "string"},
+            "minItems": 1,
+            "maxItems": COMBINATIONS_MAX_COURSES,
+            "uniqueItems": True,
+        },
+        # `day:hour` slots no picked section may meet in
+        "blocked": {"type": "array", "items": {"type": "string"}},
+        # Sections taught by these are tried, and so listed, first
+        "instructors": {"type": "array", "items": {"type": "string"}},
+        "limit": {"type": "integer", "minimum": 1},
+    },
+    "required": ["courseIds"],
+    "additionalProperties": False,
+}
+
+combinations_validator = compile_validator(combinations_schema)
+
+
+def get_course_queries(args):
+    return {
+        "query": args.get("query", type=str),
+        "name": args.get("name", type=str),
+        "code": args.get("code", type=str),
+        "dept": args.get("dept", type=str),
+        "instructors": args.getlist("instructor", type=str),
+        "time": args.getlist("time", type=str),
+        "free": args.getlist("free", type=str),
+        "avoid": args.getlist("avoid", type=str),
     }
 
-    if not any(queries.values()):
-        return jsonify({"error": "At least one valid query parameter required"}), 400
 
+def build_course_query(queries):
     bool_must_queries = []
+    # Non-scoring, on the `slots` of all of a course's sections
+    bool_must_not_queries = []
 
     for key, value in queries.items():
         if not value:
@@ -192,34 +257,217 @@ def search_course():
                     }
                 }
             )
+        elif key == "free":
+            # Fits entirely inside the given slots: occupies none of the others
+            free = set(value)
+            bool_must_not_queries.append({"terms": {"slots": [slot for slot in SLOTS if slot not in free]}})
+        elif key == "avoid":
+            bool_must_not_queries.append({"terms": {"slots": value}})
+    if bool_must_not_queries:
+        return {"bool": {"must": bool_must_queries, "must_not": bool_must_not_queries}}
     if len(bool_must_queries) == 1:
-        elastic_query = bool_must_queries[0]
-    else:
-        elastic_query = {"bool": {"must": bool_must_queries}}
-
-    res = client.search(
-        index=COURSE_INDEX,
-        query=elastic_query,
-        size=10,
-    )
+        return bool_must_queries[0]
+    return {"bool": {"must": bool_must_queries}}
+
+
+def course_search_params(queries, source=True):
+    return {
+        "index": COURSE_INDEX,
+        "query": build_course_query(queries),
+        "source": source,
+        "size": 10,
+    }
+
+
+def course_search_results(res):
     search_results = []
     for hit in res["hits"].get("hits", []):
         search_results.append({"course": hit["_source"], "score": hit["_score"]})
+    return search_results
 
-    return jsonify(search_results), 200
 
+def search_courses(queries, source=True):
+    if course_engine.ready:
+        reload_course_engine_if_stale()
+        with stage("engine"):
+            return [
+                {"course": filter_source(result["course"], source), "score": result["score"]}
+                for result in course_engine.search(queries)
+            ]
+    with stage("build"):
+        params = course_search_params(queries, source)
+    with stage("es"):
+        res = client.search(**params)
+    record_took(res)
+    with stage("hits"):
+        return course_search_results(res)
 
-@course.route("/add", methods=["POST"])
-def add_course():
-    course_data = request.json
+
+def course_search_cache_key(queries, source=True):
+    return search_cache_key(
+        COURSE_INDEX, normalize_queries(queries, case_sensitive=["time", "free", "avoid"]), source=source
+    )
+
+
+def course_suggest_params(prefix, size):
+    return {
+        "index": COURSE_INDEX,
+        "suggest": {
+            "courses": {
+                "prefix": prefix,
+                "completion": {
+                    "field": "suggest",
+                    "size": size,
+                    "skip_duplicates": True,
+                    "fuzzy": {"fuzziness": "AUTO"},
+                },
+            }
+        },
+        "source": ["id", "code", "name"],
+        "size": 0,
+    }
+
+
+def course_suggest_results(res):
+    # A course matching through several inputs (its name and an instructor) is listed once
+    suggestions = {}
+    for option in res["suggest"]["courses"][0]["options"]:
+        suggestions.setdefault(option["_id"], option["_source"])
+    return list(suggestions.values())
+
+
+def get_suggest_args(args):
+    prefix = (args.get("query", type=str) or "").strip()
+    size = min(max(args.get("size", default=10, type=int), 1), 20)
+    return prefix, size
+
+
+def course_suggest_cache_key(prefix, size):
+    return search_cache_key(COURSE_INDEX, {"suggest": prefix.lower()}, size=size)
+
+
+def suggest_courses(prefix, size):
+    with stage("build"):
+        params = course_suggest_params(prefix, size)
+    with stage("es"):
+        res = client.search(**params)
+    record_took(res)
+    with stage("hits"):
+        return course_suggest_results(res)
+
+
+@course.route("/suggest", methods=["GET"])
+def suggest_course():
+    prefix, size = get_suggest_args(request.args)
+    if not prefix:
+        return jsonify({"error": "Query parameter `query` required"}), 400
+
+    key = course_suggest_cache_key(prefix, size)
+    suggestions = with_fallback(key, lambda: search_cache.get_or_set(key, lambda: suggest_courses(prefix, size)))
+
+    with stage("serialize"):
+        response = jsonify(suggestions)
+    return response, 200
+
+
+@course.route("/search", methods=["GET"])
+def search_course():
+    queries = get_course_queries(request.args)
+
+    if not any(queries.values()):
+        return jsonify({"error": "At least one valid query parameter required"}), 400
+
+    source = parse_source_filter(request.args.get("fields", type=str), course_field_presets)
+
+    if wants_profile(request.args):
+        # Always runs on Elasticsearch, even when the in-memory engine is loaded
+        if not is_admin(request):
+            return jsonify({"error": "Admin token required"}), 403
+        return jsonify(profile_search(course_search_params(queries, source), course_search_results)), 200
+
+    key = course_search_cache_key(queries, source)
+    search_results = with_fallback(key, lambda: search_cache.get_or_set(key, lambda: search_courses(queries, source)))
+
+    with stage("serialize"):
+        response = jsonify(search_results)
+    return response, 200
+
+
+def get_courses(course_ids):
+    """Return `{course_id: course}` for the given ids that exist, in a single multi-get."""
+    if course_engine.ready:
+        reload_course_engine_if_stale()
+        return {
+            course_id: course_engine.courses[course_id]
+            for course_id in course_ids
+            if course_id in course_engine.courses
+        }
+    with stage("es"):
+        docs = get_by_ids(COURSE_INDEX, course_ids, source=["id", "code", "sections"])
+    return {course_id: doc["_source"] for course_id, doc in docs.items()}
+
+
+@course.route("/combinations", methods=["POST"])
+def course_combinations():
+    data = request.json
     try:
-        validate(instance=course_data, schema=course_schema)
+        validate_with(combinations_validator, data)
     except ValidationError as e:
-        return jsonify({"error": "Invalid course data: " + e.message}), 400
+        return jsonify({"error": "Invalid request: " + e.message}), 400
 
-    if search_by_id(COURSE_INDEX, course_data["id"]):
-        return jsonify({"error": "Course already exists"}), 400
+    courses = get_courses(data["courseIds"])
+    missing = [course_id for course_id in data["courseIds"] if course_id not in courses]
+    if missing:
+        return jsonify({"error": "Courses not found", "ids": missing}), 404
+
+    max_results = current_app.config['COMBINATIONS_MAX_RESULTS']
+    limit = min(data.get("limit", max_results), max_results)
+    combinations = enumerate_combinations(
+        [courses[course_id] for course_id in data["courseIds"]],
+        blocked=mask_of(data.get("blocked", [])),
+        instructors=data.get("instructors", []),
+        limit=limit,
+        max_picks=current_app.config['COMBINATIONS_MAX_PICKS'],
+    )
+
+    # One line per combination, written as soon as it is found
+    return stream_ndjson(
+        (
+            {"sections": [{key: value for key, value in section.items() if key != "mask"} for section in sections]}
+            for sections in combinations
+        ),
+        lambda error, sent: str(error),
+        errors=BudgetExceeded,
+    )
 
+
+def export_course(course_data):
+    """Undo `prepare_course`, as far as it can be, for a course that `/course/add` accepts back."""
+    course_data = {key: value for key, value in course_data.items() if key not in ["dept", "suggest", "slots", "mask"]}
+    sections = []
+    for section in course_data["sections"]:
+        exported = {key: value for key, value in section.items() if key not in ["mask", "time"]}
+        # Only the day and hour of roomTime are stored: the room is left empty, which
+        # the schema accepts and `prepare_course` reduces to the same `time`
+        exported["roomTime"] = [f"{course_data['code']}::{slot}" for slot in section["time"]]
+        sections.append(exported)
+    course_data["sections"] = sections
+    return course_data
+
+
+@course.route("/export", methods=["GET"])
+def export_courses():
+    query = build_course_query(get_course_queries(request.args))
+    keep_alive = current_app.config['CURSOR_KEEP_ALIVE']
+    page_size = current_app.config['EXPORT_PAGE_SIZE']
+
+    return stream_ndjson(
+        (export_course(course_data) for course_data in iter_documents(COURSE_INDEX, query, keep_alive, page_size)),
+        export_failure,
+    )
+
+
+def prepare_course(course_data):
     course_data["dept"] = course_data["code"].split()[0]
 
     # Format roomTime to time and only include the last two parts of the string
@@ -229,10 +477,115 @@ def add_course():
             time.append(":".join(roomTime.split(":")[-2:]))
         section["time"] = time
 
-    course_data = remove_newline_chars(course_data)
-    client.index(index=COURSE_INDEX, body=course_data, refresh=current_app.config['REFRESH_SETTING'])
+    course_data.update(course_derived_fields(course_data))
+    return remove_newline_chars(course_data)
+
+
+def course_written(course_data):
+    invalidate_course(course_data["id"])
+    if course_engine.ready:
+        course_engine.add(course_data)
+    course_propagator.put(course_data["id"])
+
+
+def course_removed(course_id):
+    invalidate_course(course_id)
+    course_engine.remove(course_id)
+    course_propagator.put(course_id)
+
 
-    return jsonify(course_data), 201
+def apply_flushed_courses(ops):
+    ops = [op for op in ops if op["index"] == COURSE_INDEX]
+    for op in ops:
+        if op["op"] == "delete":
+            course_removed(op["id"])
+        else:
+            course_written(op["document"])
+    if ops:
+        bump_generation(COURSE_INDEX)
+
+
+write_queue.on_flush.append(apply_flushed_courses)
+
+
+@course.route("/add", methods=["POST"])
+def add_course():
+    course_data = request.json
+    try:
+        with stage("validate"):
+            validate_with(course_validator, course_data)
+    except ValidationError as e:
+        return jsonify({"error": "Invalid course data: " + e.message}), 400
+
+    with stage("prepare"):
+        course_data = prepare_course(course_data)
+
+    if WRITE_BEHIND:
+        wait = request.args.get("sync") == "true"
+        error = write_queue.put("create", COURSE_INDEX, course_data["id"], course_data, wait=wait)
+        if error and error["status"] == 409:
+            return jsonify({"error": "Course already exists"}), 400
+        if error:
+            return jsonify({"error": error["error"]}), 500
+        return jsonify(filter_source(course_data, course_field_presets["full"])), 201 if wait else 202
+
+    try:
+        with stage("es"):
+            client.index(
+                index=COURSE_INDEX,
+                id=course_data["id"],
+                body=course_data,
+                op_type="create",
+                refresh=current_app.config['REFRESH_SETTING'],
+            )
+    except ConflictError:
+        return jsonify({"error": "Course already exists"}), 400
+    course_written(course_data)
+    bump_generation(COURSE_INDEX)
+
+    return jsonify(filter_source(course_data, course_field_presets["full"])), 201
+
+
+@course.route("/bulk", methods=["POST"])
+def bulk_add_courses():
+    op_type = "index" if request.args.get("overwrite") == "true" else "create"
+    indexed = 0
+    errors = []
+    seen_ids = set()
+
+    for chunk in iter_ndjson_chunks(request.stream, current_app.config['BULK_CHUNK_SIZE']):
+        valid = []
+        for line_number, course_data, error in chunk:
+            if error is None:
+                try:
+                    validate_with(course_validator, course_data)
+                except ValidationError as e:
+                    error = "Invalid course data: " + e.message
+            if error is None and course_data["id"] in seen_ids:
+                error = "Duplicate course id in request"
+            if error is not None:
+                course_id = course_data.get("id") if isinstance(course_data, dict) else None
+                errors.append({"line": line_number, "id": course_id, "error": error})
+                continue
+            seen_ids.add(course_data["id"])
+            valid.append((line_number, course_data))
+
+        documents = [prepare_course(course_data) for _, course_data in valid]
+        for (line_number, _), document, error in zip(valid, documents, bulk_index(COURSE_INDEX, documents, op_type)):
+            if error is None:
+                course_written(document)
+                indexed += 1
+                continue
+            message = "Course already exists" if error["status"] == 409 else error["error"]
+            errors.append({"line": line_number, "id": document["id"], "error": message})
+
+    if indexed and current_app.config['REFRESH_SETTING'] != "false":
+        client.indices.refresh(index=COURSE_INDEX)
+    if indexed:
+        bump_generation(COURSE_INDEX)
+
+    errors.sort(key=lambda error: error["line"])
+    return jsonify({"indexed": indexed, "errors": errors}), 200
 
 
 @course.route("/remove", methods=["DELETE"])
@@ -241,13 +594,21 @@ def remove_course():
     if not course_id or not isinstance(course_id, str):
         return jsonify({"error": "Invalid course id"}), 400
 
-    search_res = search_by_id(COURSE_INDEX, course_id)
-    if not search_res:
-        return jsonify({"error": "Course not found"}), 404
+    if WRITE_BEHIND:
+        wait = request.args.get("sync") == "true"
+        error = write_queue.put("delete", COURSE_INDEX, course_id, wait=wait)
+        if error and error["status"] == 404:
+            return jsonify({"error": "Course not found"}), 404
+        if error:
+            return jsonify({"error": error["error"]}), 500
+        return jsonify(), 204 if wait else 202
 
     try:
-        client.delete(index=COURSE_INDEX, id=search_res["_id"], refresh=current_app.config['REFRESH_SETTING'])
+        with stage("es"):
+            client.delete(index=COURSE_INDEX, id=course_id, refresh=current_app.config['REFRESH_SETTING'])
     except NotFoundError:
         return jsonify({"error": "Course not found"}), 404
+    course_removed(course_id)
+    bump_generation(COURSE_INDEX)
 
     return jsonify(), 204
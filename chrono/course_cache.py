@@ -0,0 +1,60 @@
+import os
+import threading
+
+from cache import TTLCache
+from elasticsearch import helpers
+from elasticsearch_setup import COURSE_INDEX, client, get_by_ids
+
+# Process-local `{course_id: {"code", "name"}}` used to denormalize timetables
+course_cache = TTLCache(
+    maxsize=int(os.getenv("COURSE_CACHE_SIZE", 5000)),
+    ttl=int(os.getenv("COURSE_CACHE_TTL", 3600)),
+)
+
+_warm_lock = threading.Lock()
+_warmed = False
+
+
+def warm_course_cache():
+    global _warmed
+    with _warm_lock:
+        if _warmed:
+            return
+        hits = helpers.scan(
+            client,
+            index=COURSE_INDEX,
+            query={"query": {"match_all": {}}, "_source": ["code", "name"]},
+        )
+        for count, hit in enumerate(hits):
+            if count >= course_cache.maxsize:
+                break
+            course_cache.set(hit["_id"], hit["_source"])
+        _warmed = True
+
+
+def get_course_summaries(course_ids):
+    """
+    Return `{course_id: {"code", "name"}}` for the given ids, leaving out
+    courses that do not exist. Ids missing from the cache are fetched with a
+    single multi-get.
+    """
+    warm_course_cache()
+
+    summaries = {}
+    misses = []
+    for course_id in course_ids:
+        summary = course_cache.get(course_id)
+        if summary is None:
+            misses.append(course_id)
+        else:
+            summaries[course_id] = summary
+
+    for course_id, doc in get_by_ids(COURSE_INDEX, misses, source=["code", "name"]).items():
+        course_cache.set(course_id, doc["_source"])
+        summaries[course_id] = doc["_source"]
+
+    return summaries
+
+
+def invalidate_course(course_id):
+    course_cache.pop(course_id)
@@ -0,0 +1,362 @@
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from elasticsearch import Elasticsearch, helpers
+from elasticsearch_setup import CLIENT_OPTIONS, COURSE_INDEX, client
+from slots import SLOTS, course_mask, mask_of
+
+
+def analyze(text):
+    # Close enough to the standard analyzer used by `name` and `sections.instructors`
+    return re.findall(r"\w+", text.lower())
+
+
+def trigrams(term):
+    padded = f"  {term}  "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def auto_fuzziness(term):
+    if len(term) <= 2:
+        return 0
+    if len(term) <= 5:
+        return 1
+    return 2
+
+
+def edit_distance(a, b, limit):
+    """
+    Damerau-Levenshtein (optimal string alignment) distance between `a` and `b`,
+    or `limit + 1` as soon as it is known to exceed `limit`.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class TermIndex:
+    """
+    Inverted index from analyzed terms to course ids, with a trigram index over
+    the vocabulary to find the terms within `fuzziness: AUTO` of a query term.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.grams = defaultdict(set)
+
+    def add(self, course_id, values):
+        for term in {term for value in values for term in analyze(value)}:
+            if term not in self.postings:
+                for gram in trigrams(term):
+                    self.grams[gram].add(term)
+            self.postings[term].add(course_id)
+
+    def remove(self, course_id, values):
+        for term in {term for value in values for term in analyze(value)}:
+            ids = self.postings.get(term)
+            if ids is None:
+                continue
+            ids.discard(course_id)
+            if not ids:
+                del self.postings[term]
+                for gram in trigrams(term):
+                    self.grams[gram].discard(term)
+
+    def expand(self, token):
+        # Every term within AUTO fuzziness of `token` shares at least one padded trigram
+        limit = auto_fuzziness(token)
+        if limit == 0:
+            return [(token, 1.0)] if token in self.postings else []
+        candidates = set()
+        for gram in trigrams(token):
+            candidates |= self.grams.get(gram, set())
+        expansions = []
+        for term in candidates:
+            distance = edit_distance(token, term, limit)
+            if distance <= limit:
+                expansions.append((term, 1.0 - distance / min(len(token), len(term))))
+        return expansions
+
+    def match(self, text, doc_count):
+        """Score courses for a fuzzy `match` query, any query term may match."""
+        scores = defaultdict(float)
+        for token in analyze(text):
+            best = {}
+            for term, similarity in self.expand(token):
+                ids = self.postings[term]
+                idf = math.log(1 + (doc_count - len(ids) + 0.5) / (len(ids) + 0.5))
+                for course_id in ids:
+                    best[course_id] = max(best.get(course_id, 0.0), idf * similarity)
+            for course_id, score in best.items():
+                scores[course_id] += score
+        return scores
+
+
+class CourseIndex:
+    """The courses of one snapshot of the `courses` index and the term indexes over them."""
+
+    def __init__(self):
+        self.courses = {}
+        self.masks = {}
+        self.codes = defaultdict(set)
+        self.depts = defaultdict(set)
+        self.names = TermIndex()
+        self.instructors = TermIndex()
+
+    def add(self, course):
+        self.remove(course["id"])
+        self.courses[course["id"]] = course
+        self.masks[course["id"]] = course_mask(course)
+        self.codes[course["code"].upper()].add(course["id"])
+        self.depts[course["dept"].upper()].add(course["id"])
+        self.names.add(course["id"], [course["name"]])
+        self.instructors.add(course["id"], _instructors(course))
+
+    def remove(self, course_id):
+        course = self.courses.pop(course_id, None)
+        if course is None:
+            return
+        del self.masks[course_id]
+        self.codes[course["code"].upper()].discard(course_id)
+        self.depts[course["dept"].upper()].discard(course_id)
+        self.names.remove(course_id, [course["name"]])
+        self.instructors.remove(course_id, _instructors(course))
+
+    def _term(self, terms, value):
+        ids = terms.get(value.upper(), set())
+        idf = math.log(1 + (len(self.courses) - len(ids) + 0.5) / (len(ids) + 0.5))
+        return {course_id: idf for course_id in ids}
+
+    def _time(self, slots):
+        slots = set(slots)
+        return {
+            course_id: 1.0
+            for course_id, course in self.courses.items()
+            if any(slots <= set(section["time"]) for section in course["sections"])
+        }
+
+    def search(self, queries, size=10):
+        doc_count = len(self.courses)
+        clauses = []
+        # Non-scoring, like the `must_not` clauses on `slots`
+        blocked = 0
+        for key, value in queries.items():
+            if not value:
+                continue
+            if isinstance(value, list):
+                value = [v for v in value if v]
+                if not value:
+                    continue
+            if key == "query":
+                clauses.append(
+                    _should(
+                        (self._term(self.codes, value), 2.0),
+                        (self._term(self.depts, value), 2.5),
+                        (self.names.match(value, doc_count), 2.0),
+                        (self.instructors.match(value, doc_count), 1.0),
+                    )
+                )
+            elif key == "name":
+                clauses.append(self.names.match(value, doc_count))
+            elif key == "code":
+                clauses.append(self._term(self.codes, value))
+            elif key == "dept":
+                clauses.append(self._term(self.depts, value))
+            elif key == "instructors":
+                for instructor in value:
+                    clauses.append(self.instructors.match(instructor, doc_count))
+            elif key == "time":
+                clauses.append(self._time(value))
+            elif key == "free":
+                blocked |= mask_of(SLOTS) & ~mask_of(value)
+            elif key == "avoid":
+                blocked |= mask_of(value)
+
+        if clauses:
+            scores = dict(clauses[0])
+            for clause in clauses[1:]:
+                scores = {
+                    course_id: score + clause[course_id]
+                    for course_id, score in scores.items()
+                    if course_id in clause
+                }
+        else:
+            scores = {course_id: 1.0 for course_id in self.courses}
+        if blocked:
+            scores = {
+                course_id: score for course_id, score in scores.items() if not self.masks[course_id] & blocked
+            }
+
+        # Ties keep index order, like Elasticsearch on a single shard
+        order = {course_id: i for i, course_id in enumerate(self.courses)}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], order[item[0]]))
+        return [
+            {"course": self.courses[course_id], "score": score}
+            for course_id, score in ranked[:size]
+        ]
+
+
+class CourseEngine:
+    """
+    In-memory copy of the `courses` index that answers `/course/search` with
+    the same clauses and boosts as `build_course_query`.
+
+    Reloads build a new CourseIndex without holding the lock, so searches keep
+    being answered from the current one, and swap it in at the end. Writes
+    made while a reload runs are applied to both.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._index = CourseIndex()
+        # Writes since the running reload started, as `(course_id, course or None)`
+        self._writes = None
+        self.loaded_at = None
+
+    @property
+    def ready(self):
+        return self.loaded_at is not None
+
+    @property
+    def courses(self):
+        return self._index.courses
+
+    def load(self, es=None):
+        """Replace the engine's contents with a snapshot of the `courses` index."""
+        with self._load_lock:
+            with self._lock:
+                self._writes = []
+            try:
+                index = CourseIndex()
+                for hit in helpers.scan(es or client, index=COURSE_INDEX, query={"query": {"match_all": {}}}):
+                    index.add(hit["_source"])
+                with self._lock:
+                    # The scan may have missed them
+                    for course_id, course in self._writes:
+                        if course is None:
+                            index.remove(course_id)
+                        else:
+                            index.add(course)
+                    self._index = index
+                    self.loaded_at = time.monotonic()
+            finally:
+                with self._lock:
+                    self._writes = None
+
+    def add(self, course):
+        with self._lock:
+            self._index.add(course)
+            if self._writes is not None:
+                self._writes.append((course["id"], course))
+
+    def remove(self, course_id):
+        with self._lock:
+            self._index.remove(course_id)
+            if self._writes is not None:
+                self._writes.append((course_id, None))
+
+    def search(self, queries, size=10):
+        with self._lock:
+            return self._index.search(queries, size)
+
+
+def _instructors(course):
+    return [instructor for section in course["sections"] for instructor in section["instructors"]]
+
+
+def _should(*clauses):
+    scores = defaultdict(float)
+    for clause, boost in clauses:
+        for course_id, score in clause.items():
+            scores[course_id] += score * boost
+    return scores
+
+
+course_engine = CourseEngine()
+
+COURSE_ENGINE_ENABLED = os.getenv("COURSE_ENGINE", "false") == "true"
+COURSE_ENGINE_RELOAD_INTERVAL = int(os.getenv("COURSE_ENGINE_RELOAD_INTERVAL", 300))
+
+_reload_lock = threading.Lock()
+
+
+def load_course_engine():
+    """
+    Load the engine from a short-lived client so that, when Gunicorn preloads
+    the app, no Elasticsearch connections are inherited by the forked workers.
+    """
+    es = Elasticsearch(os.getenv("ELASTIC_URL"), **CLIENT_OPTIONS)
+    try:
+        course_engine.load(es)
+    finally:
+        es.close()
+
+
+def reload_course_engine_if_stale():
+    """
+    Writes only reach the engine of the worker that handled them, so every
+    worker periodically reloads its snapshot in the background.
+    """
+    if time.monotonic() - course_engine.loaded_at < COURSE_ENGINE_RELOAD_INTERVAL:
+        return
+    if not _reload_lock.acquire(blocking=False):
+        return
+
+    def reload():
+        try:
+            course_engine.load()
+        finally:
+            _reload_lock.release()
+
+    threading.Thread(target=reload, daemon=True).start()
+
+
+def compare_with_elasticsearch(queries, size=10, es=None):
+    """
+    Run `queries` through the engine and Elasticsearch and return the ids each
+    of them ranked, for checking that the two stay in parity.
+    """
+    from course import course_search_params
+
+    res = (es or client).search(**dict(course_search_params(queries), size=size))
+    expected = [hit["_source"]["id"] for hit in res["hits"]["hits"]]
+    actual = [result["course"]["id"] for result in course_engine.search(queries, size=size)]
+    return expected, actual
+
+
+if __name__ == "__main__":
+    # Usage: python course_engine.py "query=CS F211" "instructor=Ramesh&time=M:2" ...
+    from urllib.parse import parse_qsl
+
+    from course import get_course_queries
+    from werkzeug.datastructures import MultiDict
+
+    load_course_engine()
+    mismatches = 0
+    for query_string in sys.argv[1:]:
+        queries = get_course_queries(MultiDict(parse_qsl(query_string)))
+        expected, actual = compare_with_elasticsearch(queries)
+        overlap = len(set(expected) & set(actual))
+        print(f"{query_string}: {overlap}/{len(expected)} shared, top hit {'same' if expected[:1] == actual[:1] else 'differs'}")
+        if set(expected) != set(actual):
+            mismatches += 1
+            print(f"  elasticsearch: {expected}\n  engine:        {actual}")
+    sys.exit(1 if mismatches else 0)
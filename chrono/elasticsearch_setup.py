@@ -1,25 +1,50 @@
 import os
+import re
+import sys
+import time
 from pprint import pprint
 
+from cache import TTLCache
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
+from elasticsearch import BadRequestError, Elasticsearch, NotFoundError, helpers
+from resilience import GuardedClient, breaker
+from slots import DAY_MASKS, course_mask, mask_of, room_time_slots, slots_of, to_hex
 
 load_dotenv()
 
 username = os.getenv("ELASTIC_USERNAME")
 password = os.getenv("ELASTIC_PASSWORD")
 
-client = Elasticsearch(
-    os.getenv("ELASTIC_URL"),
-    basic_auth=(username, password),
-)
+# Shared by the sync client below and the async client used by `asgi.py`. Each
+# client keeps a pool of up to `connections_per_node` persistent HTTP
+# connections per Elasticsearch node, reused across requests, so a worker does
+# not open a new connection per search. Sync workers serve one request at a
+# time and need few; async workers need about as many as concurrent searches.
+CLIENT_OPTIONS = {
+    "basic_auth": (username, password),
+    "connections_per_node": int(os.getenv("ELASTIC_MAX_CONNECTIONS", 10)),
+    "request_timeout": float(os.getenv("ELASTIC_REQUEST_TIMEOUT", 10)),
+}
+
+# Calls go through the circuit breaker, and reads get a deadline, see resilience.py
+client = GuardedClient(Elasticsearch(os.getenv("ELASTIC_URL"), **CLIENT_OPTIONS), breaker)
+
+
+def unhurried_client():
+    """
+    `client` with the `ELASTIC_REQUEST_TIMEOUT` deadline instead of the shorter
+    one searches get, for reads that are slow by design: exports, profiles and
+    the commands that move whole indices.
+    """
+    return client.options(request_timeout=CLIENT_OPTIONS["request_timeout"])
+
 
 COURSE_INDEX = "courses"
 TIMETABLE_INDEX = "timetables"
 
 
-def create_course_index():
-    body = {
+def course_index_body():
+    return {
         "mappings": {
             "properties": {
                 "id": {"type": "keyword"},
@@ -28,6 +53,14 @@ def create_course_index():
                     "type": "keyword"
                 },  # Added by search service when a course is added
                 "name": {"type": "search_as_you_type"},
+                "suggest": {
+                    "type": "completion",
+                    "analyzer": "standard",
+                },  # Added by search service from code, name and instructors
+                "slots": {"type": "keyword"},  # Added by search service, `time` of every section
+                # Bitmask of `slots`, see slots.py. Like `sections.mask`, only stored, not searchable:
+                # read back from `_source` by /course/combinations so that it needs no parsing of `time`
+                "mask": {"type": "keyword", "index": False},
                 "sections": {
                     "type": "nested",
                     "properties": {
@@ -39,6 +72,7 @@ def create_course_index():
                         "time": {
                             "type": "keyword"
                         },  # roomTime is modified by search service to time
+                        "mask": {"type": "keyword", "index": False},  # Bitmask of `time`
                         "createdAt": {"type": "date"},
                     },
                 },
@@ -54,15 +88,55 @@ def create_course_index():
         },
     }
 
-    if not client.indices.exists(index=COURSE_INDEX):
-        client.indices.create(index=COURSE_INDEX, body=body)
-        print(f"Index `{COURSE_INDEX}` created")
-    else:
-        print(f"Index `{COURSE_INDEX}` already exists")
 
+def create_course_index():
+    if create_index(COURSE_INDEX, course_index_body()):
+        return
+    # Adds derived fields to indices created before them, `backfill-courses` fills them in
+    properties = course_index_body()["mappings"]["properties"]
+    client.indices.put_mapping(
+        index=COURSE_INDEX,
+        properties={
+            "suggest": properties["suggest"],
+            "slots": properties["slots"],
+            "mask": properties["mask"],
+            "sections": {"type": "nested", "properties": {"mask": properties["sections"]["properties"]["mask"]}},
+        },
+    )
 
-def create_timetable_index():
-    body = {
+
+def course_suggest_inputs(course):
+    """
+    Inputs for a course's `suggest` completion field: its code, name and
+    instructors, each also starting from every later word, since completion
+    only matches from the start of an input ("algo" finds "Data Structures and
+    Algorithms", "f21" finds "CS F211").
+    """
+    phrases = [course["code"], course["name"]]
+    phrases += [instructor for section in course["sections"] for instructor in section["instructors"]]
+    inputs = set()
+    for phrase in phrases:
+        words = phrase.split()
+        inputs.update(" ".join(words[i:]) for i in range(len(words)))
+    return sorted(inputs)
+
+
+def course_derived_fields(course):
+    """
+    Fields the service derives from a course whose sections have `time`:
+    `suggest`, the `slots` its sections occupy and their bitmasks.
+    """
+    mask = course_mask(course)
+    return {
+        "suggest": course_suggest_inputs(course),
+        "slots": slots_of(mask),
+        "mask": to_hex(mask),
+        "sections": [dict(section, mask=to_hex(mask_of(section["time"]))) for section in course["sections"]],
+    }
+
+
+def timetable_index_body():
+    return {
         "mappings": {
             "properties": {
                 "id": {"type": "keyword"},
@@ -95,19 +169,156 @@ def create_timetable_index():
                 "courses": {  # Added by search service when a timetable is added
                     "type": "nested",
                     "properties": {
+                        "id": {"type": "keyword"},
                         "code": {"type": "keyword"},
                         "name": {"type": "search_as_you_type"},
                     },
                 },
+                # Added by search service from `sections.roomTime`, see `timetable_occupancy`
+                "busySlots": {"type": "keyword"},
+                "freeDays": {"type": "keyword"},
+                "hours": {"type": "integer"},
             },
         }
     }
 
-    if not client.indices.exists(index=TIMETABLE_INDEX):
-        client.indices.create(index=TIMETABLE_INDEX, body=body)
-        print(f"Index `{TIMETABLE_INDEX}` created")
-    else:
-        print(f"Index `{TIMETABLE_INDEX}` already exists")
+
+def timetable_occupancy(timetable):
+    """
+    The weekly slots a timetable's sections meet in, as `day:hour` names, the
+    days without any class and the contact hours per week.
+    """
+    mask = 0
+    for section in timetable["sections"]:
+        mask |= mask_of(room_time_slots(section["roomTime"]))
+    return {
+        "busySlots": slots_of(mask),
+        "freeDays": [day for day, day_mask in DAY_MASKS.items() if not mask & day_mask],
+        "hours": len(slots_of(mask)),
+    }
+
+
+def create_timetable_index():
+    # Term partitions are created as timetables are written to them
+    current = resolve_alias(TIMETABLE_INDEX)
+    if current is None:
+        print(f"Index `{TIMETABLE_INDEX}` is partitioned by term, partitions are created as timetables are added")
+        return
+    print(f"Index `{TIMETABLE_INDEX}` already exists (`{current}`)")
+    # Adds fields to indices created before them, `backfill-timetables` fills them in
+    properties = timetable_index_body()["mappings"]["properties"]
+    client.indices.put_mapping(
+        index=TIMETABLE_INDEX,
+        properties={
+            **{field: properties[field] for field in ["busySlots", "freeDays", "hours"]},
+            "courses": {"type": "nested", "properties": {"id": properties["courses"]["properties"]["id"]}},
+        },
+    )
+
+
+def index_versions(alias):
+    """Return the versioned indices `{alias}-v{n}` that exist, oldest first."""
+    indices = client.indices.get(index=f"{alias}-v*", ignore_unavailable=True, allow_no_indices=True)
+    return sorted(indices, key=lambda index: int(index.rsplit("-v", 1)[1]))
+
+
+def resolve_alias(alias):
+    """Return the index `alias` points to, `alias` itself for a bare index or None if neither exists."""
+    try:
+        return next(iter(client.indices.get_alias(name=alias)))
+    except NotFoundError:
+        pass
+    return alias if client.indices.exists(index=alias) else None
+
+
+def create_index(alias, body, read_aliases=()):
+    """
+    Create `{alias}-v1` with `alias` as its read and write alias, and
+    `read_aliases` for reads only, unless the alias (or a bare index predating
+    aliases) already exists. Returns whether it was created.
+    """
+    current = resolve_alias(alias)
+    if current is not None:
+        print(f"Index `{alias}` already exists (`{current}`)")
+        return False
+    aliases = {alias: {"is_write_index": True}, **{name: {} for name in read_aliases}}
+    client.indices.create(index=f"{alias}-v1", body={**body, "aliases": aliases})
+    print(f"Index `{alias}-v1` created behind `{alias}`")
+    return True
+
+
+# Timetables are partitioned by term: every term's timetables are written
+# through `timetables-{acadYear}-{semester}` and `timetables` reads all of them
+_PARTITION_PATTERN = re.compile(rf"{TIMETABLE_INDEX}-(\d+)-(\d+)")
+_partitions = set()
+_partitioned = None
+
+
+def timetable_partition(acad_year, semester):
+    return f"{TIMETABLE_INDEX}-{acad_year}-{semester}"
+
+
+def partition_term(alias):
+    """The `(acadYear, semester)` of a partition alias from `timetable_partitions()`."""
+    return tuple(int(part) for part in _PARTITION_PATTERN.fullmatch(alias).groups())
+
+
+def is_timetable_index(index_name):
+    return index_name == TIMETABLE_INDEX or index_name.startswith(f"{TIMETABLE_INDEX}-")
+
+
+def timetable_partitions():
+    """Return the aliases of the existing term partitions, oldest term first."""
+    try:
+        aliases = client.indices.get_alias(name=f"{TIMETABLE_INDEX}-*")
+    except NotFoundError:
+        return []
+    names = {name for index in aliases.values() for name in index["aliases"] if _PARTITION_PATTERN.fullmatch(name)}
+    return sorted(names, key=partition_term)
+
+
+# `timetable_partitions()` for picking the partitions a search reads, fetched at
+# most once per `PARTITION_CACHE_TTL` seconds and again when this process creates one
+_partition_cache = TTLCache(maxsize=1, ttl=float(os.getenv("PARTITION_CACHE_TTL", 60)))
+
+
+def searchable_timetable_partitions():
+    return _partition_cache.get_or_set("partitions", timetable_partitions)
+
+
+def timetables_partitioned():
+    """
+    Whether timetables are stored in term partitions, rather than in a
+    single index that `partition-timetables` has not split yet. Checked once
+    per process.
+    """
+    global _partitioned
+    if _partitioned is None:
+        current = resolve_alias(TIMETABLE_INDEX)
+        _partitioned = current is None or current != TIMETABLE_INDEX and not current.startswith(f"{TIMETABLE_INDEX}-v")
+    return _partitioned
+
+
+def ensure_timetable_partition(acad_year, semester):
+    """Return the index a timetable of the given term is written to, creating its partition if needed."""
+    if not timetables_partitioned():
+        return TIMETABLE_INDEX
+    alias = timetable_partition(acad_year, semester)
+    if alias in _partitions:
+        return alias
+    if resolve_alias(alias) is None:
+        try:
+            client.indices.create(
+                index=f"{alias}-v1",
+                body={**timetable_index_body(), "aliases": {alias: {"is_write_index": True}, TIMETABLE_INDEX: {}}},
+            )
+        except BadRequestError as e:
+            # Created by another worker in the meantime
+            if e.message != "resource_already_exists_exception":
+                raise
+        _partition_cache.clear()
+    _partitions.add(alias)
+    return alias
 
 
 def delete_index(index_name):
@@ -118,14 +329,349 @@ def delete_index(index_name):
         print(f"Index `{index_name}` does not exist")
 
 
-def search_by_id(index_name, id):
-    search_res = client.search(index=index_name, query={"term": {"id": id}}, size=1)
-    if search_res["hits"]["total"]["value"] > 0:
-        return search_res["hits"]["hits"][0]
+def get_by_id(index_name, id, source=True):
+    try:
+        return client.get(index=index_name, id=id, source=source)
+    except NotFoundError:
+        return None
+
+
+def get_by_ids(index_name, ids, source=True):
+    ids = list(ids)
+    if not ids:
+        return {}
+    res = client.mget(index=index_name, ids=ids, source=source)
+    return {doc["_id"]: doc for doc in res["docs"] if doc.get("found")}
+
+
+def iter_documents(index_name, query, keep_alive="5m", page_size=1000):
+    """
+    Yield the `_source` of every document matching `query`, a page at a time
+    from a point in time, so that the documents come from one snapshot of the
+    index however many there are.
+    """
+    es = unhurried_client()
+    pit_id = es.open_point_in_time(index=index_name, keep_alive=keep_alive, ignore_unavailable=True)["id"]
+    search_after = None
+    try:
+        while True:
+            res = es.search(
+                query=query,
+                pit={"id": pit_id, "keep_alive": keep_alive},
+                sort=[{"_shard_doc": "asc"}],
+                search_after=search_after,
+                track_total_hits=False,
+                size=page_size,
+            )
+            hits = res["hits"]["hits"]
+            pit_id = res.get("pit_id", pit_id)
+            for hit in hits:
+                yield hit["_source"]
+            if len(hits) < page_size:
+                return
+            search_after = hits[-1]["sort"]
+    finally:
+        client.close_point_in_time(id=pit_id)
+
+
+def bulk_index(index_name, documents, op_type="create"):
+    """
+    Write `documents` through the bulk helper, keyed by their `id`, without
+    refreshing. `op_type` is "create" to reject existing ids or "index" to
+    overwrite them. Returns a list aligned with `documents` holding None for
+    every successful write and `{"status", "error"}` otherwise.
+    """
+    actions = (
+        {"_op_type": op_type, "_index": index_name, "_id": document["id"], "_source": document}
+        for document in documents
+    )
+    results = []
+    for ok, item in helpers.streaming_bulk(
+        client, actions, raise_on_error=False, raise_on_exception=False
+    ):
+        if ok:
+            results.append(None)
+            continue
+        item = item[op_type]
+        error = item.get("error", "Indexing failed")
+        if isinstance(error, dict):
+            error = error.get("reason") or error.get("type")
+        results.append({"status": item.get("status"), "error": error})
+    return results
+
+
+def wait_for_task(task_id, label):
+    while True:
+        task = client.tasks.get(task_id=task_id)
+        status = task["task"]["status"]
+        print(f"{label}: {status['created'] + status['updated']}/{status['total']} copied")
+        if not task["completed"]:
+            time.sleep(2)
+            continue
+        if task.get("error") or task["response"].get("failures"):
+            raise RuntimeError(f"{label} failed: {task.get('error') or task['response']['failures'][:3]}")
+        return task["response"]
+
+
+def reindex(source, dest, label, query=None):
+    # `external` versions copy only documents that are new or changed since the previous pass
+    task = client.reindex(
+        source={"index": source, **({"query": query} if query else {})},
+        dest={"index": dest, "version_type": "external"},
+        conflicts="proceed",
+        slices="auto",
+        wait_for_completion=False,
+    )
+    return wait_for_task(task["task"], label)
+
+
+def copy_index(current, targets, body):
+    """
+    Create the indices in `targets`, `{index: query}`, from `body` and copy the
+    documents of `current` matching each query (all of them for None) into
+    them. The documents are copied with a sliced `_reindex` while `current`
+    keeps serving reads and writes, then writes to it are blocked for a
+    second pass that copies what changed meanwhile, and the document counts
+    are compared. On failure the new indices are deleted and `current`
+    unblocked.
+    """
+    settings = body.get("settings", {})
+    for index in targets:
+        client.indices.create(
+            index=index, body={**body, "settings": {**settings, "index.refresh_interval": "-1"}}
+        )
+        print(f"Index `{index}` created, copying `{current}`")
+
+    try:
+        for index, query in targets.items():
+            reindex(current, index, f"{current} -> {index}", query)
+        client.indices.put_settings(index=current, settings={"index.blocks.write": True})
+        for index, query in targets.items():
+            reindex(current, index, f"{current} -> {index} (catching up)", query)
+
+        # Documents deleted from the old index since the first pass
+        current_ids = {hit["_id"] for hit in helpers.scan(client, index=current, query={"_source": False})}
+        deleted = [
+            {"_op_type": "delete", "_index": hit["_index"], "_id": hit["_id"]}
+            for hit in helpers.scan(client, index=list(targets), query={"_source": False})
+            if hit["_id"] not in current_ids
+        ]
+        helpers.bulk(client, deleted)
+
+        client.indices.put_settings(
+            index=list(targets), settings={"index.refresh_interval": settings.get("index.refresh_interval")}
+        )
+        client.indices.refresh(index=[current, *targets])
+        for index, query in targets.items():
+            expected = unhurried_client().count(index=current, **({"query": query} if query else {}))["count"]
+            copied = unhurried_client().count(index=index)["count"]
+            if copied != expected:
+                raise RuntimeError(f"`{index}` has {copied} documents, `{current}` has {expected}")
+    except Exception:
+        client.indices.put_settings(index=current, settings={"index.blocks.write": None})
+        client.indices.delete(index=list(targets))
+        print(f"Indices {', '.join(f'`{index}`' for index in targets)} deleted, `{current}` unchanged")
+        raise
+
+
+def swap_actions(current, alias):
+    """Alias actions that take `alias`, and any other alias of `current`, off it."""
+    if current == alias:
+        return [{"remove_index": {"index": current}}]
+    aliases = client.indices.get_alias(index=current)[current]["aliases"]
+    return [{"remove": {"index": current, "alias": name}} for name in aliases]
+
+
+def migrate_index(alias, body, keep_old=True):
+    """
+    Move `alias` to a new version of its index created from `body`, for
+    mapping and analyzer changes without downtime. Once `copy_index` has
+    copied the documents, the alias (and any other alias of the old index,
+    such as `timetables` for a partition) is swapped to the new index in a
+    single atomic update. A bare index predating aliases is deleted by the
+    same update, otherwise the old version is kept (write-blocked) for
+    rollback unless `keep_old` is False.
+    """
+    current = resolve_alias(alias)
+    if current is None:
+        raise RuntimeError(f"Index `{alias}` does not exist")
+    versions = index_versions(alias)
+    new = f"{alias}-v{int(versions[-1].rsplit('-v', 1)[1]) + 1 if versions else 1}"
+
+    copy_index(current, {new: None}, body)
+
+    actions = swap_actions(current, alias)
+    adds = [{"add": {"index": new, "alias": alias, "is_write_index": True}}]
+    for action in actions:
+        if "remove" in action and action["remove"]["alias"] != alias:
+            adds.append({"add": {"index": new, "alias": action["remove"]["alias"]}})
+    client.indices.update_aliases(actions=adds + actions)
+    print(f"`{alias}` now points to `{new}`")
+
+    if current != alias and not keep_old:
+        client.indices.delete(index=current)
+        print(f"Index `{current}` deleted")
+
+
+def partition_timetables(keep_old=True):
+    """
+    Split a single timetable index into one partition per term, copied as in
+    `migrate_index`, and point `timetables` at all of them in one atomic
+    update. Workers check whether timetables are partitioned once, so they
+    should be restarted afterwards.
+    """
+    current = resolve_alias(TIMETABLE_INDEX)
+    if current is None or timetables_partitioned():
+        print(f"`{TIMETABLE_INDEX}` is already partitioned")
+        return
+    res = unhurried_client().search(
+        index=current,
+        size=0,
+        aggs={"terms": {"multi_terms": {"terms": [{"field": "acadYear"}, {"field": "semester"}], "size": 1000}}},
+    )
+    terms = [bucket["key"] for bucket in res["aggregations"]["terms"]["buckets"]]
+    targets = {
+        f"{timetable_partition(acad_year, semester)}-v1": {
+            "bool": {"filter": [{"term": {"acadYear": acad_year}}, {"term": {"semester": semester}}]}
+        }
+        for acad_year, semester in terms
+    }
+
+    copy_index(current, targets, timetable_index_body())
+
+    adds = []
+    for acad_year, semester in terms:
+        index = f"{timetable_partition(acad_year, semester)}-v1"
+        adds.append({"add": {"index": index, "alias": timetable_partition(acad_year, semester), "is_write_index": True}})
+        adds.append({"add": {"index": index, "alias": TIMETABLE_INDEX}})
+    client.indices.update_aliases(actions=adds + swap_actions(current, TIMETABLE_INDEX))
+    print(f"`{TIMETABLE_INDEX}` now points to {len(terms)} term partitions")
+
+    if current != TIMETABLE_INDEX and not keep_old:
+        client.indices.delete(index=current)
+        print(f"Index `{current}` deleted")
+
+
+def find_timetable_index(timetable_id):
+    """Return the index holding `timetable_id`, with a realtime get from every partition, or None."""
+    return find_timetable_indices([timetable_id]).get(timetable_id)
+
+
+def find_timetable_indices(timetable_ids):
+    """Return `{timetable_id: index}` for those of `timetable_ids` stored in any partition, in one multi-get."""
+    indices = timetable_partitions() if timetables_partitioned() else [TIMETABLE_INDEX]
+    if not indices or not timetable_ids:
+        return {}
+    docs = [{"_index": index, "_id": timetable_id} for timetable_id in timetable_ids for index in indices]
+    res = client.mget(docs=docs, source=False)
+    found = {}
+    for doc in res["docs"]:
+        if doc.get("found"):
+            found.setdefault(doc["_id"], doc["_index"])
+    return found
+
+
+def archive_timetable_partition(acad_year, semester):
+    """
+    Force-merge a past term's partition to a single segment and make it
+    read-only, which shrinks the heap and disk it takes. It stays searchable
+    through `timetables`.
+    """
+    alias = timetable_partition(acad_year, semester)
+    client.indices.put_settings(index=alias, settings={"index.blocks.write": True})
+    client.indices.forcemerge(index=alias, max_num_segments=1, wait_for_completion=True, request_timeout=3600)
+    print(f"Partition `{alias}` archived")
+
+
+def migrate_to_domain_ids(index_name):
+    """
+    One-off migration for indices written before documents were keyed by their
+    `id`. Every document stored under a generated `_id` is re-created under its
+    `id` and the old copy deleted. If an id was stored more than once, the copy
+    scanned last wins.
+    """
+
+    migrated = []
+
+    def actions():
+        for hit in helpers.scan(client, index=index_name, query={"query": {"match_all": {}}}):
+            document_id = hit["_source"]["id"]
+            if hit["_id"] == document_id:
+                continue
+            migrated.append(document_id)
+            yield {"_op_type": "index", "_index": index_name, "_id": document_id, "_source": hit["_source"]}
+            yield {"_op_type": "delete", "_index": index_name, "_id": hit["_id"]}
+
+    _, errors = helpers.bulk(client, actions(), raise_on_error=False)
+    client.indices.refresh(index=index_name)
+    print(f"Index `{index_name}`: {len(migrated)} documents migrated, {len(errors)} errors")
+
+
+def backfill_courses():
+    """Fill in the derived fields of courses indexed before they were added to the mapping."""
+
+    def actions():
+        for hit in helpers.scan(client, index=COURSE_INDEX, query={"query": {"match_all": {}}}):
+            yield {
+                "_op_type": "update",
+                "_index": COURSE_INDEX,
+                "_id": hit["_id"],
+                "doc": course_derived_fields(hit["_source"]),
+            }
+
+    updated, errors = helpers.bulk(client, actions(), raise_on_error=False)
+    client.indices.refresh(index=COURSE_INDEX)
+    print(f"Index `{COURSE_INDEX}`: {updated} courses updated, {len(errors)} errors")
+
+
+def backfill_timetables():
+    """Fill in the occupancy fields of timetables indexed before they were added to the mapping."""
+
+    def actions():
+        for hit in helpers.scan(client, index=TIMETABLE_INDEX, query={"query": {"match_all": {}}}):
+            yield {
+                "_op_type": "update",
+                "_index": hit["_index"],
+                "_id": hit["_id"],
+                "doc": timetable_occupancy(hit["_source"]),
+            }
+
+    # Archived terms are read-only and are reported as errors
+    updated, errors = helpers.bulk(client, actions(), raise_on_error=False)
+    client.indices.refresh(index=TIMETABLE_INDEX)
+    print(f"Index `{TIMETABLE_INDEX}`: {updated} timetables updated, {len(errors)} errors")
 
 
 if __name__ == "__main__":
     pprint(client.info().body)
+    if sys.argv[1:] == ["migrate-ids"]:
+        migrate_to_domain_ids(COURSE_INDEX)
+        migrate_to_domain_ids(TIMETABLE_INDEX)
+        sys.exit()
+    if sys.argv[1:2] == ["migrate"]:
+        for alias in sys.argv[2:] or [COURSE_INDEX, TIMETABLE_INDEX]:
+            if alias == COURSE_INDEX:
+                migrate_index(alias, course_index_body())
+            elif alias == TIMETABLE_INDEX and timetables_partitioned():
+                for partition in timetable_partitions():
+                    migrate_index(partition, timetable_index_body())
+            else:
+                migrate_index(alias, timetable_index_body())
+        sys.exit()
+    if sys.argv[1:] == ["partition-timetables"]:
+        partition_timetables()
+        sys.exit()
+    if sys.argv[1:2] == ["archive-term"]:
+        archive_timetable_partition(*sys.argv[2:4])
+        sys.exit()
+    if sys.argv[1:] == ["backfill-courses"]:
+        create_course_index()
+        backfill_courses()
+        sys.exit()
+    if sys.argv[1:] == ["backfill-timetables"]:
+        create_timetable_index()
+        backfill_timetables()
+        sys.exit()
     # delete_index(COURSE_INDEX)
     # delete_index(TIMETABLE_INDEX)
     create_course_index()
@@ -0,0 +1,546 @@
+import fnmatch
+import json
+import random
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from elastic_transport import ApiResponseMeta, HttpHeaders, JsonSerializer, NodeConfig, ObjectApiResponse
+from elasticsearch import AuthorizationException, BadRequestError, ConflictError, NotFoundError
+from utils import filter_source
+
+
+def _meta(status):
+    return ApiResponseMeta(
+        status=status,
+        http_version="1.1",
+        headers=HttpHeaders(),
+        duration=0.0,
+        node=NodeConfig("http", "localhost", 9200),
+    )
+
+
+def _responds(method):
+    # Wrapped like the real client's responses, which the helpers read `.body` from
+    def wrapper(*args, **kwargs):
+        return ObjectApiResponse(body=method(*args, **kwargs), meta=_meta(200))
+
+    return wrapper
+
+
+def _project(document, source):
+    if source is None or source is True:
+        return document
+    if source is False:
+        return None
+    if isinstance(source, str):
+        source = [source]
+    if isinstance(source, list):
+        source = {"includes": source}
+    return filter_source(document, source)
+
+
+def _values(document, field):
+    # Every value at a dotted path, through lists of objects
+    values = [document]
+    for key in field.split("."):
+        found = []
+        for value in values:
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict) and key in item:
+                    found.append(item[key])
+        values = found
+    return [item for value in values for item in (value if isinstance(value, list) else [value])]
+
+
+def _matches(document, query):
+    # Only the filters the migration commands copy by: `match_all` and `term`,
+    # alone or in a `bool` filter. Searches do not evaluate their queries at all
+    if not query or "match_all" in query:
+        return True
+    if "term" in query:
+        ((field, value),) = query["term"].items()
+        return value in _values(document, field)
+    if "bool" in query:
+        clauses = query["bool"].get("filter", []) + query["bool"].get("must", [])
+        return all(_matches(document, clause) for clause in clauses)
+    raise NotImplementedError(f"FakeElasticsearch does not evaluate {query}")
+
+
+def _buckets(counts, size):
+    ordered = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return [{"key": key, "doc_count": count} for key, count in ordered[:size]]
+
+
+def _aggregate(documents, aggs, prefix=""):
+    """Evaluate the `terms`, `multi_terms` and `nested` aggregations over `documents`."""
+    results = {}
+    for name, agg in aggs.items():
+        if "terms" in agg:
+            counts = {}
+            for document in documents:
+                for value in set(_values(document, agg["terms"]["field"][len(prefix) :])):
+                    counts[value] = counts.get(value, 0) + 1
+            results[name] = {"buckets": _buckets(counts, agg["terms"].get("size", 10))}
+        elif "multi_terms" in agg:
+            counts = {}
+            for document in documents:
+                keys = [_values(document, term["field"][len(prefix) :]) for term in agg["multi_terms"]["terms"]]
+                if all(keys):
+                    key = tuple(values[0] for values in keys)
+                    counts[key] = counts.get(key, 0) + 1
+            buckets = _buckets(counts, agg["multi_terms"].get("size", 10))
+            results[name] = {"buckets": [dict(bucket, key=list(bucket["key"])) for bucket in buckets]}
+        elif "nested" in agg:
+            path = agg["nested"]["path"]
+            nested = [item for document in documents for item in _values(document, path[len(prefix) :])]
+            results[name] = {"doc_count": len(nested), **_aggregate(nested, agg.get("aggs", {}), path + ".")}
+    return results
+
+
+class FakeIndices:
+    def __init__(self, es):
+        self._es = es
+
+    def exists(self, index, **kwargs):
+        self._es._sleep()
+        return bool(self._es._resolve(index))
+
+    @_responds
+    def create(self, index, body=None, aliases=None, **kwargs):
+        self._es._sleep()
+        self._es.request_cache.clear()
+        if index in self._es.documents:
+            raise BadRequestError("resource_already_exists_exception", _meta(400), {})
+        body = body or {}
+        self._es.documents[index] = {}
+        self._es.mappings[index] = body.get("mappings", kwargs.get("mappings", {}))
+        for alias, options in (body.get("aliases") or aliases or {}).items():
+            self._es.aliases.setdefault(alias, {})[index] = options
+        return {"acknowledged": True, "index": index}
+
+    @_responds
+    def delete(self, index, **kwargs):
+        self._es._sleep()
+        self._es.request_cache.clear()
+        indices = self._es._resolve(index)
+        if not indices:
+            raise NotFoundError("index_not_found_exception", _meta(404), {})
+        for name in indices:
+            self._es._drop(name)
+        return {"acknowledged": True}
+
+    @_responds
+    def get(self, index, **kwargs):
+        self._es._sleep()
+        return {name: {"aliases": self._es._aliases_of(name)} for name in self._es._resolve(index)}
+
+    @_responds
+    def get_alias(self, name=None, index=None, **kwargs):
+        self._es._sleep()
+        indices = self._es._resolve(index) if index else list(self._es.documents)
+        result = {}
+        for index_name in indices:
+            aliases = {
+                alias: options
+                for alias, options in self._es._aliases_of(index_name).items()
+                if name is None or fnmatch.fnmatchcase(alias, name)
+            }
+            if aliases or name is None:
+                result[index_name] = {"aliases": aliases}
+        if not result:
+            raise NotFoundError("aliases_not_found_exception", _meta(404), {})
+        return result
+
+    @_responds
+    def update_aliases(self, actions, **kwargs):
+        self._es._sleep()
+        self._es.request_cache.clear()
+        for action in actions:
+            (kind, options), = action.items()
+            if kind == "add":
+                extra = {key: value for key, value in options.items() if key not in ("index", "alias")}
+                self._es.aliases.setdefault(options["alias"], {})[options["index"]] = extra
+            elif kind == "remove":
+                self._es.aliases.get(options["alias"], {}).pop(options["index"], None)
+            elif kind == "remove_index":
+                self._es._drop(options["index"])
+        return {"acknowledged": True}
+
+    @_responds
+    def refresh(self, index=None, **kwargs):
+        self._es._sleep()
+        return {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    @_responds
+    def put_mapping(self, index, **kwargs):
+        self._es._sleep()
+        return {"acknowledged": True}
+
+    @_responds
+    def put_settings(self, index=None, settings=None, **kwargs):
+        self._es._sleep()
+        for name in self._es._resolve(index) if index else list(self._es.documents):
+            stored = self._es.settings.setdefault(name, {})
+            for key, value in (settings or {}).items():
+                # None resets a setting to its default
+                if value is None:
+                    stored.pop(key, None)
+                else:
+                    stored[key] = value
+        return {"acknowledged": True}
+
+    @_responds
+    def forcemerge(self, index=None, **kwargs):
+        self._es._sleep()
+        self._es.calls["forcemerge"] = self._es.calls.get("forcemerge", 0) + 1
+        return {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    @_responds
+    def get_settings(self, index=None, name=None, flat_settings=False, **kwargs):
+        # Flat settings only, as `{"index.blocks.write": True}` was put
+        self._es._sleep()
+        result = {}
+        for index_name in self._es._resolve(index) if index else list(self._es.documents):
+            settings = self._es.settings.get(index_name, {})
+            if name is not None:
+                settings = {key: value for key, value in settings.items() if fnmatch.fnmatchcase(key, name)}
+            result[index_name] = {"settings": {key: str(value).lower() for key, value in settings.items()}}
+        return result
+
+
+class FakeTasks:
+    def __init__(self, es):
+        self._es = es
+
+    @_responds
+    def get(self, task_id, **kwargs):
+        self._es._sleep()
+        return self._es.tasks_done[task_id]
+
+
+class FakeCluster:
+    def __init__(self, es):
+        self._es = es
+
+    @_responds
+    def health(self, **kwargs):
+        self._es._sleep("health")
+        return {"cluster_name": "fake", "status": "green", "number_of_nodes": 1}
+
+
+class FakeElasticsearch:
+    """
+    Deterministic in-process stand-in for the Elasticsearch client calls this
+    service makes, for benchmarks that should not depend on a cluster.
+
+    Documents are kept in dicts per index, which aliases and wildcards resolve
+    to as in Elasticsearch. Search queries are not evaluated (only the term
+    filters of `reindex` and `count` are, for the migrations): a search returns the
+    documents of the indices searched in id order, paged with `from_`/`size` or
+    `search_after`, and aggregates over all of them, so that the measured cost
+    is the service's own overhead plus the injected `latency` (seconds per
+    call, with up to `jitter` extra drawn from a seeded generator).
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.documents = {}
+        self.mappings = {}
+        self.settings = {}
+        # `{alias: {index: options}}`
+        self.aliases = {}
+        self.indices = FakeIndices(self)
+        self.cluster = FakeCluster(self)
+        self.tasks = FakeTasks(self)
+        # Results of the `reindex` tasks, which complete at once
+        self.tasks_done = {}
+        self.transport = SimpleNamespace(
+            serializers=SimpleNamespace(get_serializer=lambda mimetype: JsonSerializer())
+        )
+        self.calls = {}
+        # Aggregation results until the next write, like Elasticsearch's shard request cache
+        self.request_cache = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sleep(self, name=None):
+        with self._lock:
+            delay = self.latency + self._random.random() * self.jitter
+            if name:
+                self.calls[name] = self.calls.get(name, 0) + 1
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def options(self, **kwargs):
+        return self
+
+    def close(self):
+        pass
+
+    @_responds
+    def info(self):
+        return {"name": "fake", "version": {"number": "8.14.3"}}
+
+    def _resolve(self, names):
+        """The concrete indices `names` (indices, aliases or wildcards, a list or comma separated) refer to."""
+        if isinstance(names, str):
+            names = names.split(",")
+        indices = []
+        for name in names:
+            if name in self.aliases:
+                matched = list(self.aliases[name])
+            elif name in self.documents:
+                matched = [name]
+            else:
+                matched = [index for index in self.documents if fnmatch.fnmatchcase(index, name)]
+                for alias, members in self.aliases.items():
+                    if fnmatch.fnmatchcase(alias, name):
+                        matched.extend(members)
+            indices.extend(index for index in sorted(matched) if index not in indices)
+        return indices
+
+    def _aliases_of(self, index):
+        return {alias: options for alias, members in self.aliases.items() for name, options in members.items() if name == index}
+
+    def _drop(self, index):
+        self.documents.pop(index, None)
+        self.settings.pop(index, None)
+        for members in self.aliases.values():
+            members.pop(index, None)
+
+    def _index(self, index):
+        """The index writes to `index` go to and its documents, created on first use."""
+        members = self.aliases.get(index)
+        if members:
+            writable = [name for name, options in members.items() if options.get("is_write_index")]
+            if writable:
+                index = writable[0]
+            elif len(members) == 1:
+                index = next(iter(members))
+            else:
+                raise BadRequestError("illegal_argument_exception", _meta(400), {})
+        return index, self.documents.setdefault(index, {})
+
+    def _check_writable(self, index):
+        if self.settings.get(index, {}).get("index.blocks.write"):
+            raise AuthorizationException("cluster_block_exception", _meta(403), {})
+
+    def _find(self, index, id):
+        """The index holding `id` among those `index` resolves to, for reads and deletes."""
+        return next((name for name in self._resolve(index) if id in self.documents[name]), None)
+
+    @_responds
+    def index(self, index, id=None, body=None, document=None, op_type="index", **kwargs):
+        self._sleep("index")
+        self.request_cache.clear()
+        index, documents = self._index(index)
+        self._check_writable(index)
+        id = id or uuid.uuid4().hex
+        if op_type == "create" and id in documents:
+            raise ConflictError("version_conflict_engine_exception", _meta(409), {})
+        documents[id] = json.loads(json.dumps(body if body is not None else document))
+        return {"_index": index, "_id": id, "result": "created"}
+
+    @_responds
+    def get(self, index, id, source=True, **kwargs):
+        self._sleep("get")
+        found = self._find(index, id)
+        if found is None:
+            raise NotFoundError("not_found", _meta(404), {"found": False})
+        return {"_index": found, "_id": id, "found": True, "_source": _project(self.documents[found][id], source)}
+
+    @_responds
+    def mget(self, index=None, ids=None, docs=None, source=True, **kwargs):
+        self._sleep("mget")
+        docs = docs or [{"_index": index, "_id": id} for id in ids]
+        results = []
+        for doc in docs:
+            found = self._find(doc["_index"], doc["_id"])
+            if found is None:
+                results.append({"_index": doc["_index"], "_id": doc["_id"], "found": False})
+                continue
+            document = _project(self.documents[found][doc["_id"]], source)
+            results.append({"_index": found, "_id": doc["_id"], "found": True, "_source": document})
+        return {"docs": results}
+
+    @_responds
+    def delete(self, index, id, **kwargs):
+        self._sleep("delete")
+        self.request_cache.clear()
+        found = self._find(index, id)
+        if found is None:
+            raise NotFoundError("not_found", _meta(404), {"result": "not_found"})
+        del self.documents[found][id]
+        return {"_index": found, "_id": id, "result": "deleted"}
+
+    @_responds
+    def bulk(self, operations, **kwargs):
+        self._sleep("bulk")
+        self.request_cache.clear()
+        lines = [json.loads(line) for line in operations]
+        items = []
+        i = 0
+        while i < len(lines):
+            (op_type, action), = lines[i].items()
+            id = action.get("_id") or uuid.uuid4().hex
+            if op_type == "delete":
+                found = self._find(action["_index"], id)
+                if found is not None:
+                    del self.documents[found][id]
+                items.append({op_type: {"_id": id, "status": 404 if found is None else 200}})
+                i += 1
+                continue
+            index, documents = self._index(action["_index"])
+            if self.settings.get(index, {}).get("index.blocks.write"):
+                items.append({op_type: {"_id": id, "status": 403, "error": {"type": "cluster_block_exception"}}})
+            elif op_type == "create" and id in documents:
+                items.append(
+                    {op_type: {"_id": id, "status": 409, "error": {"type": "version_conflict_engine_exception"}}}
+                )
+            elif op_type == "update":
+                if id in documents:
+                    documents[id].update(lines[i + 1]["doc"])
+                    items.append({op_type: {"_id": id, "status": 200}})
+                else:
+                    items.append({op_type: {"_id": id, "status": 404, "error": {"type": "document_missing_exception"}}})
+            else:
+                documents[id] = lines[i + 1]
+                items.append({op_type: {"_id": id, "status": 201}})
+            i += 2
+        return {"errors": any(next(iter(item.values()))["status"] >= 300 for item in items), "items": items}
+
+    @_responds
+    def count(self, index=None, query=None, **kwargs):
+        self._sleep("count")
+        return {
+            "count": sum(
+                _matches(document, query) for name in self._resolve(index) for document in self.documents[name].values()
+            )
+        }
+
+    @_responds
+    def reindex(self, source, dest, wait_for_completion=True, **kwargs):
+        # Copies at once, overwriting what the destination holds as `version_type: external` would
+        self._sleep("reindex")
+        self.request_cache.clear()
+        index, documents = self._index(dest["index"])
+        self._check_writable(index)
+        copied = {
+            id: json.loads(json.dumps(document))
+            for name in self._resolve(source["index"])
+            for id, document in self.documents[name].items()
+            if _matches(document, source.get("query"))
+        }
+        created = len(copied.keys() - documents.keys())
+        documents.update(copied)
+        response = {"total": len(copied), "created": created, "updated": len(copied) - created, "failures": []}
+        if wait_for_completion:
+            return response
+        task_id = f"fake:{len(self.tasks_done) + 1}"
+        self.tasks_done[task_id] = {
+            "completed": True,
+            "task": {"status": {key: response[key] for key in ["total", "created", "updated"]}},
+            "response": response,
+        }
+        return {"task": task_id}
+
+    @_responds
+    def open_point_in_time(self, index, keep_alive, **kwargs):
+        self._sleep("open_point_in_time")
+        return {"id": json.dumps({"indices": self._resolve(index)})}
+
+    @_responds
+    def close_point_in_time(self, id=None, **kwargs):
+        self._sleep("close_point_in_time")
+        return {"succeeded": True}
+
+    def _complete(self, hits, suggester, source):
+        # Completion suggester: prefix match (without fuzziness) on the field's inputs
+        prefix = suggester["prefix"].lower()
+        completion = suggester["completion"]
+        options = []
+        for index, id, document in hits:
+            inputs = [value for value in document.get(completion["field"], []) if value.lower().startswith(prefix)]
+            if inputs:
+                options.append(
+                    {"text": inputs[0], "_index": index, "_id": id, "_score": 1.0, "_source": _project(document, source)}
+                )
+                if len(options) == completion.get("size", 5):
+                    break
+        return [{"text": suggester["prefix"], "offset": 0, "length": len(prefix), "options": options}]
+
+    @_responds
+    def search(self, **kwargs):
+        delay = self._sleep("search")
+        return self._search(delay, **kwargs)
+
+    def _search(self, delay, index=None, body=None, from_=0, size=10, source=True, pit=None, search_after=None, scroll=None, suggest=None, aggs=None, **kwargs):
+        body = body or {}
+        indices = json.loads(pit["id"])["indices"] if pit is not None else self._resolve(index)
+        source = body.get("_source", source)
+        size = body.get("size", size)
+        from_ = body.get("from", from_)
+
+        hits = sorted(
+            ((name, id, document) for name in indices for id, document in self.documents[name].items()),
+            key=lambda hit: hit[1],
+        )
+        matched = hits
+        if search_after is not None:
+            matched = [hit for hit in hits if hit[1] > search_after[-1]]
+        if scroll is not None:
+            # Everything in the first page, the following scroll is empty
+            from_, size = 0, len(matched)
+        page = matched[from_ : from_ + size]
+
+        res = {
+            "took": int(delay * 1000),
+            "timed_out": False,
+            "_shards": {"total": len(indices), "successful": len(indices), "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": len(matched), "relation": "eq"},
+                "max_score": 1.0 if page else None,
+                "hits": [
+                    {"_index": name, "_id": id, "_score": 1.0, "_source": _project(document, source), "sort": [1.0, id]}
+                    for name, id, document in page
+                ],
+            },
+        }
+        if aggs:
+            key = (tuple(indices), json.dumps(aggs, sort_keys=True))
+            if key not in self.request_cache:
+                self.request_cache[key] = _aggregate([document for _, _, document in hits], aggs)
+            res["aggregations"] = json.loads(json.dumps(self.request_cache[key]))
+        if suggest:
+            res["suggest"] = {name: self._complete(hits, suggester, source) for name, suggester in suggest.items()}
+        if pit is not None:
+            res["pit_id"] = pit["id"]
+        if scroll is not None:
+            res["_scroll_id"] = "fake-scroll"
+        return res
+
+    @_responds
+    def msearch(self, searches, index=None, **kwargs):
+        delay = self._sleep("msearch")
+        responses = [
+            {**self._search(delay, index=header.get("index", index), body=body), "status": 200}
+            for header, body in zip(searches[::2], searches[1::2])
+        ]
+        return {"took": int(delay * 1000), "responses": responses}
+
+    @_responds
+    def scroll(self, scroll_id=None, **kwargs):
+        self._sleep("scroll")
+        return {
+            "_scroll_id": scroll_id,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"hits": []},
+        }
+
+    @_responds
+    def clear_scroll(self, scroll_id=None, **kwargs):
+        return {"succeeded": True}
@@ -0,0 +1,22 @@
+import os
+
+# CHRONO_SERVER_MODE=sync serves `wsgi:app` with gunicorn's sync workers.
+# CHRONO_SERVER_MODE=async serves `asgi:app` with uvicorn workers, where a
+# single worker handles many concurrent searches on its event loop.
+bind = f"0.0.0.0:{os.getenv('CHRONO_PORT', 4713)}"
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
+# HTTP keep-alive towards clients of the service. Connections to Elasticsearch
+# are pooled and reused by the client itself, see CLIENT_OPTIONS in
+# elasticsearch_setup.py (`ELASTIC_MAX_CONNECTIONS`)
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+
+# Load the in-memory course engine once in the master so that the workers
+# share its pages copy-on-write
+preload_app = os.getenv("COURSE_ENGINE", "false") == "true"
+
+if os.getenv("CHRONO_SERVER_MODE", "sync") == "async":
+    wsgi_app = "asgi:app"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "wsgi:app"
@@ -0,0 +1,246 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Latency histograms and counters exported in the Prometheus text format by
+# `/metrics`. Every process keeps its own, so with several Gunicorn workers a
+# scrape sees the worker that served it.
+
+logger = logging.getLogger("chrono.slow_queries")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {entry['count']}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(entry['sum'])}")
+                lines.append(f"{self.name}_count{labels} {entry['count']}")
+        return lines
+
+
+request_seconds = Histogram(
+    "chrono_request_seconds",
+    "Wall-clock time to handle a request, by the query parameters it used",
+    ("endpoint", "params"),
+)
+responses_total = Counter(
+    "chrono_responses_total",
+    "Responses sent, by status code",
+    ("endpoint", "method", "status"),
+)
+stage_seconds = Histogram(
+    "chrono_stage_seconds",
+    "Time spent in each stage of a request",
+    ("endpoint", "stage"),
+)
+es_took_seconds = Histogram(
+    "chrono_es_took_seconds",
+    "Time Elasticsearch reported for a search (`took`), next to the `es` stage's wall-clock time",
+    ("endpoint",),
+)
+
+registry = [request_seconds, responses_total, stage_seconds, es_took_seconds]
+
+# `{"endpoint", "params", "started", "timings"}` for the request being handled,
+# set per thread under Flask and per task under `asgi.py`
+_current = contextvars.ContextVar("chrono_request_timings", default=None)
+
+
+# The query parameters the endpoints read. Anything else is labelled "other", so
+# that made-up parameters cannot create an unbounded number of label values.
+KNOWN_PARAMS = {
+    "query", "name", "code", "dept", "instructor", "time", "free", "avoid",
+    "year", "authorId", "acadYear", "semester", "degree", "course", "freeDay", "maxHours", "noClashWith",
+    "from", "size", "fields", "cursor", "hits", "profile", "sync", "overwrite",
+}
+
+
+def used_params(args):
+    used = {key if key in KNOWN_PARAMS else "other" for key, value in args.items(multi=True) if value}
+    return "+".join(sorted(used)) or "none"
+
+
+def fingerprint(args):
+    """The shape of a request's parameters, each with how often it was repeated, e.g. `degree+instructor×2+query`."""
+    counts = {}
+    for key, value in args.items(multi=True):
+        if value:
+            counts[key] = counts.get(key, 0) + 1
+    return "+".join(key if count == 1 else f"{key}×{count}" for key, count in sorted(counts.items())) or "none"
+
+
+class SlowQueryLog:
+    """
+    Requests slower than `threshold` seconds, aggregated per endpoint and
+    parameter `fingerprint`, keeping the `maxsize` most recently seen.
+    """
+
+    def __init__(self, threshold, maxsize):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, fingerprint, seconds, es_took=None, example=None):
+        if seconds < self.threshold:
+            return
+        logger.warning("Slow request: %s %s took %.0f ms", endpoint, fingerprint, seconds * 1000)
+        with self._lock:
+            entry = self._entries.pop((endpoint, fingerprint), None)
+            if entry is None:
+                entry = {"endpoint": endpoint, "fingerprint": fingerprint, "count": 0, "total_ms": 0.0, "max_ms": 0.0}
+            entry["count"] += 1
+            entry["total_ms"] += seconds * 1000
+            if seconds * 1000 >= entry["max_ms"]:
+                entry["max_ms"] = seconds * 1000
+                entry["max_es_took_ms"] = es_took * 1000 if es_took is not None else None
+                entry["example"] = example
+            entry["last_seen"] = time.time()
+            self._entries[(endpoint, fingerprint)] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def summary(self):
+        """Aggregates, the most total time first."""
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        for entry in entries:
+            entry["mean_ms"] = entry["total_ms"] / entry["count"]
+        return sorted(entries, key=lambda entry: entry["total_ms"], reverse=True)
+
+
+slow_queries = SlowQueryLog(
+    threshold=float(os.getenv("SLOW_QUERY_MS", 500)) / 1000,
+    maxsize=int(os.getenv("SLOW_QUERY_LOG_SIZE", 200)),
+)
+
+
+def begin_request(endpoint, args):
+    _current.set(
+        {
+            "endpoint": endpoint,
+            "params": used_params(args),
+            "fingerprint": fingerprint(args),
+            "query": args.to_dict(flat=False),
+            "started": time.perf_counter(),
+            "timings": [],
+        }
+    )
+
+
+def _record(stage, seconds):
+    current = _current.get()
+    endpoint = current["endpoint"] if current else "none"
+    stage_seconds.observe(seconds, endpoint=endpoint, stage=stage)
+    if current:
+        current["timings"].append((stage, seconds))
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - started)
+
+
+def record_took(res):
+    """Record the `took` of a search response next to the wall-clock `es` stage."""
+    took = res.get("took")
+    if took is None:
+        return
+    current = _current.get()
+    es_took_seconds.observe(took / 1000, endpoint=current["endpoint"] if current else "none")
+    if current:
+        current["timings"].append(("es-took", took / 1000))
+
+
+def finish_request(method, status):
+    """Record the request and return its `Server-Timing` header value."""
+    current = _current.get()
+    if current is None:
+        return None
+    _current.set(None)
+    elapsed = time.perf_counter() - current["started"]
+    request_seconds.observe(elapsed, endpoint=current["endpoint"], params=current["params"])
+    responses_total.inc(endpoint=current["endpoint"], method=method, status=str(status))
+    if "profile" not in current["query"]:
+        # Profiled searches are slower by design and would skew their fingerprint
+        es_took = next((seconds for name, seconds in current["timings"] if name == "es-took"), None)
+        slow_queries.record(current["endpoint"], current["fingerprint"], elapsed, es_took, current["query"])
+    timings = current["timings"] + [("total", elapsed)]
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings)
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
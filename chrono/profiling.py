@@ -0,0 +1,91 @@
+import hmac
+
+from elasticsearch_setup import unhurried_client
+from flask import current_app
+from metrics import record_took, stage
+
+# Admin-only `profile=1` searches, run with the Elasticsearch profile API and
+# answered with a per-clause breakdown of where the query spent its time.
+
+
+def is_admin(request):
+    """Whether `request` carries the `ADMIN_TOKEN` in `X-Admin-Token`. Always false when no token is set."""
+    token = current_app.config['ADMIN_TOKEN']
+    given = request.headers.get("X-Admin-Token", "")
+    return bool(token) and hmac.compare_digest(given.encode(), token.encode())
+
+
+def wants_profile(args):
+    return args.get("profile") in ["1", "true"]
+
+
+def profile_search(params, format_results):
+    """Run the search described by `params` uncached, with its results, `took` and condensed profile."""
+    with stage("es"):
+        res = unhurried_client().search(**params, profile=True)
+    record_took(res)
+    return {"results": format_results(res), "took": res["took"], "profile": condense_profile(res.get("profile", {}))}
+
+
+def condense_profile(profile):
+    """
+    Merge the query profiles of every shard into one tree of clauses, each
+    with its total time, its share of the whole query and the Lucene phase
+    (such as `build_scorer` or `next_doc`) that took most of it.
+    """
+    merged = []
+    for shard in profile.get("shards", []):
+        for search in shard["searches"]:
+            _merge(merged, search["query"])
+    total = sum(node["time_in_nanos"] for node in merged) or 1
+    return {
+        "shards": len(profile.get("shards", [])),
+        "time_ms": total / 1e6,
+        "clauses": [_condense(node, total) for node in merged],
+    }
+
+
+def _merge(into, nodes):
+    # Matched by clause rather than position: shards (and partitions) rewrite
+    # fuzzy and terms queries against their own terms, so their trees differ.
+    # A clause repeated among siblings is matched occurrence by occurrence
+    used = set()
+    for node in nodes:
+        target = next(
+            (
+                merged
+                for merged in into
+                if id(merged) not in used
+                and (merged["type"], merged["description"]) == (node["type"], node["description"])
+            ),
+            None,
+        )
+        if target is None:
+            target = {
+                "type": node["type"],
+                "description": node["description"],
+                "time_in_nanos": 0,
+                "breakdown": {},
+                "children": [],
+            }
+            into.append(target)
+        used.add(id(target))
+        target["time_in_nanos"] += node["time_in_nanos"]
+        for phase, nanos in node.get("breakdown", {}).items():
+            if not phase.endswith("_count"):
+                target["breakdown"][phase] = target["breakdown"].get(phase, 0) + nanos
+        _merge(target["children"], node.get("children", []))
+
+
+def _condense(node, total):
+    breakdown = node["breakdown"]
+    condensed = {
+        "type": node["type"],
+        "description": node["description"][:200],
+        "time_ms": node["time_in_nanos"] / 1e6,
+        "share": round(node["time_in_nanos"] / total, 3),
+        "dominant": max(breakdown, key=breakdown.get) if breakdown else None,
+    }
+    if node["children"]:
+        condensed["children"] = [_condense(child, total) for child in node["children"]]
+    return condensed
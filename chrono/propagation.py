@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+from collections import deque
+
+from course_cache import get_course_summaries
+from elasticsearch import helpers
+from elasticsearch_setup import TIMETABLE_INDEX, client
+from search_cache import bump_generation
+from timetable import embedded_courses, timetable_course_ids
+
+
+# Bulk item statuses worth retrying: rejected by a busy cluster, still conflicting
+# after `retry_on_conflict` or failed on the node
+RETRY_STATUSES = {409, 429, 500, 502, 503, 504}
+
+
+class CoursePropagator:
+    """
+    Rewrites the `courses` embedded in timetables after courses are added,
+    replaced or removed. Changed course ids are queued by the request that
+    wrote them and handled by a background thread, which finds the timetables
+    with a section of any of them and sends partial updates in bulk batches of
+    `batch_size`, at most `max_rate` timetables per second. Every process
+    propagates the writes it handled.
+    """
+
+    def __init__(self, batch_size, max_rate, refresh):
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.refresh = refresh
+
+        # `{course_id: queued_at}`, a course changed twice before it is handled is propagated once
+        self._pending = {}
+        # `{timetable_id: course ids}` of the timetables sent by the running propagation
+        self._course_ids = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+        self.running = 0
+        self.runs = 0
+        self.courses = 0
+        self.updated = 0
+        self.failed = 0
+        self.retries = 0
+        # Seconds slept before the next run after one that left courses to retry, doubling up to a minute
+        self._backoff = 0.0
+        self.last_run_seconds = 0.0
+        self.last_lag_seconds = 0.0
+        self.recent_errors = deque(maxlen=20)
+
+    def _ensure_started(self):
+        # Started lazily so that a propagator imported before Gunicorn forks runs in each worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending.clear()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def put(self, course_id):
+        self._ensure_started()
+        with self._lock:
+            self._pending.setdefault(course_id, time.time())
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while self._pending:
+                with self._lock:
+                    queued = self._pending
+                    self._pending = {}
+                self.running = len(queued)
+                try:
+                    retry = self.propagate(sorted(queued))
+                except Exception as e:
+                    retry = set(queued)
+                    self.recent_errors.append({"error": str(e), "at": time.time()})
+                finally:
+                    self.running = 0
+                if retry:
+                    # Requeued, unless changed again since, for the next run
+                    with self._lock:
+                        for course_id in retry:
+                            self._pending.setdefault(course_id, queued[course_id])
+                    self.retries += len(retry)
+                    self._backoff = min(self._backoff * 2 or 1.0, 60.0)
+                    time.sleep(self._backoff)
+                else:
+                    self._backoff = 0.0
+                    self.last_lag_seconds = time.time() - min(queued.values())
+
+    def propagate(self, course_ids):
+        """
+        Recompute the embedded `courses` of every timetable with a section of
+        one of `course_ids`, except in archived (write-blocked) partitions.
+        Returns the course ids whose timetables could not all be updated for
+        now and are worth another try.
+        """
+        started = time.monotonic()
+        indices = self._writable_indices()
+        if not indices:
+            return set()
+        hits = helpers.scan(
+            client,
+            index=indices,
+            query={
+                "query": {
+                    "nested": {"path": "sections", "query": {"terms": {"sections.courseId": course_ids}}}
+                },
+                "_source": ["sections.courseId"],
+            },
+        )
+
+        def actions():
+            batch = []
+            for hit in hits:
+                batch.append(hit)
+                if len(batch) == self.batch_size:
+                    yield from self._throttled(batch)
+                    batch = []
+            if batch:
+                yield from self._throttled(batch)
+
+        updated = 0
+        retry = set()
+        for ok, item in helpers.streaming_bulk(
+            client, actions(), chunk_size=self.batch_size, raise_on_error=False, raise_on_exception=False
+        ):
+            if ok:
+                updated += 1
+                continue
+            item = next(iter(item.values()))
+            self.failed += 1
+            self.recent_errors.append(
+                {"id": item.get("_id"), "status": item.get("status"), "error": item.get("error")}
+            )
+            # A timetable removed since the scan has nothing left to update
+            if item.get("status") in RETRY_STATUSES:
+                retry |= self._course_ids.get(item.get("_id"), set()) & set(course_ids)
+
+        if updated:
+            if self.refresh != "false":
+                client.indices.refresh(index=TIMETABLE_INDEX)
+            bump_generation(TIMETABLE_INDEX)
+        self.runs += 1
+        self.courses += len(course_ids)
+        self.updated += updated
+        self.last_run_seconds = time.monotonic() - started
+        self._course_ids = {}
+        return retry
+
+    def _writable_indices(self):
+        settings = client.indices.get_settings(index=TIMETABLE_INDEX, name="index.blocks.write", flat_settings=True)
+        return sorted(
+            index for index, value in settings.items() if value["settings"].get("index.blocks.write") != "true"
+        )
+
+    def _throttled(self, hits):
+        # Paced per batch so that propagation does not crowd out searches
+        started = time.monotonic()
+        yield from self._updates(hits)
+        if self.max_rate:
+            delay = started + len(hits) / self.max_rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _updates(self, hits):
+        # One multi-get for the courses of the whole batch, changed ones are no longer cached
+        course_ids = {id for hit in hits for id in timetable_course_ids(hit["_source"])}
+        courses = get_course_summaries(course_ids)
+        for hit in hits:
+            self._course_ids[hit["_id"]] = set(timetable_course_ids(hit["_source"]))
+            yield {
+                "_op_type": "update",
+                "_index": hit["_index"],
+                "_id": hit["_id"],
+                "retry_on_conflict": 3,
+                "doc": {"courses": embedded_courses(timetable_course_ids(hit["_source"]), courses)},
+            }
+
+    def stats(self):
+        with self._lock:
+            oldest = min(self._pending.values()) if self._pending else None
+        return {
+            "depth": len(self._pending),
+            "running": self.running,
+            "oldest_pending_seconds": time.time() - oldest if oldest else 0.0,
+            "last_lag_seconds": self.last_lag_seconds,
+            "runs": self.runs,
+            "courses": self.courses,
+            "updated": self.updated,
+            "failed": self.failed,
+            "retries": self.retries,
+            "last_run_seconds": self.last_run_seconds,
+            "recent_errors": list(self.recent_errors),
+        }
+
+
+course_propagator = CoursePropagator(
+    batch_size=int(os.getenv("PROPAGATION_BATCH", 200)),
+    max_rate=float(os.getenv("PROPAGATION_RATE", 500)),
+    refresh=os.getenv("REFRESH_SETTING", "wait_for"),
+)
@@ -0,0 +1,213 @@
+import contextvars
+import os
+import threading
+import time
+
+from cache import TTLCache
+from search_cache import without_generation
+from elastic_transport import TransportError
+from elasticsearch import ApiError
+
+# Keeps Elasticsearch outages (GC pauses, restarts) from tying up every worker:
+# read calls get a short deadline, a circuit breaker fails calls fast once
+# Elasticsearch keeps failing, and searches fall back to the last result seen
+# for the same query, marked stale.
+
+SEARCH_TIMEOUT = float(os.getenv("ELASTIC_SEARCH_TIMEOUT", 2))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", 10))
+
+STALE_WARNING = '110 - "Response is Stale"'
+
+# Client methods that only read and are given the `SEARCH_TIMEOUT` deadline
+READ_METHODS = {"search", "msearch", "count", "get", "mget", "open_point_in_time"}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_unavailable(error):
+    """Whether `error` means Elasticsearch is down or overloaded, rather than a bad request."""
+    if isinstance(error, (TransportError, CircuitOpenError)):
+        return True
+    return isinstance(error, ApiError) and (error.meta.status >= 500 or error.meta.status == 429)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive calls fail with `is_unavailable`, so
+    that calls fail at once with CircuitOpenError instead of waiting on their
+    deadline. After `reset` seconds one call is let through to probe
+    Elasticsearch, closing the breaker if it succeeds.
+    """
+
+    def __init__(self, failures, reset):
+        self.failures = failures
+        self.reset = reset
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if self._probing or time.monotonic() - self._opened_at >= self.reset:
+            return "half_open"
+        return "open"
+
+    def before(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if not self._probing and time.monotonic() - self._opened_at >= self.reset:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError("Elasticsearch is unavailable")
+
+    def succeeded(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failed(self, error):
+        if not is_unavailable(error):
+            # The probe got an answer, Elasticsearch is back
+            self.succeeded()
+            return
+        with self._lock:
+            self._consecutive += 1
+            if self._probing or (self._opened_at is None and self._consecutive >= self.failures):
+                if self._opened_at is None:
+                    self.opened += 1
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def call(self, method, *args, **kwargs):
+        self.before()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            self.failed(e)
+            raise
+        self.succeeded()
+        return result
+
+    async def call_async(self, method, *args, **kwargs):
+        self.before()
+        try:
+            result = await method(*args, **kwargs)
+        except Exception as e:
+            self.failed(e)
+            raise
+        self.succeeded()
+        return result
+
+    def stats(self):
+        return {"state": self.state, "opened": self.opened, "rejected": self.rejected}
+
+
+class GuardedClient:
+    """
+    Wraps an Elasticsearch client, or one of its namespaces such as `indices`,
+    so that every API call goes through `breaker`, and calls in READ_METHODS
+    have a `SEARCH_TIMEOUT` deadline unless the caller gave its own
+    `request_timeout`, through `options()` or the call.
+    """
+
+    def __init__(self, target, breaker, root=True, timed=False):
+        self._target = target
+        self._breaker = breaker
+        self._root = root
+        self._timed = timed
+
+    def options(self, **kwargs):
+        timed = self._timed or "request_timeout" in kwargs
+        return GuardedClient(self._target.options(**kwargs), self._breaker, timed=timed)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if name.startswith("_") or name == "transport":
+            return attribute
+        if not callable(attribute):
+            return GuardedClient(attribute, self._breaker, root=False)
+        timed = self._timed or not self._root or name not in READ_METHODS
+
+        def call(*args, **kwargs):
+            method = attribute
+            if not timed and "request_timeout" not in kwargs:
+                method = getattr(self._target.options(request_timeout=SEARCH_TIMEOUT), name)
+            return self._breaker.call(method, *args, **kwargs)
+
+        return call
+
+
+breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET)
+
+# Last successful results per search cache key (across writes, which change the
+# key's generation), served when Elasticsearch is unavailable
+last_known_good = TTLCache(
+    maxsize=int(os.getenv("STALE_STORE_SIZE", 5000)),
+    ttl=int(os.getenv("STALE_STORE_TTL", 86400)),
+)
+
+# Cluster health for `/health`, fetched at most once per `HEALTH_CACHE_TTL` seconds
+health_cache = TTLCache(maxsize=1, ttl=float(os.getenv("HEALTH_CACHE_TTL", 2)))
+
+_stale = contextvars.ContextVar("stale", default=False)
+
+
+def reset_stale():
+    _stale.set(False)
+
+
+def served_stale():
+    return _stale.get()
+
+
+def remember(key, results):
+    last_known_good.set(without_generation(key), results)
+
+
+def stale_results(key):
+    """The last good results for the search cache key `key`, marking the response stale, or None."""
+    results = last_known_good.get(without_generation(key))
+    if results is not None:
+        _stale.set(True)
+    return results
+
+
+def with_fallback(key, search):
+    """
+    Return `search()`, remembering it as the last good result for `key`, or
+    the remembered result when Elasticsearch is unavailable, in which case the
+    response is marked stale. Re-raises when there is nothing to fall back on.
+    """
+    try:
+        results = search()
+    except Exception as e:
+        return _fall_back(key, e)
+    remember(key, results)
+    return results
+
+
+async def with_fallback_async(key, search):
+    try:
+        results = await search()
+    except Exception as e:
+        return _fall_back(key, e)
+    remember(key, results)
+    return results
+
+
+def _fall_back(key, error):
+    results = stale_results(key) if is_unavailable(error) else None
+    if results is None:
+        raise error
+    return results
@@ -0,0 +1,165 @@
+from course import (
+    course_field_presets,
+    course_search_cache_key,
+    course_search_params,
+    course_search_results,
+    get_course_queries,
+    search_courses,
+)
+from course_engine import course_engine
+from elasticsearch_setup import client
+from flask import Blueprint, jsonify, request, current_app
+from jsonschema import ValidationError
+from metrics import record_took, stage
+from resilience import is_unavailable, remember, stale_results
+from search_cache import search_cache
+from timetable import (
+    get_timetable_queries,
+    timetable_field_presets,
+    timetable_search_cache_key,
+    timetable_search_params,
+    timetable_search_results,
+)
+from utils import compile_validator, parse_source_filter, validate_with
+from werkzeug.datastructures import MultiDict
+
+search = Blueprint("search", __name__)
+
+batch_schema = {
+    "type": "object",
+    "properties": {
+        "searches": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {"enum": ["course", "timetable"]},
+                    # The query parameters of /course/search or /timetable/search
+                    "params": {
+                        "type": "object",
+                        "additionalProperties": {
+                            "type": ["string", "integer", "array"],
+                            "items": {"type": ["string", "integer"]},
+                        },
+                    },
+                },
+                "required": ["type", "params"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["searches"],
+    "additionalProperties": False,
+}
+
+batch_validator = compile_validator(batch_schema)
+
+
+def msearch_body(params):
+    """Translate keyword arguments for `client.search` to an `_msearch` header and body."""
+    header = {"index": params["index"]}
+    if params.get("ignore_unavailable"):
+        header["ignore_unavailable"] = True
+    body = {"query": params["query"], "_source": params["source"], "size": params["size"]}
+    if params.get("from_"):
+        body["from"] = params["from_"]
+    return header, body
+
+
+def plan_search(item):
+    """
+    Return `(cache_key, params, format_results)` for one search of a batch,
+    `(None, results, None)` when it is answered without Elasticsearch, or
+    raise ValueError with the error to report for it.
+    """
+    args = MultiDict(item["params"])
+    if item["type"] == "course":
+        queries = get_course_queries(args)
+        if not any(queries.values()):
+            raise ValueError("At least one valid query parameter required")
+        source = parse_source_filter(args.get("fields", type=str), course_field_presets)
+        if course_engine.ready:
+            return None, search_courses(queries, source), None
+        return (
+            course_search_cache_key(queries, source),
+            course_search_params(queries, source),
+            course_search_results,
+        )
+
+    if "cursor" in args:
+        raise ValueError("Cursor pagination is not supported in a batch")
+    start = args.get("from", default=0, type=int)
+    queries = get_timetable_queries(args)
+    source = parse_source_filter(args.get("fields", type=str), timetable_field_presets)
+    return (
+        timetable_search_cache_key(queries, start, source),
+        timetable_search_params(queries, start, source),
+        timetable_search_results,
+    )
+
+
+@search.route("/batch", methods=["POST"])
+def batch_search():
+    data = request.json
+    try:
+        validate_with(batch_validator, data)
+    except ValidationError as e:
+        return jsonify({"error": "Invalid batch: " + e.message}), 400
+    searches = data["searches"]
+    if len(searches) > current_app.config['BATCH_MAX_SEARCHES']:
+        return jsonify({"error": f"At most {current_app.config['BATCH_MAX_SEARCHES']} searches per batch"}), 400
+
+    responses = [None] * len(searches)
+    pending = []
+    with stage("build"):
+        for i, item in enumerate(searches):
+            try:
+                key, params, format_results = plan_search(item)
+            except ValueError as e:
+                responses[i] = {"error": str(e), "status": 400}
+                continue
+            if key is None:
+                responses[i] = {"results": params}
+                continue
+            results = search_cache.get(key)
+            if results is not None:
+                responses[i] = {"results": results}
+                continue
+            pending.append((i, key, params, format_results))
+
+    if pending:
+        body = []
+        for _, _, params, _ in pending:
+            body.extend(msearch_body(params))
+        try:
+            with stage("es"):
+                res = client.msearch(searches=body)
+        except Exception as e:
+            if not is_unavailable(e):
+                raise
+            # Every search is answered from its last good results, where there are any
+            for i, key, _, _ in pending:
+                results = stale_results(key)
+                if results is None:
+                    responses[i] = {"error": "Search is temporarily unavailable", "status": 503}
+                else:
+                    responses[i] = {"results": results}
+            return jsonify(responses), 200
+        record_took(res)
+
+        with stage("hits"):
+            for (i, key, _, format_results), item in zip(pending, res["responses"]):
+                if "error" in item:
+                    error = item["error"]
+                    if isinstance(error, dict):
+                        error = error.get("reason") or error.get("type")
+                    responses[i] = {"error": error, "status": item.get("status", 500)}
+                    continue
+                results = format_results(item)
+                search_cache.set(key, results)
+                remember(key, results)
+                responses[i] = {"results": results}
+
+    with stage("serialize"):
+        response = jsonify(responses)
+    return response, 200
@@ -0,0 +1,61 @@
+import json
+import os
+import threading
+
+from cache import TTLCache
+
+# Parsed search results keyed on `search_cache_key`
+search_cache = TTLCache(
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE", 2000)),
+    ttl=int(os.getenv("SEARCH_CACHE_TTL", 60)),
+)
+
+# `/timetable/facets` responses, kept briefly since they are counted over the
+# whole index and shift with writes made through other workers
+facet_cache = TTLCache(
+    maxsize=int(os.getenv("FACET_CACHE_SIZE", 500)),
+    ttl=int(os.getenv("FACET_CACHE_TTL", 10)),
+)
+
+# Bumped by every write to an index so that keys built before it stop matching.
+# Generations are per process, entries cached by other workers expire with the TTL.
+_generations = {}
+_generation_lock = threading.Lock()
+
+
+def bump_generation(index_name):
+    with _generation_lock:
+        _generations[index_name] = _generations.get(index_name, 0) + 1
+
+
+def normalize_queries(queries, case_sensitive=()):
+    """
+    Drop empty values, sort multi-valued parameters and case fold strings for
+    every key not in `case_sensitive`, so that searches which build the same
+    Elasticsearch query share a cache entry.
+    """
+    normalized = {}
+    for key, value in queries.items():
+        fold = key not in case_sensitive
+        if isinstance(value, list):
+            value = sorted(v.casefold() if fold and isinstance(v, str) else v for v in value if v)
+        elif fold and isinstance(value, str):
+            value = value.casefold()
+        # Zero is a value, `maxHours=0` is not the same search as no `maxHours`
+        if value or value == 0 and not isinstance(value, bool):
+            normalized[key] = value
+    return normalized
+
+
+def search_cache_key(index_name, queries, **params):
+    return (
+        index_name,
+        _generations.get(index_name, 0),
+        json.dumps(queries, sort_keys=True),
+        json.dumps(params, sort_keys=True),
+    )
+
+
+def without_generation(key):
+    """`key` from `search_cache_key`, matching the same search before and after writes."""
+    return (key[0],) + key[2:]
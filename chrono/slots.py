@@ -0,0 +1,53 @@
+# Weekly class slots, as the `day:hour` names sections store in `time` and as
+# bitmasks with one bit per slot, which make clash checks a single `&`.
+# Masks are stored in documents as fixed-width hex strings.
+
+DAYS = ["M", "T", "W", "Th", "F", "S"]
+HOURS = 12
+
+SLOTS = [f"{day}:{hour}" for day in DAYS for hour in range(1, HOURS + 1)]
+_BITS = {slot: 1 << i for i, slot in enumerate(SLOTS)}
+
+DAY_MASKS = {day: sum(_BITS[f"{day}:{hour}"] for hour in range(1, HOURS + 1)) for day in DAYS}
+
+
+# JSON schema `pattern` of a `roomTime` entry, `code:room:day:hour`, whose slot
+# is one of SLOTS. Writes are validated against it, so that no stored time is
+# left out of a mask.
+ROOM_TIME_PATTERN = rf":({'|'.join(DAYS)}):({'|'.join(str(hour) for hour in range(1, HOURS + 1))})$"
+
+
+def mask_of(slots):
+    """
+    Return the mask of the `day:hour` names in `slots`, ignoring any that are
+    not a slot (stored times are validated, query parameters are not).
+    """
+    mask = 0
+    for slot in slots:
+        mask |= _BITS.get(slot, 0)
+    return mask
+
+
+def slots_of(mask):
+    return [slot for slot in SLOTS if mask & _BITS[slot]]
+
+
+def to_hex(mask):
+    return f"{mask:0{(len(SLOTS) + 3) // 4}x}"
+
+
+def from_hex(value):
+    return int(value, 16)
+
+
+def room_time_slots(room_times):
+    """`day:hour` names of `roomTime` entries, `code:room:day:hour`."""
+    return [":".join(room_time.split(":")[-2:]) for room_time in room_times]
+
+
+def course_mask(course):
+    """Union of the masks of a (prepared) course's sections."""
+    mask = 0
+    for section in course["sections"]:
+        mask |= mask_of(section["time"])
+    return mask
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from elasticsearch import helpers
+from elasticsearch_setup import COURSE_INDEX, client
+
+# Syncs the course catalog from ChronoFactorem into the search service:
+#
+#   python sync.py [--upstream URL] [--service URL] [--concurrency N] [--prune]
+#
+# Only courses that are new or whose `createdAt` changed are fetched and
+# written, in bulk. Progress is checkpointed so an interrupted run resumes
+# where it stopped.
+
+
+class ChronoUpstream:
+    """Course source backed by the ChronoFactorem API, or anything serving the same routes."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def list_courses(self):
+        res = self.session.get(f"{self.base_url}/course", timeout=30)
+        res.raise_for_status()
+        return res.json()
+
+    def get_course(self, course_id):
+        res = self.session.get(f"{self.base_url}/course/{course_id}", timeout=30)
+        res.raise_for_status()
+        return res.json()
+
+
+def indexed_versions():
+    """Return `{course_id: createdAt}` for every course in the index."""
+    hits = helpers.scan(
+        client,
+        index=COURSE_INDEX,
+        query={"query": {"match_all": {}}, "_source": ["createdAt"]},
+    )
+    return {hit["_id"]: hit["_source"].get("createdAt") for hit in hits}
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return set(json.load(f)["done"])
+
+
+def save_checkpoint(path, done):
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"done": sorted(done)}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def write_courses(service_url, courses):
+    body = "\n".join(json.dumps(course) for course in courses)
+    res = requests.post(
+        f"{service_url}/course/bulk",
+        params={"overwrite": "true"},
+        data=body.encode(),
+        headers={"Content-Type": "application/x-ndjson"},
+        timeout=300,
+    )
+    res.raise_for_status()
+    return res.json()["errors"]
+
+
+def sync_courses(upstream, service_url, concurrency=8, batch_size=200, checkpoint=".sync_checkpoint", prune=False):
+    listed = upstream.list_courses()
+    indexed = indexed_versions()
+    done = load_checkpoint(checkpoint)
+
+    changed = [
+        course["id"]
+        for course in listed
+        if course["id"] not in done
+        and (course["id"] not in indexed or course.get("createdAt") != indexed[course["id"]])
+    ]
+    print(f"{len(listed)} upstream, {len(indexed)} indexed, {len(changed)} to sync, {len(done)} already synced")
+
+    written = failed = 0
+    batch = []
+
+    def flush():
+        nonlocal written, failed
+        errors = write_courses(service_url, batch)
+        failed_ids = {error["id"] for error in errors}
+        for error in errors:
+            print(f"{error['id']}: {error['error']}")
+        done.update(course["id"] for course in batch if course["id"] not in failed_ids)
+        save_checkpoint(checkpoint, done)
+        written += len(batch) - len(failed_ids)
+        failed += len(failed_ids)
+        batch.clear()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(upstream.get_course, course_id): course_id for course_id in changed}
+        for future in as_completed(futures):
+            try:
+                batch.append(future.result())
+            except requests.RequestException as e:
+                print(f"{futures[future]}: {e}")
+                failed += 1
+                continue
+            if len(batch) >= batch_size:
+                flush()
+    if batch:
+        flush()
+
+    removed = 0
+    if prune:
+        listed_ids = {course["id"] for course in listed}
+        for course_id in indexed.keys() - listed_ids:
+            res = requests.delete(f"{service_url}/course/remove", json={"id": course_id}, timeout=30)
+            removed += res.status_code == 204
+
+    print(f"{written} written, {failed} failed, {removed} removed")
+    if not failed:
+        # Finished cleanly, the next run diffs from scratch
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+    return written, failed, removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync courses from ChronoFactorem into the search service")
+    parser.add_argument("--upstream", default=os.getenv("CHRONO_API_URL", "https://www.chrono.crux-bphc.com/api"))
+    parser.add_argument("--service", default=os.getenv("SEARCH_SERVICE_URL", "http://localhost:5000"))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--checkpoint", default=".sync_checkpoint")
+    parser.add_argument("--prune", action="store_true", help="remove indexed courses that no longer exist upstream")
+    args = parser.parse_args()
+
+    sync_courses(
+        ChronoUpstream(args.upstream),
+        args.service.rstrip("/"),
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        checkpoint=args.checkpoint,
+        prune=args.prune,
+    )
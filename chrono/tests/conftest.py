@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# The modules import each other by name, as when run from `chrono/`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The real client is constructed on import but never connects: it is swapped
+# for a FakeElasticsearch before any module does `from elasticsearch_setup import client`
+os.environ.setdefault("ELASTIC_URL", "http://localhost:9200")
+os.environ.setdefault("ELASTIC_USERNAME", "elastic")
+os.environ.setdefault("ELASTIC_PASSWORD", "test")
+
+import elasticsearch_setup  # noqa: E402
+from fake_elasticsearch import FakeElasticsearch  # noqa: E402
+
+elasticsearch_setup.client = FakeElasticsearch()
+
+
+@pytest.fixture
+def es():
+    """The fake every module talks to, emptied along with the caches in front of it."""
+    from course_cache import course_cache
+    from search_cache import facet_cache, search_cache
+
+    fake = elasticsearch_setup.client
+    fake.documents.clear()
+    fake.mappings.clear()
+    fake.aliases.clear()
+    fake.settings.clear()
+    fake.request_cache.clear()
+    fake.tasks_done.clear()
+    fake.latency, fake.calls = 0.0, {}
+    elasticsearch_setup._partitions.clear()
+    elasticsearch_setup._partitioned = None
+    elasticsearch_setup._partition_cache.clear()
+    for cache in [course_cache, search_cache, facet_cache]:
+        cache.clear()
+    return fake
+
+
+@pytest.fixture
+def client(es):
+    from app import app
+
+    return app.test_client()
+
+
+@pytest.fixture
+def service(es):
+    """The app served over HTTP on a free local port, for clients such as `sync.py`."""
+    from app import app
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import threading
+
+import elasticsearch_setup
+from benchmark import synthetic_courses, synthetic_timetables
+
+
+class AsyncFake:
+    """Answers `asgi.py`'s searches from the sync fake."""
+
+    def __init__(self, es):
+        self.es = es
+
+    def options(self, **kwargs):
+        return self
+
+    async def search(self, **kwargs):
+        return self.es.search(**kwargs)
+
+
+def get(app, path, query_string=b""):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": query_string, "headers": []}
+    asyncio.run(app(scope, receive, send))
+    return messages[0]["status"]
+
+
+def test_partitions_are_listed_off_the_event_loop(es, client, monkeypatch):
+    import asgi
+
+    courses = synthetic_courses(10)
+    body = "\n".join(json.dumps(course) for course in courses)
+    assert not client.post("/course/bulk", data=body, content_type="application/x-ndjson").json["errors"]
+    for timetable in synthetic_timetables(4, courses):
+        assert client.post("/timetable/add", json=timetable).status_code == 201
+    elasticsearch_setup._partition_cache.clear()
+    monkeypatch.setattr(asgi, "async_client", AsyncFake(es))
+
+    listed_on = []
+    get_alias = es.indices.get_alias
+
+    def recording_get_alias(**kwargs):
+        listed_on.append(threading.current_thread())
+        return get_alias(**kwargs)
+
+    monkeypatch.setattr(es.indices, "get_alias", recording_get_alias)
+    assert get(asgi.app, "/timetable/search", b"acadYear=2024") == 200
+    assert get(asgi.app, "/timetable/facets", b"semester=1") == 200
+    assert listed_on and threading.main_thread() not in listed_on
@@ -0,0 +1,127 @@
+import json
+
+import pytest
+from combinations import BudgetExceeded, enumerate_combinations
+from slots import SLOTS, mask_of
+
+
+def section(id, type, time, instructors=()):
+    return {"id": id, "type": type, "time": time, "instructors": list(instructors)}
+
+
+def course(id, *sections):
+    return {"id": id, "sections": list(sections)}
+
+
+def ids(combinations):
+    return [sorted(section["id"] for section in sections) for sections in combinations]
+
+
+def test_no_two_picked_sections_clash():
+    courses = [
+        course("a", section("a-L1", "L", ["M:1"]), section("a-L2", "L", ["M:2"]), section("a-T1", "T", ["T:1"])),
+        course("b", section("b-L1", "L", ["M:1"]), section("b-L2", "L", ["M:3"])),
+        course("c", section("c-L1", "L", ["M:2", "T:1"]), section("c-L2", "L", ["W:1"])),
+    ]
+    found = ids(enumerate_combinations(courses))
+    assert sorted(found) == [
+        ["a-L1", "a-T1", "b-L2", "c-L2"],
+        ["a-L2", "a-T1", "b-L1", "c-L2"],
+        ["a-L2", "a-T1", "b-L2", "c-L2"],
+    ]
+    for sections in enumerate_combinations(courses):
+        taken = 0
+        for picked in sections:
+            assert not mask_of(picked["time"]) & taken
+            taken |= mask_of(picked["time"])
+
+
+def test_blocked_slots_are_never_picked():
+    courses = [course("a", section("a-L1", "L", ["M:1"]), section("a-L2", "L", ["M:2"]))]
+    assert ids(enumerate_combinations(courses, blocked=mask_of(["M:1"]))) == [["a-L2"]]
+    # Nothing left for a type, so no combination at all
+    assert ids(enumerate_combinations(courses, blocked=mask_of(["M:1", "M:2"]))) == []
+
+
+def test_preferred_instructors_come_first():
+    courses = [
+        course(
+            "a",
+            section("a-L1", "L", ["M:1"], ["Anil Sharma"]),
+            section("a-L2", "L", ["M:2"], ["Priya Rao"]),
+            section("a-L3", "L", ["M:3"], ["Ravi Iyer"]),
+        )
+    ]
+    assert ids(enumerate_combinations(courses, instructors=["priya rao"])) == [["a-L2"], ["a-L1"], ["a-L3"]]
+
+
+def test_limit():
+    courses = [course("a", *(section(f"a-L{i}", "L", [slot]) for i, slot in enumerate(SLOTS[:10])))]
+    assert len(list(enumerate_combinations(courses, limit=4))) == 4
+
+
+def test_hopeless_searches_give_up():
+    # Ten courses for nine slots: every pick fits on its own, none fits all of them
+    courses = [course(f"c{i}", *(section(f"c{i}-{slot}", "L", [slot]) for slot in SLOTS[:9])) for i in range(10)]
+    with pytest.raises(BudgetExceeded):
+        list(enumerate_combinations(courses, max_picks=10000))
+
+
+def add_course(client, id, sections):
+    res = client.post(
+        "/course/add",
+        json={
+            "id": id,
+            "code": f"CS F{id}",
+            "name": f"Course {id}",
+            "sections": [
+                {
+                    "id": f"{id}-{number}",
+                    "courseId": id,
+                    "type": "L",
+                    "number": number,
+                    "instructors": [],
+                    "roomTime": [f"CS F{id}:F101:{slot}"],
+                    "createdAt": "2024-07-01T00:00:00.000Z",
+                }
+                for number, slot in enumerate(sections, start=1)
+            ],
+            "midsemStartTime": None,
+            "midsemEndTime": None,
+            "compreStartTime": None,
+            "compreEndTime": None,
+            "archived": False,
+            "acadYear": 2024,
+            "semester": 1,
+            "createdAt": "2024-07-01T00:00:00.000Z",
+        },
+    )
+    assert res.status_code == 201, res.json
+
+
+def test_endpoint_streams_combinations(client):
+    add_course(client, "101", ["M:1", "M:2"])
+    add_course(client, "102", ["M:1"])
+    res = client.post("/course/combinations", json={"courseIds": ["101", "102"]})
+    assert res.status_code == 200
+    lines = [json.loads(line) for line in res.data.decode().splitlines()]
+    assert [sorted(section["id"] for section in line["sections"]) for line in lines] == [["101-2", "102-1"]]
+    assert "mask" not in lines[0]["sections"][0]
+
+
+def test_endpoint_ends_with_an_error_line_when_it_gives_up(client, monkeypatch):
+    from app import app
+
+    for i in range(10):
+        add_course(client, str(200 + i), SLOTS[:9])
+    monkeypatch.setitem(app.config, "COMBINATIONS_MAX_PICKS", 10000)
+    res = client.post("/course/combinations", json={"courseIds": [str(200 + i) for i in range(10)]})
+    assert res.status_code == 200
+    assert "error" in json.loads(res.data.decode().splitlines()[-1])
+
+
+def test_endpoint_rejects_too_many_courses(client):
+    from course import COMBINATIONS_MAX_COURSES
+
+    res = client.post("/course/combinations", json={"courseIds": [str(i) for i in range(COMBINATIONS_MAX_COURSES + 1)]})
+    assert res.status_code == 400
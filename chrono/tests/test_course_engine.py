@@ -0,0 +1,183 @@
+import math
+import threading
+import time
+
+from benchmark import synthetic_courses
+from course import prepare_course
+import course_engine
+from course_engine import CourseEngine, CourseIndex, TermIndex, compare_with_elasticsearch, edit_distance
+from elasticsearch_setup import COURSE_INDEX
+from fake_elasticsearch import FakeElasticsearch
+from slots import SLOTS, mask_of
+
+
+def seeded(count=60, latency=0.0):
+    es = FakeElasticsearch()
+    courses = [prepare_course(course) for course in synthetic_courses(count)]
+    for course in courses:
+        es.index(index=COURSE_INDEX, id=course["id"], document=course)
+    es.latency = latency
+    return es, courses
+
+
+def test_load_matches_index():
+    es, courses = seeded()
+    engine = CourseEngine()
+    engine.load(es)
+    assert engine.ready
+    assert engine.courses == {course["id"]: course for course in courses}
+
+
+def test_exact_clauses_match_the_indexed_documents(monkeypatch):
+    # The fake does not evaluate queries, so fuzzy matching and boosts are only
+    # checked against Elasticsearch itself, with `python course_engine.py`
+    es, courses = seeded()
+    engine = CourseEngine()
+    monkeypatch.setattr(course_engine, "course_engine", engine)
+    engine.load(es)
+
+    # Only match_all ranks the same way in the fake
+    expected, actual = compare_with_elasticsearch({}, size=len(courses), es=es)
+    assert actual == expected
+
+    def ids(queries):
+        return {result["course"]["id"] for result in engine.search(queries, size=len(courses))}
+
+    # Exact clauses and slot filters, checked against the documents the fake holds
+    documents = list(es.documents[COURSE_INDEX].values())
+    for code in {course["code"] for course in documents[:5]}:
+        assert ids({"code": code.lower()}) == {c["id"] for c in documents if c["code"] == code}
+    for dept in {course["dept"] for course in documents[:5]}:
+        assert ids({"dept": dept}) == {c["id"] for c in documents if c["dept"] == dept}
+    free = SLOTS[: len(SLOTS) // 2]
+    assert ids({"free": free}) == {c["id"] for c in documents if set(c["slots"]) <= set(free)}
+    avoid = ["M:1", "T:2", "W:3"]
+    assert ids({"avoid": avoid}) == {c["id"] for c in documents if not mask_of(c["slots"]) & mask_of(avoid)}
+
+
+def course(id, code, name, instructors=(), times=()):
+    return prepare_course(
+        {
+            "id": id,
+            "code": code,
+            "name": name,
+            "sections": [
+                {"type": "L", "number": 1, "instructors": list(instructors), "roomTime": [f"{code}:F101:{t}" for t in times]}
+            ],
+        }
+    )
+
+
+def idf(matching, total):
+    return math.log(1 + (total - matching + 0.5) / (matching + 0.5))
+
+
+def test_edit_distance_counts_a_transposition_as_one_edit():
+    assert edit_distance("data", "daat", 2) == 1
+    assert edit_distance("data", "dtab", 2) == 2
+    assert edit_distance("algorithms", "logarithms", 1) == 2
+
+
+def test_expand_follows_auto_fuzziness():
+    terms = TermIndex()
+    terms.add("c1", ["Data Structures"])
+    terms.add("c2", ["Operating Systems"])
+    terms.add("c3", ["AI"])
+
+    # Up to two characters: exact only
+    assert terms.expand("ai") == [("ai", 1.0)]
+    assert terms.expand("al") == []
+    # Three to five characters: one edit, a transposition included
+    assert terms.expand("data") == [("data", 1.0)]
+    assert terms.expand("daat") == [("data", 0.75)]
+    assert terms.expand("dat") == [("data", 1 - 1 / 3)]
+    assert terms.expand("dtab") == []
+    # Six or more: two edits
+    assert terms.expand("sytsems") == [("systems", 1 - 1 / 7)]
+    assert terms.expand("strcutrues") == [("structures", 0.8)]
+    assert terms.expand("strctrs") == []
+
+
+def test_query_boosts_add_up_per_field():
+    index = CourseIndex()
+    index.add(course("c1", "CS F211", "Data Structures", ["Ramesh"]))
+    index.add(course("c2", "CS F212", "Database Systems", ["Data Lal"]))
+    index.add(course("c3", "BIO F111", "General Biology", ["Meera"]))
+
+    scores = {result["course"]["id"]: result["score"] for result in index.search({"query": "data"})}
+    # `name` (2.0) for c1, `instructors` (1.0) for c2, whose `database` is more than one edit from `data`
+    assert scores == {"c1": 2.0 * idf(1, 3), "c2": 1.0 * idf(1, 3)}
+
+    scores = {result["course"]["id"]: result["score"] for result in index.search({"query": "cs"})}
+    # `dept` (2.5) only: `code` is matched whole
+    assert scores == {"c1": 2.5 * idf(2, 3), "c2": 2.5 * idf(2, 3)}
+
+    scores = {result["course"]["id"]: result["score"] for result in index.search({"query": "cs f211"})}
+    # `code` (2.0) only: `dept` is matched whole too, and `cs` is too short to match `name` fuzzily
+    assert scores == {"c1": 2.0 * idf(1, 3)}
+
+
+def test_time_needs_every_slot_in_one_section():
+    index = CourseIndex()
+    index.add(course("c1", "CS F211", "Data Structures", times=["M:2", "W:2"]))
+    index.add(course("c2", "CS F212", "Database Systems", times=["M:2", "T:3"]))
+
+    assert [result["course"]["id"] for result in index.search({"time": ["M:2", "W:2"]})] == ["c1"]
+    assert [result["course"]["id"] for result in index.search({"time": ["M:2"]})] == ["c1", "c2"]
+
+
+def test_free_and_avoid_filter_without_changing_scores():
+    index = CourseIndex()
+    index.add(course("c1", "CS F211", "Data Structures", times=["M:2", "W:2"]))
+    index.add(course("c2", "CS F212", "Data Mining", times=["T:3"]))
+    index.add(course("c3", "CS F213", "Big Data", times=["F:8"]))
+    index.add(course("c4", "BIO F111", "General Biology", times=["M:2"]))
+
+    def ranked(queries):
+        return [(result["course"]["id"], result["score"]) for result in index.search(queries)]
+
+    scored = ranked({"name": "data"})
+    assert [id for id, _ in scored] == ["c1", "c2", "c3"]
+    assert ranked({"name": "data", "avoid": ["M:2"]}) == [item for item in scored if item[0] != "c1"]
+    assert ranked({"name": "data", "free": ["M:2", "W:2", "F:8"]}) == [item for item in scored if item[0] != "c2"]
+    assert ranked({"name": "data", "avoid": ["T:3"], "free": ["T:3", "F:8"]}) == [item for item in scored if item[0] == "c3"]
+
+
+def test_searches_are_not_blocked_by_reload(monkeypatch):
+    es, courses = seeded()
+    engine = CourseEngine()
+    engine.load(es)
+
+    add = CourseIndex.add
+
+    def slow_add(self, course):
+        time.sleep(0.01)
+        add(self, course)
+
+    monkeypatch.setattr(CourseIndex, "add", slow_add)
+
+    loader = threading.Thread(target=engine.load, args=(es,))
+    loader.start()
+    time.sleep(0.1)
+    started = time.monotonic()
+    assert len(engine.search({}, size=len(courses))) == len(courses)
+    assert time.monotonic() - started < 0.2
+    assert loader.is_alive()
+    loader.join()
+
+
+def test_writes_during_reload_are_kept():
+    es, courses = seeded(latency=0.3)
+    engine = CourseEngine()
+
+    loader = threading.Thread(target=engine.load, args=(es,))
+    loader.start()
+    time.sleep(0.1)
+    added = dict(courses[0], id="course-new")
+    engine.add(added)
+    engine.remove(courses[1]["id"])
+    loader.join()
+
+    assert engine.courses["course-new"] == added
+    assert courses[1]["id"] not in engine.courses
+    assert len(engine.courses) == len(courses)
@@ -0,0 +1,59 @@
+import json
+
+from benchmark import synthetic_courses, synthetic_timetables
+from elastic_transport import ConnectionError
+
+
+def seed(client, courses, timetables):
+    for path, documents in [("/course/bulk", courses), ("/timetable/bulk", timetables)]:
+        body = "\n".join(json.dumps(document) for document in documents)
+        assert not client.post(path, data=body, content_type="application/x-ndjson").json["errors"]
+
+
+def export_lines(client, path, **args):
+    res = client.get(path, query_string=args)
+    assert res.status_code == 200
+    return [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+
+
+def test_timetables_of_every_term_are_exported_once(es, client, monkeypatch):
+    courses = synthetic_courses(10)
+    timetables = synthetic_timetables(20, courses)
+    for i, timetable in enumerate(timetables):
+        timetable["semester"] = 1 + i % 2
+    seed(client, courses, timetables)
+    monkeypatch.setitem(client.application.config, "EXPORT_PAGE_SIZE", 3)
+
+    exported = export_lines(client, "/timetable/export")
+    assert sorted(timetable["id"] for timetable in exported) == sorted(timetable["id"] for timetable in timetables)
+
+
+def test_exported_courses_can_be_loaded_again(es, client):
+    seed(client, synthetic_courses(10), [])
+    exported = export_lines(client, "/course/export")
+    assert len(exported) == 10
+    for index in es.documents:
+        es.documents[index].clear()
+
+    body = "\n".join(json.dumps(course) for course in exported)
+    res = client.post("/course/bulk", data=body, content_type="application/x-ndjson")
+    assert res.json["errors"] == []
+    assert export_lines(client, "/course/export") == exported
+
+
+def test_failed_export_ends_with_an_error_line(es, client, monkeypatch):
+    seed(client, synthetic_courses(10), [])
+    monkeypatch.setitem(client.application.config, "EXPORT_PAGE_SIZE", 3)
+    search = es.search
+
+    def failing_search(**kwargs):
+        # The second page never arrives
+        if kwargs.get("search_after") is not None:
+            raise ConnectionError("connection reset")
+        return search(**kwargs)
+
+    monkeypatch.setattr(es, "search", failing_search)
+    lines = export_lines(client, "/course/export")
+    assert len(lines) == 4
+    assert lines[-1]["error"].startswith("Export failed after 3 documents")
+
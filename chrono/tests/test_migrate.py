@@ -0,0 +1,86 @@
+import pytest
+from elasticsearch import AuthorizationException
+from elasticsearch_setup import (
+    archive_timetable_partition,
+    course_index_body,
+    create_index,
+    migrate_index,
+    partition_timetables,
+    timetable_index_body,
+)
+
+
+def add_documents(es, index, count, **fields):
+    for i in range(count):
+        es.index(index=index, id=f"{index}-{i}", document={"id": f"{index}-{i}", **fields})
+
+
+def write_blocked(es, index):
+    return es.indices.get_settings(index=index)[index]["settings"].get("index.blocks.write") == "true"
+
+
+def test_bare_index_is_replaced_by_its_first_version(es):
+    es.indices.create(index="courses")
+    add_documents(es, "courses", 5)
+    documents = dict(es.documents["courses"])
+
+    migrate_index("courses", course_index_body())
+    # Deleted by the same alias update that points `courses` at the copy
+    assert "courses" not in es.documents
+    assert es.aliases["courses"] == {"courses-v1": {"is_write_index": True}}
+    assert es.documents["courses-v1"] == documents
+
+
+def test_new_version_takes_every_alias_and_the_old_one_is_kept_read_only(es):
+    create_index("timetables-2024-1", timetable_index_body(), read_aliases=["timetables"])
+    add_documents(es, "timetables-2024-1", 5)
+
+    migrate_index("timetables-2024-1", timetable_index_body())
+    assert es.aliases["timetables-2024-1"] == {"timetables-2024-1-v2": {"is_write_index": True}}
+    assert es.aliases["timetables"] == {"timetables-2024-1-v2": {}}
+    assert es.documents["timetables-2024-1-v2"] == es.documents["timetables-2024-1-v1"]
+
+    # Kept for rollback, and no write reaches it by mistake
+    assert write_blocked(es, "timetables-2024-1-v1")
+    with pytest.raises(AuthorizationException):
+        es.index(index="timetables-2024-1-v1", id="late", document={"id": "late"})
+    assert not write_blocked(es, "timetables-2024-1-v2")
+    es.index(index="timetables-2024-1", id="late", document={"id": "late"})
+    assert "late" in es.documents["timetables-2024-1-v2"]
+
+
+def test_failed_count_check_leaves_the_alias_on_the_old_index(es, monkeypatch):
+    create_index("courses", course_index_body())
+    add_documents(es, "courses", 5)
+    count = es.count
+
+    def short_count(index=None, **kwargs):
+        # As if a document had not been copied
+        res = count(index=index, **kwargs)
+        return {"count": res["count"] - 1} if index == "courses-v2" else res
+
+    monkeypatch.setattr(es, "count", short_count)
+    with pytest.raises(RuntimeError, match="`courses-v2` has 4 documents"):
+        migrate_index("courses", course_index_body())
+    assert es.aliases["courses"] == {"courses-v1": {"is_write_index": True}}
+    assert "courses-v2" not in es.documents
+    assert not write_blocked(es, "courses-v1")
+    es.index(index="courses", id="late", document={"id": "late"})
+
+
+def test_single_timetable_index_is_split_by_term(es):
+    create_index("timetables", timetable_index_body())
+    for i, (acad_year, semester) in enumerate([(2023, 2), (2024, 1)] * 3):
+        es.index(index="timetables", id=f"t{i}", document={"id": f"t{i}", "acadYear": acad_year, "semester": semester})
+
+    partition_timetables()
+    assert es.aliases["timetables-2023-2"] == {"timetables-2023-2-v1": {"is_write_index": True}}
+    assert es.aliases["timetables-2024-1"] == {"timetables-2024-1-v1": {"is_write_index": True}}
+    assert es.aliases["timetables"] == {"timetables-2023-2-v1": {}, "timetables-2024-1-v1": {}}
+    assert {document["acadYear"] for document in es.documents["timetables-2023-2-v1"].values()} == {2023}
+    assert len(es.documents["timetables-2024-1-v1"]) == 3
+    assert write_blocked(es, "timetables-v1")
+
+    archive_timetable_partition(2023, 2)
+    assert write_blocked(es, "timetables-2023-2-v1")
+    assert es.calls["forcemerge"] == 1
@@ -0,0 +1,35 @@
+from profiling import condense_profile
+
+
+def clause(type, description, nanos, children=()):
+    return {
+        "type": type,
+        "description": description,
+        "time_in_nanos": nanos,
+        "breakdown": {"next_doc": nanos, "next_doc_count": 3},
+        "children": list(children),
+    }
+
+
+def shard(*children):
+    return {"searches": [{"query": [clause("BooleanQuery", "name:data", sum(c["time_in_nanos"] for c in children), children)]}]}
+
+
+def test_shards_are_merged_by_clause_not_position():
+    # The fuzzy `name` query expands to different terms on each shard
+    profile = {
+        "shards": [
+            shard(clause("TermQuery", "name:data", 100), clause("TermQuery", "name:date", 300)),
+            shard(clause("TermQuery", "name:date", 500), clause("TermQuery", "name:dta", 100)),
+        ]
+    }
+
+    (root,) = condense_profile(profile)["clauses"]
+    children = {child["description"]: child for child in root["children"]}
+    assert {description: child["time_ms"] for description, child in children.items()} == {
+        "name:data": 100 / 1e6,
+        "name:date": 800 / 1e6,
+        "name:dta": 100 / 1e6,
+    }
+    assert children["name:date"]["share"] == 0.8
+    assert children["name:date"]["dominant"] == "next_doc"
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+from benchmark import synthetic_courses, synthetic_timetables
+from propagation import CoursePropagator
+
+
+@pytest.fixture
+def seeded(es, client):
+    courses = synthetic_courses(10)
+    timetables = synthetic_timetables(20, courses)
+    for i, timetable in enumerate(timetables):
+        timetable["semester"] = 1 + i % 2
+    for path, documents in [("/course/bulk", courses), ("/timetable/bulk", timetables)]:
+        body = "\n".join(json.dumps(document) for document in documents)
+        assert not client.post(path, data=body, content_type="application/x-ndjson").json["errors"]
+    return [course["id"] for course in courses]
+
+
+def partition_ids(es, semester):
+    (index,) = [index for index in es.documents if index.startswith(f"timetables-2024-{semester}")]
+    return index, set(es.documents[index])
+
+
+def test_archived_partitions_are_skipped(es, seeded):
+    archived, archived_ids = partition_ids(es, 1)
+    es.indices.put_settings(index=archived, settings={"index.blocks.write": True})
+    propagator = CoursePropagator(batch_size=7, max_rate=0, refresh="false")
+
+    assert propagator.propagate(seeded) == set()
+    assert propagator.failed == 0
+    assert propagator.updated == 20 - len(archived_ids)
+
+
+def test_failed_updates_return_their_courses_for_retry(es, seeded, monkeypatch):
+    bulk = es.bulk
+    rejected = {}
+
+    def rejecting_bulk(operations, **kwargs):
+        # The first timetable of every request is rejected as if the cluster were overloaded
+        operations = list(operations)
+        res = bulk(operations, **kwargs)
+        item = res["items"][0]["update"]
+        item.update(status=429, error={"type": "es_rejected_execution_exception"})
+        rejected[item["_id"]] = json.loads(operations[0])
+        res.body["errors"] = True
+        return res
+
+    monkeypatch.setattr(es, "bulk", rejecting_bulk)
+    propagator = CoursePropagator(batch_size=7, max_rate=0, refresh="false")
+    retry = propagator.propagate(seeded)
+
+    expected = set()
+    for id, action in rejected.items():
+        timetable = es.documents[action["update"]["_index"]][id]
+        expected |= {section["courseId"] for section in timetable["sections"]}
+    assert propagator.failed == len(rejected) == 3
+    assert retry == expected and expected
@@ -0,0 +1,39 @@
+from elasticsearch import ApiError
+from fake_elasticsearch import _meta
+from resilience import SEARCH_TIMEOUT, CircuitBreaker, GuardedClient
+
+
+class RecordingClient:
+    """Records the `request_timeout` searches are sent with."""
+
+    def __init__(self, timeouts, request_timeout=None):
+        self.timeouts = timeouts
+        self.request_timeout = request_timeout
+
+    def options(self, **kwargs):
+        return RecordingClient(self.timeouts, kwargs.get("request_timeout", self.request_timeout))
+
+    def search(self, **kwargs):
+        self.timeouts.append(self.request_timeout)
+        return {}
+
+
+def test_reads_keep_the_deadline_their_caller_set():
+    timeouts = []
+    client = GuardedClient(RecordingClient(timeouts), CircuitBreaker(5, 10))
+
+    client.search()
+    client.options(request_timeout=3600).search()
+    client.options(request_timeout=3600).options(ignore_status=404).search()
+    client.options(ignore_status=404).search()
+    assert timeouts == [SEARCH_TIMEOUT, 3600, 3600, SEARCH_TIMEOUT]
+
+
+def test_overloaded_elasticsearch_is_a_503(es, client, monkeypatch):
+    def search(**kwargs):
+        raise ApiError("es_rejected_execution_exception", _meta(429), {})
+
+    monkeypatch.setattr(es, "search", search)
+    res = client.get("/course/search", query_string={"query": "nothing cached"})
+    assert res.status_code == 503
+    assert res.json == {"error": "Search is temporarily unavailable"}
@@ -0,0 +1,110 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+import sync
+from benchmark import synthetic_courses
+from elasticsearch_setup import COURSE_INDEX
+from sync import ChronoUpstream, sync_courses
+
+
+class StubUpstream:
+    """Serves ChronoFactorem's `/course` routes from `courses`, failing the ids in `failing` once each."""
+
+    def __init__(self, courses):
+        self.courses = {course["id"]: course for course in courses}
+        self.failing = set()
+        self.fetched = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/course":
+                    listed = [{"id": id, "createdAt": course["createdAt"]} for id, course in stub.courses.items()]
+                    return self.respond(200, listed)
+                course_id = self.path.rsplit("/", 1)[-1]
+                stub.fetched.append(course_id)
+                if course_id in stub.failing:
+                    stub.failing.discard(course_id)
+                    return self.respond(500, {"error": "upstream failed"})
+                self.respond(200, stub.courses[course_id])
+
+            def respond(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+
+@pytest.fixture
+def upstream():
+    stub = StubUpstream(synthetic_courses(30))
+    yield stub
+    stub.server.shutdown()
+
+
+def indexed_ids(es):
+    return {id for index in es.documents if index.startswith(COURSE_INDEX) for id in es.documents[index]}
+
+
+def test_failed_course_is_retried_on_the_next_run(es, service, upstream, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    upstream.failing = {"course-3"}
+
+    written, failed, _ = sync_courses(ChronoUpstream(upstream.url), service, batch_size=7, checkpoint=checkpoint)
+    assert (written, failed) == (29, 1)
+    assert indexed_ids(es) == set(upstream.courses) - {"course-3"}
+    with open(checkpoint) as f:
+        assert len(json.load(f)["done"]) == 29
+
+    upstream.fetched.clear()
+    written, failed, _ = sync_courses(ChronoUpstream(upstream.url), service, batch_size=7, checkpoint=checkpoint)
+    assert (written, failed) == (1, 0)
+    assert upstream.fetched == ["course-3"]
+    assert indexed_ids(es) == set(upstream.courses)
+
+
+def test_interrupted_run_resumes_from_checkpoint(es, service, upstream, tmp_path, monkeypatch):
+    checkpoint = str(tmp_path / "checkpoint")
+    write_courses = sync.write_courses
+    pages = []
+
+    def failing_second_page(service_url, courses):
+        pages.append(len(courses))
+        if len(pages) == 2:
+            raise requests.HTTPError("503 Service Unavailable")
+        return write_courses(service_url, courses)
+
+    monkeypatch.setattr(sync, "write_courses", failing_second_page)
+    with pytest.raises(requests.HTTPError):
+        sync_courses(ChronoUpstream(upstream.url), service, concurrency=1, batch_size=10, checkpoint=checkpoint)
+    assert len(indexed_ids(es)) == 10
+
+    monkeypatch.setattr(sync, "write_courses", write_courses)
+    upstream.fetched.clear()
+    written, failed, _ = sync_courses(ChronoUpstream(upstream.url), service, batch_size=10, checkpoint=checkpoint)
+    assert (written, failed) == (20, 0)
+    assert len(upstream.fetched) == 20
+    assert indexed_ids(es) == set(upstream.courses)
+
+
+def test_unchanged_courses_are_skipped(es, service, upstream, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    sync_courses(ChronoUpstream(upstream.url), service, checkpoint=checkpoint)
+
+    upstream.courses["course-5"] = dict(upstream.courses["course-5"], createdAt="2024-08-01T00:00:00.000Z")
+    upstream.fetched.clear()
+    written, failed, _ = sync_courses(ChronoUpstream(upstream.url), service, checkpoint=checkpoint)
+    assert (written, failed) == (1, 0)
+    assert upstream.fetched == ["course-5"]
@@ -0,0 +1,24 @@
+import json
+
+from benchmark import synthetic_courses, synthetic_timetables
+
+
+def seed_courses(client, courses):
+    body = "\n".join(json.dumps(course) for course in courses)
+    assert not client.post("/course/bulk", data=body, content_type="application/x-ndjson").json["errors"]
+
+
+def test_occupancy_fields_are_only_returned_when_asked_for(es, client):
+    courses = synthetic_courses(10)
+    (timetable,) = synthetic_timetables(1, courses)
+    seed_courses(client, courses)
+
+    res = client.post("/timetable/add", json=timetable)
+    assert res.status_code == 201
+    assert not {"busySlots", "freeDays", "hours"} & set(res.json)
+
+    (hit,) = client.get("/timetable/search", query_string={"name": "Timetable"}).json
+    assert not {"busySlots", "freeDays", "hours"} & set(hit["timetable"])
+    assert hit["timetable"]["sections"] == timetable["sections"]
+    (hit,) = client.get("/timetable/search", query_string={"name": "Timetable", "fields": "id,hours"}).json
+    assert set(hit["timetable"]) == {"id", "hours"}
@@ -0,0 +1,99 @@
+import fcntl
+import json
+import os
+
+import pytest
+from elastic_transport import ConnectionError
+from write_queue import WriteBehindQueue
+
+
+def queue(journal_dir):
+    return WriteBehindQueue(str(journal_dir), max_batch=10000, max_delay=3600, refresh="false")
+
+
+def write_journal(journal_dir, name, ops):
+    journal_dir.mkdir(exist_ok=True)
+    with open(journal_dir / f"journal-{name}.ndjson", "w") as f:
+        f.writelines(json.dumps(op) + "\n" for op in ops)
+
+
+def op(id):
+    return {"op": "index", "index": "courses", "id": id, "document": {"id": id}}
+
+
+def test_journals_are_named_uniquely(es, tmp_path):
+    first, second = queue(tmp_path), queue(tmp_path)
+    first.put("index", "courses", "a", {"id": "a"})
+    second.put("index", "courses", "b", {"id": "b"})
+    assert first.journal_path != second.journal_path
+
+
+def test_unlocked_journals_are_adopted(es, tmp_path):
+    # Left by a worker that died, whatever its pid was
+    write_journal(tmp_path, str(os.getpid()), [op("a"), op("b")])
+    write_journal(tmp_path, "dead", [op("c")])
+    (tmp_path / "journal-dead.lock").touch()
+
+    adopter = queue(tmp_path)
+    adopter.flush()
+    assert set(es.documents["courses"]) == {"a", "b", "c"}
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ["recover.lock", os.path.basename(adopter.journal_path), f"journal-{adopter._name}.lock"]
+    )
+
+
+def test_locked_journals_are_left_to_their_owner(es, tmp_path):
+    write_journal(tmp_path, "alive", [op("a")])
+    with open(tmp_path / "journal-alive.lock", "w") as owner:
+        fcntl.flock(owner, fcntl.LOCK_EX)
+        queue(tmp_path).flush()
+    assert "courses" not in es.documents
+    assert (tmp_path / "journal-alive.ndjson").exists()
+
+
+def test_partial_failure_keeps_only_unanswered_writes(es, tmp_path, monkeypatch):
+    write_queue = queue(tmp_path)
+    for i in range(700):
+        write_queue.put("create", "courses", f"course-{i}", {"id": f"course-{i}"})
+
+    bulk, calls = es.bulk, []
+
+    def failing_second_chunk(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise ConnectionError("connection reset")
+        return bulk(*args, **kwargs)
+
+    monkeypatch.setattr(es, "bulk", failing_second_chunk)
+    with pytest.raises(ConnectionError):
+        write_queue.flush()
+    assert len(es.documents["courses"]) == 500
+    assert write_queue.stats()["depth"] == 200
+    with open(write_queue.journal_path) as f:
+        assert len(f.readlines()) == 200
+
+    write_queue.flush()
+    assert len(es.documents["courses"]) == 700
+    assert write_queue.stats()["failed"] == 0
+
+
+def test_failed_refresh_does_not_resend_writes(es, tmp_path, monkeypatch):
+    write_queue = WriteBehindQueue(str(tmp_path), max_batch=10000, max_delay=3600, refresh="wait_for")
+    flushed = []
+    write_queue.on_flush.append(flushed.extend)
+    for i in range(3):
+        write_queue.put("create", "courses", f"course-{i}", {"id": f"course-{i}"})
+
+    def failing_refresh(**kwargs):
+        raise ConnectionError("connection timed out")
+
+    monkeypatch.setattr(es.indices, "refresh", failing_refresh)
+    write_queue.flush()
+    assert [op["id"] for op in flushed] == ["course-0", "course-1", "course-2"]
+    stats = write_queue.stats()
+    assert (stats["depth"], stats["failed"], stats["refresh_failed"]) == (0, 0, 1)
+    with open(write_queue.journal_path) as f:
+        assert f.read() == ""
+
+    write_queue.flush()
+    assert write_queue.stats()["failed"] == 0
@@ -1,11 +1,74 @@
-from elasticsearch import NotFoundError
-from elasticsearch_setup import COURSE_INDEX, TIMETABLE_INDEX, client, search_by_id
+import os
+
+from course_cache import get_course_summaries
+from elasticsearch import BadRequestError, ConflictError, NotFoundError
+from elasticsearch_setup import (
+    COURSE_INDEX,
+    TIMETABLE_INDEX,
+    bulk_index,
+    client,
+    ensure_timetable_partition,
+    find_timetable_index,
+    find_timetable_indices,
+    get_by_id,
+    is_timetable_index,
+    iter_documents,
+    partition_term,
+    searchable_timetable_partitions,
+    timetable_occupancy,
+    timetable_partition,
+    timetables_partitioned,
+)
 from flask import Blueprint, jsonify, request, current_app
-from jsonschema import ValidationError, validate
-from utils import remove_newline_chars
+from jsonschema import ValidationError
+from metrics import record_took, stage
+from profiling import is_admin, profile_search, wants_profile
+from resilience import with_fallback
+from search_cache import bump_generation, facet_cache, normalize_queries, search_cache, search_cache_key
+from slots import ROOM_TIME_PATTERN
+from utils import (
+    compile_validator,
+    decode_cursor,
+    encode_cursor,
+    export_failure,
+    filter_source,
+    iter_ndjson_chunks,
+    parse_source_filter,
+    remove_newline_chars,
+    stream_ndjson,
+    validate_with,
+)
+from write_queue import WRITE_BEHIND, write_queue
 
 timetable = Blueprint("timetable", __name__)
 
+# "{acadYear}-{semester}" searched when a search gives neither, all terms when unset
+TIMETABLE_CURRENT_TERM = os.getenv("TIMETABLE_CURRENT_TERM")
+
+# Stored by `timetable_occupancy` for the occupancy filters, never returned unless asked for by name
+TIMETABLE_DERIVED_FIELDS = ["busySlots", "freeDays", "hours"]
+
+# `fields` presets for /timetable/search, mapping to `_source` filters
+timetable_field_presets = {
+    "full": {"excludes": TIMETABLE_DERIVED_FIELDS},
+    "summary": {
+        "includes": [
+            "id",
+            "authorId",
+            "name",
+            "degrees",
+            "private",
+            "draft",
+            "archived",
+            "year",
+            "acadYear",
+            "semester",
+            "courses",
+            "lastUpdated",
+        ]
+    },
+}
+
 timetable_schema = {
     "type": "object",
     "properties": {
@@ -29,7 +92,7 @@ timetable_schema = {
                     "type": {"type": "string"},
                     "number": {"type": "integer"},
                     "instructors": {"type": "array", "items": {"type": "string"}},
-                    "roomTime": {"type": "array", "items": {"type": "string"}},
+                    "roomTime": {"type": "array", "items": {"type": "string", "pattern": ROOM_TIME_PATTERN}},
                     "createdAt": {"type": "string", "format": "date-time"},
                 },
                 "required": [
@@ -71,32 +134,78 @@ timetable_schema = {
     "additionalProperties": False,
 }
 
+timetable_validator = compile_validator(timetable_schema)
+
+# Query parameters matched exactly, which must not share a cache entry across case
+TIMETABLE_CASE_SENSITIVE = ["freeDays", "free", "noClashWith"]
 
-@timetable.route("/search", methods=["GET"])
-def search_timetable():
-    start = request.args.get("from", type=int)
-    if start == None:
-        start = 0
 
-    queries = {
-        "query": request.args.get("query", type=str),
-        "year": request.args.get("year", type=int),
-        "name": request.args.get("name", type=str),
-        "authorId": request.args.get("authorId", type=str),
-        "acadYear": request.args.get("acadYear", type=int),
-        "semester": request.args.get("semester", type=int),
-        "degrees": [code.upper() for code in request.args.getlist("degree", type=str)],
-        "courses": request.args.getlist("course", type=str),
-        "instructors": request.args.getlist("instructor", type=str),
+def get_timetable_queries(args):
+    return {
+        "query": args.get("query", type=str),
+        "year": args.get("year", type=int),
+        "name": args.get("name", type=str),
+        "authorId": args.get("authorId", type=str),
+        "acadYear": args.get("acadYear", type=int),
+        "semester": args.get("semester", type=int),
+        "degrees": [code.upper() for code in args.getlist("degree", type=str)],
+        "courses": args.getlist("course", type=str),
+        "instructors": args.getlist("instructor", type=str),
+        "freeDays": args.getlist("freeDay", type=str),
+        "free": args.getlist("free", type=str),
+        "maxHours": args.get("maxHours", type=int),
+        "noClashWith": no_clash_sections(args.get("noClashWith", type=str)),
     }
 
-    # if not any(queries.values()):
-    #     return jsonify({"error": "At least one valid query parameter required"}), 400
 
+def no_clash_sections(course_id):
+    """
+    The `time` of every section of `course_id`, by section type, for the
+    `noClashWith` filter. Read here rather than when the query is built so
+    that the search cache key changes whenever the course does.
+    """
+    if not course_id:
+        return None
+    course = get_by_id(COURSE_INDEX, course_id, source=["sections.type", "sections.time"])
+    if course is None:
+        return {"id": course_id, "types": None}
+    types = {}
+    for section in course["_source"]["sections"]:
+        types.setdefault(section["type"], []).append(sorted(section["time"]))
+    return {"id": course_id, "types": {section_type: sorted(times) for section_type, times in types.items()}}
+
+
+def no_clash_query(course):
+    """
+    Filter for timetables that can fit `course`, from `no_clash_sections`: for
+    each of its section types, at least one section meets only in slots the
+    timetable leaves free.
+    """
+    if course["types"] is None:
+        return {"match_none": {}}
+    clauses = []
+    for times in course["types"].values():
+        if not all(times):
+            continue  # A section without classes always fits
+        clauses.append(
+            {
+                "bool": {
+                    "should": [{"bool": {"must_not": {"terms": {"busySlots": time}}}} for time in times],
+                    "minimum_should_match": 1,
+                }
+            }
+        )
+    return {"bool": {"filter": clauses}}
+
+
+def build_timetable_query(queries):
     bool_must_queries = []
+    # Non-scoring, on the occupancy fields
+    bool_filter_queries = []
 
     for key, value in queries.items():
-        if not value:
+        # `maxHours=0` is a filter like any other
+        if value is None or value == "":
             continue
         if isinstance(value, list):
             value = [v for v in value if v]
@@ -308,55 +417,426 @@ def search_timetable():
                 }
             )
 
+        elif key == "freeDays":
+            bool_filter_queries.extend({"term": {"freeDays": day}} for day in value)
+        elif key == "free":
+            bool_filter_queries.append({"bool": {"must_not": {"terms": {"busySlots": value}}}})
+        elif key == "maxHours":
+            bool_filter_queries.append({"range": {"hours": {"lte": value}}})
+        elif key == "noClashWith":
+            bool_filter_queries.append(no_clash_query(value))
+
+    if bool_filter_queries:
+        return {"bool": {"must": bool_must_queries or [{"match_all": {}}], "filter": bool_filter_queries}}
     if len(bool_must_queries) == 0:
-        elastic_query = {"match_all": {}}
+        return {"match_all": {}}
     elif len(bool_must_queries) == 1:
-        elastic_query = bool_must_queries[0]
-    else:
-        elastic_query = {"bool": {"must": bool_must_queries}}
+        return bool_must_queries[0]
+    return {"bool": {"must": bool_must_queries}}
 
-    res = client.search(
-        index=TIMETABLE_INDEX,
-        query=elastic_query,
-        from_=start,
-        size=12,
-    )
+
+def timetable_search_index(queries, default_current=True):
+    """
+    The term partitions a search needs to read: those matching its `acadYear`
+    and `semester`, or the current term when it gives neither.
+    """
+    if not timetables_partitioned():
+        return TIMETABLE_INDEX
+    acad_year, semester = queries.get("acadYear"), queries.get("semester")
+    if acad_year is None and semester is None:
+        if not (default_current and TIMETABLE_CURRENT_TERM):
+            return TIMETABLE_INDEX
+        acad_year, semester = TIMETABLE_CURRENT_TERM.split("-")
+    if acad_year is not None and semester is not None:
+        # Searched with `ignore_unavailable`, a term without a partition has no timetables
+        return timetable_partition(acad_year, semester)
+    # Listed rather than a wildcard, which would also match the concrete `-vN`
+    # indices `migrate_index` keeps and return their timetables twice
+    partitions = [
+        alias
+        for alias in searchable_timetable_partitions()
+        if all(wanted is None or wanted == part for wanted, part in zip((acad_year, semester), partition_term(alias)))
+    ]
+    return ",".join(partitions) or timetable_partition(acad_year or "none", semester or "none")
+
+
+def timetable_search_params(queries, start, source=True):
+    return {
+        "index": timetable_search_index(queries),
+        # A term without a partition has no timetables
+        "ignore_unavailable": True,
+        "query": build_timetable_query(queries),
+        "source": source,
+        "from_": start,
+        "size": 12,
+    }
+
+
+def timetable_search_results(res):
     search_results = []
     for hit in res["hits"].get("hits", []):
         search_results.append({"timetable": hit["_source"], "score": hit["_score"]})
-    return jsonify(search_results), 200
+    return search_results
+
+
+def search_timetables(queries, start, source=True):
+    with stage("build"):
+        params = timetable_search_params(queries, start, source)
+    with stage("es"):
+        res = client.search(**params)
+    record_took(res)
+    with stage("hits"):
+        return timetable_search_results(res)
+
+
+def search_timetables_after(queries, cursor, source=True):
+    """
+    Return a page of results and the cursor for the next one, which is None
+    after the last page. `cursor` is empty for the first page, which opens a
+    point in time so that every page sees the same snapshot of the index.
+    Raises ValueError for a cursor Elasticsearch cannot read.
+    """
+    keep_alive = current_app.config['CURSOR_KEEP_ALIVE']
+    if cursor:
+        pit_id, search_after = decode_cursor(cursor)
+    else:
+        pit_id = client.open_point_in_time(
+            index=timetable_search_index(queries), keep_alive=keep_alive, ignore_unavailable=True
+        )["id"]
+        search_after = None
+
+    with stage("build"):
+        query = build_timetable_query(queries)
+    with stage("es"):
+        try:
+            res = client.search(
+                query=query,
+                source=source,
+                pit={"id": pit_id, "keep_alive": keep_alive},
+                sort=[{"_score": "desc"}, {"_shard_doc": "asc"}],
+                search_after=search_after,
+                track_total_hits=False,
+                size=12,
+            )
+        except BadRequestError as e:
+            # A tampered point in time id or `search_after`, the query itself is ours
+            if not cursor:
+                raise
+            raise ValueError("Invalid cursor") from e
+    record_took(res)
+    hits = res["hits"].get("hits", [])
+    pit_id = res.get("pit_id", pit_id)
+
+    if len(hits) < 12:
+        client.close_point_in_time(id=pit_id)
+        return timetable_search_results(res), None
+    return timetable_search_results(res), encode_cursor(pit_id, hits[-1]["sort"])
+
+
+def timetable_search_cache_key(queries, start, source=True):
+    queries = normalize_queries(queries, case_sensitive=TIMETABLE_CASE_SENSITIVE)
+    return search_cache_key(TIMETABLE_INDEX, queries, start=start, source=source)
+
+
+@timetable.route("/search", methods=["GET"])
+def search_timetable():
+    start = request.args.get("from", type=int)
+    if start == None:
+        start = 0
+
+    queries = get_timetable_queries(request.args)
+
+    # if not any(queries.values()):
+    #     return jsonify({"error": "At least one valid query parameter required"}), 400
+
+    source = parse_source_filter(request.args.get("fields", type=str), timetable_field_presets)
+
+    if wants_profile(request.args):
+        if not is_admin(request):
+            return jsonify({"error": "Admin token required"}), 403
+        return jsonify(profile_search(timetable_search_params(queries, start, source), timetable_search_results)), 200
+
+    if "cursor" in request.args:
+        try:
+            search_results, cursor = search_timetables_after(queries, request.args["cursor"], source)
+        except (ValueError, NotFoundError):
+            return jsonify({"error": "Invalid or expired cursor"}), 400
+        return jsonify({"results": search_results, "cursor": cursor}), 200
+
+    key = timetable_search_cache_key(queries, start, source)
+    search_results = with_fallback(
+        key, lambda: search_cache.get_or_set(key, lambda: search_timetables(queries, start, source))
+    )
+
+    with stage("serialize"):
+        response = jsonify(search_results)
+    return response, 200
+
+
+def timetable_facet_params(queries, start, hits=False, source=True):
+    return {
+        # Counts every term unless one is asked for, so that `terms` lists them
+        "index": timetable_search_index(queries, default_current=False),
+        "ignore_unavailable": True,
+        "query": build_timetable_query(queries),
+        "aggs": {
+            "degrees": {"terms": {"field": "degrees", "size": 50}},
+            "year": {"terms": {"field": "year", "size": 10}},
+            "terms": {"multi_terms": {"terms": [{"field": "acadYear"}, {"field": "semester"}], "size": 20}},
+            "courses": {
+                "nested": {"path": "courses"},
+                "aggs": {"codes": {"terms": {"field": "courses.code", "size": 20}}},
+            },
+        },
+        "track_total_hits": True,
+        "source": source,
+        "from_": start,
+        "size": 12 if hits else 0,
+    }
+
+
+def timetable_facet_results(res, hits=False):
+    aggs = res["aggregations"]
+    results = {
+        "total": res["hits"]["total"]["value"],
+        "facets": {
+            "degrees": [
+                {"degree": bucket["key"], "count": bucket["doc_count"]}
+                for bucket in aggs["degrees"]["buckets"]
+            ],
+            "year": [
+                {"year": bucket["key"], "count": bucket["doc_count"]}
+                for bucket in aggs["year"]["buckets"]
+            ],
+            "terms": [
+                {"acadYear": bucket["key"][0], "semester": bucket["key"][1], "count": bucket["doc_count"]}
+                for bucket in aggs["terms"]["buckets"]
+            ],
+            # Counts timetables, each lists a course once
+            "courses": [
+                {"code": bucket["key"], "count": bucket["doc_count"]}
+                for bucket in aggs["courses"]["codes"]["buckets"]
+            ],
+        },
+    }
+    if hits:
+        results["results"] = timetable_search_results(res)
+    return results
+
+
+def search_timetable_facets(queries, start, hits=False, source=True):
+    with stage("build"):
+        params = timetable_facet_params(queries, start, hits, source)
+    with stage("es"):
+        res = client.search(**params)
+    record_took(res)
+    with stage("hits"):
+        return timetable_facet_results(res, hits)
+
+
+def timetable_facet_cache_key(queries, start, hits=False, source=True):
+    if not hits:
+        start, source = 0, True
+    return search_cache_key(
+        TIMETABLE_INDEX,
+        normalize_queries(queries, case_sensitive=TIMETABLE_CASE_SENSITIVE),
+        facets=True,
+        hits=hits,
+        start=start,
+        source=source,
+    )
+
+
+@timetable.route("/facets", methods=["GET"])
+def timetable_facets():
+    start = request.args.get("from", default=0, type=int)
+    hits = request.args.get("hits") == "true"
+    queries = get_timetable_queries(request.args)
+    source = parse_source_filter(request.args.get("fields", type=str), timetable_field_presets)
+
+    key = timetable_facet_cache_key(queries, start, hits, source)
+    results = with_fallback(
+        key, lambda: facet_cache.get_or_set(key, lambda: search_timetable_facets(queries, start, hits, source))
+    )
+
+    with stage("serialize"):
+        response = jsonify(results)
+    return response, 200
+
+
+def export_timetable(timetable_data):
+    """A stored timetable without the fields the service adds, as `/timetable/add` accepts it."""
+    return {
+        key: value
+        for key, value in timetable_data.items()
+        if key not in ["courses", *TIMETABLE_DERIVED_FIELDS]
+    }
+
+
+@timetable.route("/export", methods=["GET"])
+def export_timetables():
+    queries = get_timetable_queries(request.args)
+    # Every term unless one is asked for
+    index_name = timetable_search_index(queries, default_current=False)
+    query = build_timetable_query(queries)
+    keep_alive = current_app.config['CURSOR_KEEP_ALIVE']
+    page_size = current_app.config['EXPORT_PAGE_SIZE']
+
+    return stream_ndjson(
+        (export_timetable(timetable_data) for timetable_data in iter_documents(index_name, query, keep_alive, page_size)),
+        export_failure,
+    )
+
+
+def timetable_course_ids(timetable_data):
+    return sorted({section["courseId"] for section in timetable_data["sections"]})
+
+
+def embedded_courses(course_ids, courses):
+    """The `courses` of a timetable, from `get_course_summaries`, leaving out courses that no longer exist."""
+    return [
+        {"id": course_id, "code": courses[course_id]["code"], "name": courses[course_id]["name"]}
+        for course_id in course_ids
+        if course_id in courses
+    ]
+
+
+def apply_flushed_timetables(ops):
+    if any(is_timetable_index(op["index"]) for op in ops):
+        bump_generation(TIMETABLE_INDEX)
+
+
+write_queue.on_flush.append(apply_flushed_timetables)
 
 
 @timetable.route("/add", methods=["POST"])
 def add_timetable():
     timetable_data = request.json
     try:
-        validate(instance=timetable_data, schema=timetable_schema)
+        with stage("validate"):
+            validate_with(timetable_validator, timetable_data)
     except ValidationError as e:
         return jsonify({"error": "Invalid timetable data: " + e.message}), 400
 
-    if search_by_id(TIMETABLE_INDEX, timetable_data["id"]):
-        return jsonify({"error": "Timetable already exists"}), 400
-
     # Add course information to timetable_data
-    timetable_data["courses"] = []
-    course_ids = {section["courseId"] for section in timetable_data["sections"]}
+    course_ids = timetable_course_ids(timetable_data)
+    with stage("courses"):
+        courses = get_course_summaries(course_ids)
     for course_id in course_ids:
-        course = search_by_id(COURSE_INDEX, course_id)
-        if not course:
+        if course_id not in courses:
             return jsonify({"error": f"Course with id {course_id} not found"}), 404
-        course = course["_source"]
-        timetable_data["courses"].append(
-            {
-                "code": course["code"],
-                "name": course["name"],
-            }
-        )
+    timetable_data["courses"] = embedded_courses(course_ids, courses)
 
+    timetable_data.update(timetable_occupancy(timetable_data))
     timetable_data = remove_newline_chars(timetable_data)
-    client.index(index=TIMETABLE_INDEX, body=timetable_data, refresh=current_app.config['REFRESH_SETTING'])
+    index_name = ensure_timetable_partition(timetable_data["acadYear"], timetable_data["semester"])
+    if timetables_partitioned():
+        # `create` only rejects an id already stored in the partition of the same term
+        with stage("route"):
+            if find_timetable_index(timetable_data["id"]) is not None:
+                return jsonify({"error": "Timetable already exists"}), 400
 
-    return jsonify(timetable_data), 201
+    if WRITE_BEHIND:
+        wait = request.args.get("sync") == "true"
+        error = write_queue.put("create", index_name, timetable_data["id"], timetable_data, wait=wait)
+        if error and error["status"] == 409:
+            return jsonify({"error": "Timetable already exists"}), 400
+        if error:
+            return jsonify({"error": error["error"]}), 500
+        return jsonify(filter_source(timetable_data, timetable_field_presets["full"])), 201 if wait else 202
+
+    try:
+        with stage("es"):
+            client.index(
+                index=index_name,
+                id=timetable_data["id"],
+                body=timetable_data,
+                op_type="create",
+                refresh=current_app.config['REFRESH_SETTING'],
+            )
+    except ConflictError:
+        return jsonify({"error": "Timetable already exists"}), 400
+    bump_generation(TIMETABLE_INDEX)
+
+    return jsonify(filter_source(timetable_data, timetable_field_presets["full"])), 201
+
+
+def bulk_index_timetables(documents):
+    """`bulk_index` for timetables, each written to the partition of its term."""
+    results = [None] * len(documents)
+    # `create` only rejects ids already stored in the partition written to
+    existing = find_timetable_indices([document["id"] for document in documents]) if timetables_partitioned() else {}
+    partitions = {}
+    for position, document in enumerate(documents):
+        if document["id"] in existing:
+            results[position] = {"status": 409, "error": "version_conflict_engine_exception"}
+            continue
+        index_name = ensure_timetable_partition(document["acadYear"], document["semester"])
+        partitions.setdefault(index_name, []).append(position)
+    for index_name, positions in partitions.items():
+        for position, error in zip(positions, bulk_index(index_name, [documents[p] for p in positions])):
+            results[position] = error
+    return results
+
+
+@timetable.route("/bulk", methods=["POST"])
+def bulk_add_timetables():
+    indexed = 0
+    errors = []
+    seen_ids = set()
+
+    for chunk in iter_ndjson_chunks(request.stream, current_app.config['BULK_CHUNK_SIZE']):
+        valid = []
+        for line_number, timetable_data, error in chunk:
+            if error is None:
+                try:
+                    validate_with(timetable_validator, timetable_data)
+                except ValidationError as e:
+                    error = "Invalid timetable data: " + e.message
+            if error is None and timetable_data["id"] in seen_ids:
+                error = "Duplicate timetable id in request"
+            if error is not None:
+                timetable_id = timetable_data.get("id") if isinstance(timetable_data, dict) else None
+                errors.append({"line": line_number, "id": timetable_id, "error": error})
+                continue
+            seen_ids.add(timetable_data["id"])
+            valid.append((line_number, timetable_data))
+
+        courses = get_course_summaries(
+            {section["courseId"] for _, t in valid for section in t["sections"]}
+        )
+        documents, lines = [], []
+        for line_number, timetable_data in valid:
+            course_ids = timetable_course_ids(timetable_data)
+            missing = [course_id for course_id in course_ids if course_id not in courses]
+            if missing:
+                errors.append(
+                    {
+                        "line": line_number,
+                        "id": timetable_data["id"],
+                        "error": f"Course with id {missing[0]} not found",
+                    }
+                )
+                continue
+            timetable_data["courses"] = embedded_courses(course_ids, courses)
+            timetable_data.update(timetable_occupancy(timetable_data))
+            documents.append(remove_newline_chars(timetable_data))
+            lines.append(line_number)
+
+        for line_number, document, error in zip(lines, documents, bulk_index_timetables(documents)):
+            if error is None:
+                indexed += 1
+                continue
+            message = "Timetable already exists" if error["status"] == 409 else error["error"]
+            errors.append({"line": line_number, "id": document["id"], "error": message})
+
+    if indexed and current_app.config['REFRESH_SETTING'] != "false":
+        client.indices.refresh(index=TIMETABLE_INDEX)
+    if indexed:
+        bump_generation(TIMETABLE_INDEX)
+
+    errors.sort(key=lambda error: error["line"])
+    return jsonify({"indexed": indexed, "errors": errors}), 200
 
 
 @timetable.route("/remove", methods=["DELETE"])
@@ -365,13 +845,26 @@ def remove_timetable():
     if not timetable_id or not isinstance(timetable_id, str):
         return jsonify({"error": "Invalid timetable id"}), 400
 
-    search_res = search_by_id(TIMETABLE_INDEX, timetable_id)
-    if not search_res:
+    # Timetables are stored in the partition of their term, which the request does not give
+    with stage("route"):
+        index_name = find_timetable_index(timetable_id)
+    if index_name is None:
         return jsonify({"error": "Timetable not found"}), 404
 
+    if WRITE_BEHIND:
+        wait = request.args.get("sync") == "true"
+        error = write_queue.put("delete", index_name, timetable_id, wait=wait)
+        if error and error["status"] == 404:
+            return jsonify({"error": "Timetable not found"}), 404
+        if error:
+            return jsonify({"error": error["error"]}), 500
+        return jsonify(), 204 if wait else 202
+
     try:
-        client.delete(index=TIMETABLE_INDEX, id=search_res["_id"], refresh=current_app.config['REFRESH_SETTING'])
+        with stage("es"):
+            client.delete(index=index_name, id=timetable_id, refresh=current_app.config['REFRESH_SETTING'])
     except NotFoundError:
         return jsonify({"error": "Timetable not found"}), 404
+    bump_generation(TIMETABLE_INDEX)
 
     return jsonify(), 204
@@ -1,18 +1,9 @@
-from pprint import pprint
+import base64
+import json
 
-import requests
-
-
-def insert_courses():
-    courses = requests.get(f"https://www.chrono.crux-bphc.com/api/course").json()
-    for course in courses:
-        course_id = course["id"]
-        print(course_id)
-        course = requests.get(
-            f"https://www.chrono.crux-bphc.com/api/course/{course_id}"
-        ).json()
-        res = requests.post(f"http://localhost:5000/course/add", json=course)
-        pprint(res.json())
+from flask import Response
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 
 def remove_newline_chars(object):
@@ -27,5 +18,118 @@ def remove_newline_chars(object):
     return object
 
 
-if __name__ == "__main__":
-    insert_courses()
+def compile_validator(schema):
+    """
+    Check `schema` once and build the validator `jsonschema.validate` would
+    otherwise build (and re-check the schema for) on every call.
+    """
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def validate_with(validator, instance):
+    """Equivalent of `jsonschema.validate`, raising the same error for `instance`."""
+    error = best_match(validator.iter_errors(instance))
+    if error is not None:
+        raise error
+
+
+def iter_ndjson_chunks(stream, chunk_size):
+    """
+    Read newline delimited JSON from `stream` and yield it in lists of at most
+    `chunk_size` `(line_number, document, error)` tuples. Lines that cannot be
+    parsed are yielded with `document` set to None and a message in `error`.
+    """
+    chunk = []
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            chunk.append((line_number, json.loads(line), None))
+        except ValueError as e:
+            chunk.append((line_number, None, f"Invalid JSON: {e}"))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_ndjson(items, describe_failure, errors=(Exception,)):
+    """
+    Respond with one line of newline delimited JSON per item of `items`, each
+    written as soon as it is produced. The 200 status is sent before the first
+    line, so when producing the items raises one of `errors` the stream ends
+    with an `{"error": describe_failure(error, sent)}` line instead, `sent`
+    being the number of lines written before it.
+    """
+
+    def generate():
+        sent = 0
+        try:
+            for item in items:
+                yield json.dumps(item) + "\n"
+                sent += 1
+        except errors as e:
+            yield json.dumps({"error": describe_failure(e, sent)}) + "\n"
+
+    return Response(generate(), status=200, mimetype="application/x-ndjson")
+
+
+def export_failure(error, sent):
+    return f"Export failed after {sent} documents: {error}"
+
+
+def encode_cursor(pit_id, search_after):
+    token = json.dumps({"pit": pit_id, "after": search_after}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(token.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return `(pit_id, search_after)` from `encode_cursor`, raising ValueError if malformed."""
+    try:
+        token = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return token["pit"], token["after"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def parse_source_filter(fields, presets):
+    """
+    Translate a `fields` parameter, either the name of a preset or a comma
+    separated list of (dotted) field names, to an Elasticsearch `_source`
+    filter. Returns the `full` preset, or True for the whole document, when it
+    is empty.
+    """
+    if not fields:
+        return presets.get("full", True)
+    if fields in presets:
+        return presets[fields]
+    return {"includes": [field.strip() for field in fields.split(",") if field.strip()]}
+
+
+def filter_source(document, source, prefix=""):
+    """Apply a `_source` filter from `parse_source_filter` to a document held in memory."""
+    if source is True:
+        return document
+    # Like Elasticsearch, an empty `includes` filters nothing in
+    includes = source.get("includes") or None
+    excludes = source.get("excludes", [])
+    if isinstance(document, list):
+        return [filter_source(value, source, prefix) for value in document]
+    if not isinstance(document, dict):
+        return document
+
+    filtered = {}
+    for key, value in document.items():
+        path = prefix + key
+        if path in excludes:
+            continue
+        if includes is None or path in includes:
+            filtered[key] = filter_source(value, {"excludes": excludes}, path + ".")
+        elif any(field.startswith(path + ".") for field in includes):
+            filtered[key] = filter_source(value, source, path + ".")
+    return filtered
+
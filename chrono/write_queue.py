@@ -0,0 +1,256 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from elasticsearch import helpers
+from elasticsearch_setup import client
+
+
+class WriteBehindQueue:
+    """
+    Acknowledges writes once they are appended (and fsynced) to a journal
+    file, and flushes them to Elasticsearch in bulk when `max_batch` writes
+    are pending or the oldest has waited `max_delay` seconds, with a single
+    refresh per flush. Every process keeps its own journal, named uniquely
+    and locked for as long as the process lives; journals nobody holds the
+    lock of are adopted by the next queue to start.
+    """
+
+    def __init__(self, journal_dir, max_batch, max_delay, refresh):
+        self.journal_dir = journal_dir
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.refresh = refresh
+        # Called with the writes that succeeded after every flush
+        self.on_flush = []
+
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._waiters = {}
+        self._seq = 0
+        self._pid = None
+        self._name = None
+
+        self.flushes = 0
+        self.flushed = 0
+        self.failed = 0
+        self.refresh_failed = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.recent_errors = deque(maxlen=20)
+
+    @property
+    def journal_path(self):
+        return self._path(self._name, "ndjson")
+
+    def _path(self, name, extension):
+        return os.path.join(self.journal_dir, f"journal-{name}.{extension}")
+
+    def _ensure_started(self):
+        # Started lazily so that a queue imported before Gunicorn forks runs in each worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Not the pid, which a restarted container hands out again
+            self._name = uuid.uuid4().hex
+            self._pending.clear()
+            os.makedirs(self.journal_dir, exist_ok=True)
+            # Queues start one at a time, so a journal without a lock file is never one being created
+            with open(os.path.join(self.journal_dir, "recover.lock"), "w") as recovering:
+                fcntl.flock(recovering, fcntl.LOCK_EX)
+                self._claim()
+                self._journal = open(self.journal_path, "a")
+                self._recover()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _claim(self):
+        # Locked before it gets its final name so that no other queue sees it unlocked.
+        # The kernel releases the lock when the process dies, however it dies.
+        temp = os.path.join(self.journal_dir, f".{self._name}.lock")
+        self._owner = open(temp, "w")
+        fcntl.flock(self._owner, fcntl.LOCK_EX)
+        os.rename(temp, self._path(self._name, "lock"))
+
+    def _recover(self):
+        for path in glob.glob(self._path("*", "ndjson")):
+            name = os.path.basename(path)[len("journal-") : -len(".ndjson")]
+            if name == self._name:
+                continue
+            lock_path = self._path(name, "lock")
+            owner = None
+            if os.path.exists(lock_path):
+                owner = open(lock_path)
+                try:
+                    fcntl.flock(owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Its process is alive and flushing it
+                    owner.close()
+                    continue
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        op = json.loads(line)
+                        self._append({key: op[key] for key in ["op", "index", "id", "document"]})
+            os.remove(path)
+            if owner is not None:
+                os.remove(lock_path)
+                owner.close()
+
+    def _append(self, op):
+        self._seq += 1
+        op["seq"] = self._seq
+        op["queued_at"] = time.time()
+        self._journal.write(json.dumps(op) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._pending.append(op)
+        return op
+
+    def put(self, op_type, index_name, id, document=None, wait=False):
+        """
+        Queue a "create", "index" or "delete" of `id`. With `wait`, flush right
+        away and return the error Elasticsearch reported for it, if any, as
+        `{"status", "error"}`.
+        """
+        self._ensure_started()
+        with self._lock:
+            op = self._append({"op": op_type, "index": index_name, "id": id, "document": document})
+            if wait:
+                waiter = self._waiters[op["seq"]] = {"event": threading.Event(), "result": None}
+        if wait:
+            self.flush()
+            waiter["event"].wait()
+            return waiter["result"]
+        if len(self._pending) >= self.max_batch:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.max_delay)
+            self._wake.clear()
+            if self._pending and (
+                len(self._pending) >= self.max_batch
+                or time.time() - self._pending[0]["queued_at"] >= self.max_delay
+            ):
+                try:
+                    self.flush()
+                except Exception as e:
+                    self.recent_errors.append({"error": str(e), "at": time.time()})
+
+    def flush(self):
+        """Write everything pending in this process to Elasticsearch and refresh the indices written to."""
+        self._ensure_started()
+        with self._flush_lock:
+            with self._lock:
+                ops = list(self._pending)
+            if not ops:
+                return
+
+            started = time.monotonic()
+            actions = []
+            for op in ops:
+                action = {"_op_type": op["op"], "_index": op["index"], "_id": op["id"]}
+                if op["op"] != "delete":
+                    action["_source"] = op["document"]
+                actions.append(action)
+
+            results = []
+            try:
+                for ok, item in helpers.streaming_bulk(client, actions, raise_on_error=False):
+                    item = next(iter(item.values()))
+                    results.append(None if ok else {"status": item.get("status"), "error": item.get("error")})
+            except Exception:
+                # A connection error in a later chunk: the writes of the chunks Elasticsearch
+                # answered are done, only the rest stay pending for the next flush
+                if results:
+                    self._finish(ops[: len(results)], results, started)
+                raise
+            self._finish(ops, results, started, refresh=self.refresh != "false")
+
+    def _finish(self, ops, results, started, refresh=False):
+        with self._lock:
+            for _ in ops:
+                self._pending.popleft()
+            self._rewrite_journal()
+
+        # The writes are done whether or not the refresh succeeds, a failed one
+        # only delays when searches see them until the next refresh
+        if refresh:
+            try:
+                client.indices.refresh(index=sorted({op["index"] for op in ops}))
+            except Exception as e:
+                self.refresh_failed += 1
+                self.recent_errors.append({"error": f"Refresh failed: {e}", "at": time.time()})
+
+        with self._lock:
+            for op, result in zip(ops, results):
+                if result is not None:
+                    self.failed += 1
+                    self.recent_errors.append(
+                        {"op": op["op"], "index": op["index"], "id": op["id"], **result}
+                    )
+                waiter = self._waiters.pop(op["seq"], None)
+                if waiter is not None:
+                    waiter["result"] = result
+                    waiter["event"].set()
+
+        elapsed = time.monotonic() - started
+        self.flushes += 1
+        self.flushed += len(ops)
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+        succeeded = [op for op, result in zip(ops, results) if result is None]
+        for callback in self.on_flush:
+            callback(succeeded)
+
+    def _rewrite_journal(self):
+        # Only the writes still pending, swapped in whole so that a crash leaves either journal intact
+        self._journal.close()
+        temp = self._path(self._name, "ndjson.tmp")
+        with open(temp, "w") as f:
+            f.writelines(json.dumps(op) + "\n" for op in self._pending)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.journal_path)
+        directory = os.open(self.journal_dir, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self._journal = open(self.journal_path, "a")
+
+    def stats(self):
+        with self._lock:
+            oldest = self._pending[0]["queued_at"] if self._pending else None
+        return {
+            "depth": len(self._pending),
+            "oldest_pending_seconds": time.time() - oldest if oldest else 0.0,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "refresh_failed": self.refresh_failed,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "recent_errors": list(self.recent_errors),
+        }
+
+
+WRITE_BEHIND = os.getenv("WRITE_MODE", "direct") == "write_behind"
+
+write_queue = WriteBehindQueue(
+    journal_dir=os.getenv("WRITE_QUEUE_DIR", "write_queue"),
+    max_batch=int(os.getenv("WRITE_QUEUE_BATCH", 500)),
+    max_delay=float(os.getenv("WRITE_QUEUE_DELAY", 1.0)),
+    refresh=os.getenv("REFRESH_SETTING", "wait_for"),
+)